@@ -0,0 +1,354 @@
+#!/usr/bin/env python3
+"""
+Offline benchmark for the lookup pipeline in mcp-servers/.
+
+Starts the local upstream stubs (stub_upstreams.py), points the scripts at
+them through their endpoint environment variables and replays a realistic
+scan mix: Zipf-distributed repeat scans over a SKU catalogue, mixed barcode
+forms (UPC-A, EAN-13, dashed), unknown codes and mistyped check digits.
+
+Targets:
+  product-data   mcp_product_data.py as a long-running daemon (getProductDataByUPC)
+  upc-lookup     mcp_upc_lookup.py     } --mode spawn: one process per scan (today's n8n setup)
+  ebay           mcp_ebay.py           } --mode daemon: the matching tool on the product-data
+  amazon         mcp_amazon.py         }                server (lookupUPC / lookupEbay / ...)
+  normalizer     mcp_barcode_normalizer.py }
+
+Reports requests/s, p50/p95/p99 latency, CPU time and peak RSS per target and
+writes them to a JSON file (default benchmarks/results/) so runs can be
+compared across commits with --compare.
+
+  python3 benchmarks/run_benchmark.py --targets product-data,upc-lookup --requests 2000
+  python3 benchmarks/run_benchmark.py --compare benchmarks/results/<previous>.json
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from stub_upstreams import add_stub_arguments, build_config, start_stub_server, stub_env
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SERVERS_DIR = os.path.join(REPO_ROOT, "mcp-servers")
+
+SCRIPTS = {
+    "product-data": "mcp_product_data.py",
+    "upc-lookup": "mcp_upc_lookup.py",
+    "ebay": "mcp_ebay.py",
+    "amazon": "mcp_amazon.py",
+    "normalizer": "mcp_barcode_normalizer.py",
+}
+DAEMON_METHODS = {
+    "product-data": "getProductDataByUPC",
+    "upc-lookup": "lookupUPC",
+    "ebay": "lookupEbay",
+    "amazon": "lookupAmazon",
+    "normalizer": "normalizeBarcode",
+}
+
+
+# --- scan mix ---------------------------------------------------------------
+
+def _check_digit(body):
+    total = 3 * sum(map(int, body[::-2])) + sum(map(int, body[-2::-2]))
+    return str((10 - total % 10) % 10)
+
+
+def _random_upca(rng):
+    body = "0" + "".join(rng.choice("0123456789") for _ in range(10))
+    return body + _check_digit(body)
+
+
+def scan_mix(count, skus, zipf_s, unknown_ratio, invalid_ratio, seed):
+    """Barcodes as a scanner station would send them."""
+    rng = random.Random(seed)
+    catalogue = [_random_upca(rng) for _ in range(skus)]
+    cum_weights = []
+    total = 0.0
+    for rank in range(skus):
+        total += 1.0 / (rank + 1) ** zipf_s
+        cum_weights.append(total)
+
+    scans = []
+    for _ in range(count):
+        roll = rng.random()
+        if roll < unknown_ratio:
+            code = _random_upca(rng)
+        else:
+            code = rng.choices(catalogue, cum_weights=cum_weights)[0]
+        if rng.random() < invalid_ratio:
+            code = code[:-1] + str((int(code[-1]) + 1) % 10)
+        form = rng.random()
+        if form < 0.15:
+            code = "0" + code                                    # EAN-13
+        elif form < 0.25:
+            code = f"{code[0]}-{code[1:6]}-{code[6:11]}-{code[11]}"  # dashed label entry
+        scans.append(code)
+    return scans
+
+
+# --- measurement ------------------------------------------------------------
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return None
+    index = max(0, min(len(sorted_values) - 1, int(round(pct / 100.0 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+
+def _wait_rusage(proc):
+    """Reaps a child and returns its own rusage (CPU seconds, peak RSS in MB)."""
+    _, status, usage = os.wait4(proc.pid, 0)
+    proc.returncode = os.waitstatus_to_exitcode(status)
+    rss_mb = usage.ru_maxrss / (1024.0 * 1024.0 if sys.platform == "darwin" else 1024.0)
+    return usage.ru_utime + usage.ru_stime, rss_mb
+
+
+def summarize(target, mode, latencies_s, wall_s, errors, not_found, cpu_s, rss_mb, upstream_before, upstream_after,
+              rejected=0):
+    latencies_ms = sorted(l * 1000.0 for l in latencies_s)
+    completed = len(latencies_ms)
+    return {
+        "target": target,
+        "mode": mode,
+        "requests": completed,
+        "wall_s": round(wall_s, 3),
+        "rps": round(completed / wall_s, 2) if wall_s else None,
+        "latency_ms": {
+            "p50": round(percentile(latencies_ms, 50), 2) if completed else None,
+            "p95": round(percentile(latencies_ms, 95), 2) if completed else None,
+            "p99": round(percentile(latencies_ms, 99), 2) if completed else None,
+            "mean": round(sum(latencies_ms) / completed, 2) if completed else None,
+            "max": round(latencies_ms[-1], 2) if completed else None,
+        },
+        "errors": errors,
+        "rejected": rejected,
+        "not_found": not_found,
+        "cpu_s": round(cpu_s, 3),
+        "cpu_ms_per_request": round(cpu_s * 1000.0 / completed, 3) if completed else None,
+        "max_rss_mb": round(rss_mb, 1),
+        "upstream_requests": {name: upstream_after[name] - upstream_before[name] for name in upstream_after},
+    }
+
+
+def run_daemon(target, scans, env, concurrency, params, stub_config):
+    """Drives one long-running product-data server over stdin with `concurrency` requests outstanding."""
+    method = DAEMON_METHODS[target]
+    proc = subprocess.Popen(
+        [sys.executable, os.path.join(SERVERS_DIR, SCRIPTS["product-data"])],
+        stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+        env=env, text=True, bufsize=1,
+    )
+
+    def send(request_id, rpc_method, rpc_params):
+        line = json.dumps({"body": {"jsonrpc": "2.0", "id": request_id, "method": rpc_method, "params": rpc_params}})
+        proc.stdin.write(line + "\n")
+        proc.stdin.flush()
+
+    # Warm-up: startup is not part of the measurement.
+    send("warmup", "initialize", {})
+    proc.stdout.readline()
+
+    window = threading.Semaphore(concurrency)
+    sent_at = {}
+    latencies, counters = [], {"errors": 0, "rejected": 0, "not_found": 0}
+    upstream_before = dict(stub_config.requests)
+
+    def reader():
+        for line in proc.stdout:
+            received = time.perf_counter()
+            try:
+                response = json.loads(line)
+            except ValueError:
+                counters["errors"] += 1
+                continue
+            for item in response if isinstance(response, list) else [response]:
+                started = sent_at.pop(item.get("id"), None)
+                if started is None:
+                    continue
+                latencies.append(received - started)
+                result = item.get("result") or {}
+                if item.get("error") and item["error"].get("code") == 400:
+                    counters["rejected"] += 1  # e.g. the mix's mistyped check digits
+                elif item.get("error"):
+                    counters["errors"] += 1
+                elif result.get("success") is False or "(Not Found)" in str(result.get("title", "")):
+                    counters["not_found"] += 1
+                window.release()
+
+    reader_thread = threading.Thread(target=reader, daemon=True)
+    reader_thread.start()
+
+    started = time.perf_counter()
+    for index, code in enumerate(scans):
+        window.acquire()
+        rpc_params = dict(params)
+        rpc_params["barcode" if target == "normalizer" else "upc"] = code
+        sent_at[index] = time.perf_counter()
+        send(index, method, rpc_params)
+    while sent_at and reader_thread.is_alive():
+        time.sleep(0.001)
+    wall = time.perf_counter() - started
+
+    proc.stdin.close()
+    reader_thread.join(timeout=10)
+    cpu_s, rss_mb = _wait_rusage(proc)
+    return summarize(target, "daemon", latencies, wall, counters["errors"], counters["not_found"],
+                     cpu_s, rss_mb, upstream_before, dict(stub_config.requests), counters["rejected"])
+
+
+def run_spawn(target, scans, env, concurrency, stub_config):
+    """One interpreter per scan, the way n8n executeCommand nodes run the scripts today."""
+    script = os.path.join(SERVERS_DIR, SCRIPTS[target])
+    lock = threading.Lock()
+    latencies, counters = [], {"errors": 0, "not_found": 0, "cpu_s": 0.0, "rss_mb": 0.0}
+    upstream_before = dict(stub_config.requests)
+
+    def one(code):
+        payload = {"barcode": code} if target == "normalizer" else {"upc": code}
+        t0 = time.perf_counter()
+        proc = subprocess.Popen([sys.executable, script], stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                stderr=subprocess.DEVNULL, env=env, text=True)
+        proc.stdin.write(json.dumps(payload))
+        proc.stdin.close()
+        output = proc.stdout.read()
+        proc.stdout.close()
+        cpu_s, rss_mb = _wait_rusage(proc)
+        elapsed = time.perf_counter() - t0
+        with lock:
+            latencies.append(elapsed)
+            counters["cpu_s"] += cpu_s
+            counters["rss_mb"] = max(counters["rss_mb"], rss_mb)
+            if proc.returncode != 0:
+                counters["errors"] += 1
+            elif "(Not Found)" in output or "(Error)" in output or "No external data" in output:
+                counters["not_found"] += 1
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(one, scans))
+    wall = time.perf_counter() - started
+    return summarize(target, "spawn", latencies, wall, counters["errors"], counters["not_found"],
+                     counters["cpu_s"], counters["rss_mb"], upstream_before, dict(stub_config.requests))
+
+
+# --- reporting --------------------------------------------------------------
+
+def git_revision():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT,
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def print_table(results):
+    header = f"{'target':<14}{'mode':<8}{'req':>7}{'rps':>10}{'p50':>10}{'p95':>10}{'p99':>10}{'cpu ms/req':>12}{'rss MB':>9}{'err':>6}"
+    print(header)
+    print("-" * len(header))
+    for r in results:
+        lat = r["latency_ms"]
+        print(f"{r['target']:<14}{r['mode']:<8}{r['requests']:>7}{r['rps'] or 0:>10.1f}{lat['p50'] or 0:>10.1f}"
+              f"{lat['p95'] or 0:>10.1f}{lat['p99'] or 0:>10.1f}{r['cpu_ms_per_request'] or 0:>12.2f}"
+              f"{r['max_rss_mb']:>9.1f}{r['errors']:>6}")
+
+
+def print_comparison(results, previous_path):
+    with open(previous_path) as f:
+        previous = json.load(f)
+    before = {(r["target"], r["mode"]): r for r in previous["results"]}
+    print(f"\nCompared with {previous_path} (commit {previous['meta'].get('commit')}):")
+    for r in results:
+        old = before.get((r["target"], r["mode"]))
+        if not old:
+            continue
+
+        def delta(new, prev):
+            if not new or not prev:
+                return "   n/a"
+            return f"{(new - prev) / prev * 100:+6.1f}%"
+
+        print(f"  {r['target']:<14}{r['mode']:<8} rps {delta(r['rps'], old['rps'])}  "
+              f"p95 {delta(r['latency_ms']['p95'], old['latency_ms']['p95'])}  "
+              f"p99 {delta(r['latency_ms']['p99'], old['latency_ms']['p99'])}  "
+              f"cpu/req {delta(r['cpu_ms_per_request'], old['cpu_ms_per_request'])}  "
+              f"rss {delta(r['max_rss_mb'], old['max_rss_mb'])}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--targets", default="product-data,upc-lookup,ebay,amazon",
+                        help="Comma-separated: " + ", ".join(SCRIPTS))
+    parser.add_argument("--mode", choices=("spawn", "daemon"), default="spawn",
+                        help="How non-product-data targets run (product-data is always a daemon)")
+    parser.add_argument("--requests", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=8, help="Requests outstanding at once")
+    parser.add_argument("--skus", type=int, default=2000, help="Catalogue size for repeat scans")
+    parser.add_argument("--zipf", type=float, default=1.1, help="Zipf exponent of scan popularity")
+    parser.add_argument("--unknown-ratio", type=float, default=0.05)
+    parser.add_argument("--invalid-ratio", type=float, default=0.01)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--strategy", help="getProductDataByUPC strategy for product-data")
+    parser.add_argument("--warm-cache", action="store_true", help="Reuse one cache file across targets")
+    parser.add_argument("--output", help="Result file (default benchmarks/results/bench-<commit>-<time>.json)")
+    parser.add_argument("--compare", help="Earlier result file to diff against")
+    add_stub_arguments(parser)
+    args = parser.parse_args()
+
+    stub_config = build_config(args)
+    stub = start_stub_server(stub_config)
+    scans = scan_mix(args.requests, args.skus, args.zipf, args.unknown_ratio, args.invalid_ratio, args.seed)
+
+    results = []
+    with tempfile.TemporaryDirectory(prefix="mcp-bench-") as tmp:
+        for target in [t.strip() for t in args.targets.split(",") if t.strip()]:
+            if target not in SCRIPTS:
+                parser.error(f"unknown target {target}")
+            env = dict(os.environ, **stub_env(stub.server_port))
+            env["MCP_CACHE_PATH"] = os.path.join(tmp, "cache.sqlite3" if args.warm_cache else f"{target}.sqlite3")
+            env["PYTHONPATH"] = SERVERS_DIR + os.pathsep + env.get("PYTHONPATH", "")
+            # Let the daemon work on as many requests as the harness keeps outstanding.
+            env.setdefault("MCP_STDIO_CONCURRENCY", str(args.concurrency))
+            params = {"strategy": args.strategy} if args.strategy and target == "product-data" else {}
+            if target == "product-data" or args.mode == "daemon":
+                result = run_daemon(target, scans, env, args.concurrency, params, stub_config)
+            else:
+                result = run_spawn(target, scans, env, args.concurrency, stub_config)
+            results.append(result)
+    stub.shutdown()
+
+    print_table(results)
+    commit = git_revision()
+    report = {
+        "meta": {
+            "commit": commit,
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "args": vars(args),
+            "stub_profiles": stub_config.profiles,
+        },
+        "results": results,
+    }
+    output = args.output or os.path.join(REPO_ROOT, "benchmarks", "results",
+                                         f"bench-{commit}-{time.strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"\nWrote {output}")
+
+    if args.compare:
+        print_comparison(results, args.compare)
+
+
+if __name__ == "__main__":
+    main()
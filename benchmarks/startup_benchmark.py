@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+"""
+Cold-start benchmark for the entry points in mcp-servers/.
+
+n8n starts most scripts once per scan, so their start-up cost is paid on
+every request. For each target this measures, over --runs fresh interpreters:
+
+  import_ms          importing the script's module (interpreter start excluded)
+  first_response_ms  from spawning the script to its first output line, with
+                     the upstreams answered by zero-latency local stubs
+  python_ms          `python -c pass`, the floor both of the above sit on
+
+and lists which heavy modules (requests, ebaysdk, psycopg2, ...) the bare
+import pulled in. Medians are compared with a per-target budget; the exit
+status is 1 when any budget is exceeded, so CI can enforce them.
+
+  python3 benchmarks/startup_benchmark.py
+  python3 benchmarks/startup_benchmark.py --targets normalizer,product-data --runs 20
+  python3 benchmarks/startup_benchmark.py --no-credentials   # the skipped-lookup path
+  python3 benchmarks/startup_benchmark.py --budget product-data=first_response_ms:250
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from run_benchmark import REPO_ROOT, SCRIPTS, SERVERS_DIR, git_revision
+from stub_upstreams import UPSTREAMS, StubConfig, start_stub_server, stub_env
+
+HEAVY_MODULES = ("requests", "urllib3", "ebaysdk", "psycopg2", "sqlite3", "statistics", "argparse", "email.utils")
+
+# Medians in ms. Generous for slow CI machines; a lazy import turned eager
+# (requests alone is ~100 ms) still breaks them.
+DEFAULT_BUDGETS = {
+    "normalizer": {"import_ms": 15, "first_response_ms": 120},
+    "upc-lookup": {"import_ms": 40, "first_response_ms": 350},
+    "ebay": {"import_ms": 40, "first_response_ms": 400},
+    "amazon": {"import_ms": 40, "first_response_ms": 350},
+    "product-data": {"import_ms": 80, "first_response_ms": 400},
+}
+
+_IMPORT_PROBE = """
+import json, sys, time
+started = time.perf_counter()
+import {module}
+elapsed = (time.perf_counter() - started) * 1000
+print(json.dumps({{"import_ms": elapsed, "loaded": [m for m in {heavy!r} if m in sys.modules]}}))
+"""
+
+
+def first_request(target):
+    """The stdin payload a script gets for its first request."""
+    if target == "normalizer":
+        return json.dumps({"barcode": "012345678905", "qty": 1}) + "\n"
+    if target == "product-data":
+        return json.dumps({"body": {"jsonrpc": "2.0", "id": 1, "method": "getProductDataByUPC",
+                                    "params": {"upc": "012345678905"}}}) + "\n"
+    return json.dumps({"upc": "012345678905"}) + "\n"
+
+
+def measure_python(env):
+    started = time.perf_counter()
+    subprocess.run([sys.executable, "-c", "pass"], env=env, check=True)
+    return (time.perf_counter() - started) * 1000
+
+
+def measure_import(target, env):
+    module = os.path.splitext(SCRIPTS[target])[0]
+    probe = _IMPORT_PROBE.format(module=module, heavy=HEAVY_MODULES)
+    output = subprocess.run([sys.executable, "-c", probe], env=env, check=True,
+                            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def measure_first_response(target, env):
+    """Spawn to first stdout line. product-data keeps running, so it is closed afterwards."""
+    script = os.path.join(SERVERS_DIR, SCRIPTS[target])
+    started = time.perf_counter()
+    proc = subprocess.Popen([sys.executable, script], stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                            stderr=subprocess.DEVNULL, env=env, text=True)
+    proc.stdin.write(first_request(target))
+    proc.stdin.flush()
+    if target != "product-data":
+        proc.stdin.close()  # the one-shot scripts answer at EOF
+    line = proc.stdout.readline()
+    elapsed = (time.perf_counter() - started) * 1000
+    if not proc.stdin.closed:
+        proc.stdin.close()
+    proc.stdout.close()
+    proc.wait(timeout=30)
+    return elapsed, bool(line.strip())
+
+
+def parse_budget_overrides(values):
+    """--budget target=metric:ms, repeatable."""
+    budgets = {target: dict(limits) for target, limits in DEFAULT_BUDGETS.items()}
+    for value in values or []:
+        try:
+            target, rest = value.split("=", 1)
+            metric, limit = rest.split(":", 1)
+            budgets.setdefault(target, {})[metric] = float(limit)
+        except ValueError:
+            raise SystemExit(f"Invalid --budget {value!r}; expected target=metric:ms")
+    return budgets
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--targets", default=",".join(SCRIPTS), help="Comma-separated: " + ", ".join(SCRIPTS))
+    parser.add_argument("--runs", type=int, default=10, help="Fresh interpreters per measurement")
+    parser.add_argument("--no-credentials", action="store_true",
+                        help="Leave the marketplace credentials unset, so their lookups are skipped")
+    parser.add_argument("--budget", action="append", metavar="TARGET=METRIC:MS",
+                        help="Override a budget, e.g. product-data=import_ms:60")
+    parser.add_argument("--output", help="Result file (default benchmarks/results/startup-<commit>-<time>.json)")
+    args = parser.parse_args()
+    budgets = parse_budget_overrides(args.budget)
+
+    # Zero-latency stubs, so first_response_ms is start-up plus our own work.
+    stub_config = StubConfig({name: {"latency_ms": 0.0, "latency_sigma": 0.0} for name in UPSTREAMS})
+    stub = start_stub_server(stub_config)
+    env = dict(os.environ, **stub_env(stub.server_port))
+    if args.no_credentials:
+        for name in ("EBAY_APP_ID", "AMAZON_CLIENT_ID", "AMAZON_CLIENT_SECRET", "AMAZON_REFRESH_TOKEN"):
+            env.pop(name, None)
+    env["PYTHONPATH"] = SERVERS_DIR + os.pathsep + env.get("PYTHONPATH", "")
+    env["MCP_CACHE_DISABLED"] = "1"  # every run starts cold
+    env["MCP_STDIO_CONCURRENCY"] = "1"
+
+    # Compile once up front so no run pays for writing bytecode.
+    subprocess.run([sys.executable, "-m", "compileall", "-q", SERVERS_DIR], check=True)
+    python_ms = statistics.median(measure_python(env) for _ in range(args.runs))
+
+    results, over_budget = [], []
+    for target in [t.strip() for t in args.targets.split(",") if t.strip()]:
+        if target not in SCRIPTS:
+            parser.error(f"unknown target {target}")
+        imports = [measure_import(target, env) for _ in range(args.runs)]
+        responses = [measure_first_response(target, env) for _ in range(args.runs)]
+        result = {
+            "target": target,
+            "import_ms": round(statistics.median(run["import_ms"] for run in imports), 1),
+            "first_response_ms": round(statistics.median(elapsed for elapsed, _ in responses), 1),
+            "failed_runs": sum(1 for _, answered in responses if not answered),
+            "heavy_modules": imports[-1]["loaded"],
+            "budget": budgets.get(target, {}),
+        }
+        result["over_budget"] = [metric for metric, limit in result["budget"].items()
+                                 if result.get(metric) is not None and result[metric] > limit]
+        if result["over_budget"] or result["failed_runs"]:
+            over_budget.append(target)
+        results.append(result)
+    stub.shutdown()
+
+    header = f"{'target':<14}{'import ms':>11}{'budget':>8}{'1st resp ms':>13}{'budget':>8}  heavy modules at import"
+    print(f"python -c pass: {python_ms:.1f} ms (median of {args.runs})\n")
+    print(header)
+    print("-" * len(header))
+    for r in results:
+        budget = r["budget"]
+        flag = "  OVER BUDGET" if r["over_budget"] else ("  NO RESPONSE" if r["failed_runs"] else "")
+        print(f"{r['target']:<14}{r['import_ms']:>11.1f}{budget.get('import_ms', 0):>8.0f}"
+              f"{r['first_response_ms']:>13.1f}{budget.get('first_response_ms', 0):>8.0f}  "
+              f"{', '.join(r['heavy_modules']) or '-'}{flag}")
+
+    commit = git_revision()
+    report = {
+        "meta": {
+            "commit": commit,
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "args": vars(args),
+            "python_ms": round(python_ms, 1),
+        },
+        "results": results,
+    }
+    output = args.output or os.path.join(REPO_ROOT, "benchmarks", "results",
+                                         f"startup-{commit}-{time.strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"\nWrote {output}")
+    return 1 if over_budget else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
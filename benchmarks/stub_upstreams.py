@@ -0,0 +1,261 @@
+#!/usr/bin/env python3
+"""
+Local stand-ins for the upstream APIs used by mcp-servers/, for offline
+benchmarking. One HTTP server answers all of them, routed by path:
+
+  GET  /prod/trial/lookup?upc=...          upcitemdb.com
+  GET  /product/<upc>, /v1/product/<upc>   upcdatabase.org (both API shapes)
+  POST /services/search/FindingService/v1  eBay Finding API (XML)
+  POST /auth/o2/token                      Amazon LWA token exchange
+  GET  /catalog/<version>/items            SP-API catalog search
+
+Each upstream has its own latency (lognormal around a median), error rate
+and hit ratio. Hits are decided by a hash of the barcode, so repeat scans of
+one code always get the same answer.
+
+  python3 benchmarks/stub_upstreams.py --port 8089 --latency-ms 80 --error-rate 0.02
+  python3 benchmarks/stub_upstreams.py --config stubs.json
+"""
+import argparse
+import hashlib
+import json
+import math
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+UPSTREAMS = ("upcitemdb", "upcdatabase", "ebay", "amazon")
+
+DEFAULT_PROFILE = {
+    "latency_ms": 80.0,   # median latency
+    "latency_sigma": 0.5, # lognormal spread; 0 gives a fixed latency
+    "error_rate": 0.0,    # share of requests answered with a 5xx/429
+    "hit_ratio": 0.8,     # share of barcodes the upstream knows
+}
+
+
+class StubConfig:
+    def __init__(self, profiles=None):
+        self.profiles = {name: dict(DEFAULT_PROFILE) for name in UPSTREAMS}
+        for name, profile in (profiles or {}).items():
+            self.profiles[name].update(profile)
+        self.requests = {name: 0 for name in UPSTREAMS}
+        self._lock = threading.Lock()
+
+    def count(self, upstream):
+        with self._lock:
+            self.requests[upstream] += 1
+
+    def latency_s(self, upstream):
+        profile = self.profiles[upstream]
+        median = profile["latency_ms"] / 1000.0
+        sigma = profile["latency_sigma"]
+        return median * math.exp(random.gauss(0, sigma)) if sigma else median
+
+    def is_error(self, upstream):
+        return random.random() < self.profiles[upstream]["error_rate"]
+
+    def is_hit(self, upstream, code):
+        digest = hashlib.blake2b(f"{upstream}:{code}".encode(), digest_size=8).digest()
+        return int.from_bytes(digest, "big") / 2 ** 64 < self.profiles[upstream]["hit_ratio"]
+
+
+def _price(code):
+    return round(5 + int(hashlib.md5(code.encode()).hexdigest()[:4], 16) % 9500 / 100.0, 2)
+
+
+def upcitemdb_payload(code, hit):
+    if not hit:
+        return {"code": "OK", "total": 0, "offset": 0, "items": []}
+    price = _price(code)
+    return {"code": "OK", "total": 1, "offset": 0, "items": [{
+        "ean": code.zfill(13), "title": f"Stub Product {code}", "description": "Stub description " * 8,
+        "upc": code, "brand": "StubBrand", "model": f"M-{code[-4:]}", "category": "Stub > Category",
+        "images": [f"https://img.example.com/{code}/{i}.jpg" for i in range(3)],
+        "lowest_recorded_price": price, "highest_recorded_price": round(price * 1.6, 2),
+        "offers": [{"merchant": f"Shop {i}", "price": round(price * (1 + i / 10.0), 2), "currency": "USD"}
+                   for i in range(5)],
+    }]}
+
+
+def upcdatabase_payload(code, hit):
+    if not hit:
+        return {"success": False, "error": {"code": 404, "message": "No product found"}}
+    item = {"title": f"Stub Product {code}", "description": "Stub description", "avg_price": _price(code),
+            "images": [f"https://img.example.com/{code}/db.jpg"]}
+    # Union of the /product/ (flat) and /v1/product/ (nested "item") shapes.
+    return {"success": True, "barcode": code, "upc": code, "item_name": item["title"],
+            "description": item["description"], "brand": "StubBrand", "category": "Stub",
+            "image": item["images"][0], "price": item["avg_price"], "currency": "USD", "item": item}
+
+
+def ebay_payload(code, hit):
+    items = ""
+    if hit:
+        price = _price(code)
+        items = "".join(
+            f"<item><itemId>{i}{code}</itemId><title>Stub eBay {code} #{i}</title>"
+            f"<subtitle>Stub subtitle</subtitle><galleryURL>https://img.example.com/{code}/g{i}.jpg</galleryURL>"
+            f"<pictureURLSuperSize>https://img.example.com/{code}/s{i}.jpg</pictureURLSuperSize>"
+            f"<sellingStatus><currentPrice currencyId=\"USD\">{price + i}</currentPrice></sellingStatus></item>"
+            for i in range(3)
+        )
+    count = 3 if hit else 0
+    return (
+        "<?xml version='1.0' encoding='UTF-8'?>"
+        "<findItemsByProductResponse xmlns=\"http://www.ebay.com/marketplace/search/v1/services\">"
+        f"<ack>Success</ack><version>1.13.0</version><timestamp>2024-01-01T00:00:00.000Z</timestamp>"
+        f"<searchResult count=\"{count}\">{items}</searchResult>"
+        "</findItemsByProductResponse>"
+    )
+
+
+def amazon_catalog_payload(codes, config):
+    items = []
+    for code in codes:
+        if not config.is_hit("amazon", code):
+            continue
+        items.append({
+            "asin": "B0" + hashlib.md5(code.encode()).hexdigest()[:8].upper(),
+            "identifiers": [{"marketplaceId": "ATVPDKIKX0DER",
+                             "identifiers": [{"identifierType": "UPC", "identifier": code}]}],
+            "summaries": [{"marketplaceId": "ATVPDKIKX0DER", "itemName": f"Stub Amazon {code}",
+                           "item_name": f"Stub Amazon {code}", "brand": "StubBrand"}],
+            "images": [{"marketplaceId": "ATVPDKIKX0DER",
+                        "images": [{"variant": "MAIN", "link": f"https://img.example.com/{code}/a.jpg"}],
+                        "link": f"https://img.example.com/{code}/a.jpg"}],
+        })
+    return {"numberOfResults": len(items), "items": items}
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Headers and body go out in separate writes; without TCP_NODELAY Nagle
+    # plus delayed ACKs would add ~40 ms to every stub response.
+    disable_nagle_algorithm = True
+    config: StubConfig = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status, body, content_type="application/json", headers=None):
+        data = body.encode() if isinstance(body, str) else json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _serve(self, upstream, respond):
+        self.config.count(upstream)
+        time.sleep(self.config.latency_s(upstream))
+        if self.config.is_error(upstream):
+            if random.random() < 0.5:
+                self._send(429, {"error": "rate limited"}, headers={"Retry-After": "0"})
+            else:
+                self._send(503, {"error": "unavailable"})
+            return
+        respond()
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        if url.path.endswith("/lookup"):
+            code = query.get("upc", [""])[0]
+            self._serve("upcitemdb", lambda: self._send(
+                200, upcitemdb_payload(code, self.config.is_hit("upcitemdb", code))))
+        elif re.search(r"/product/[^/]+$", url.path):
+            code = url.path.rsplit("/", 1)[1]
+            hit = self.config.is_hit("upcdatabase", code)
+            self._serve("upcdatabase", lambda: self._send(200 if hit else 404, upcdatabase_payload(code, hit)))
+        elif url.path.startswith("/catalog/"):
+            codes = [c for c in ",".join(query.get("identifiers", [])).split(",") if c]
+            self._serve("amazon", lambda: self._send(200, amazon_catalog_payload(codes, self.config)))
+        else:
+            self._send(404, {"error": f"unknown stub path {url.path}"})
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length).decode("utf-8", "replace") if length else ""
+        url = urlparse(self.path)
+        if url.path.startswith("/services/search/FindingService"):
+            match = re.search(r"<productId[^>]*>([^<]+)</productId>", body)
+            code = match.group(1) if match else ""
+            self._serve("ebay", lambda: self._send(
+                200, ebay_payload(code, self.config.is_hit("ebay", code)), "text/xml"))
+        elif url.path == "/auth/o2/token":
+            self._send(200, {"access_token": "Atza|stub-token", "token_type": "bearer",
+                             "expires_in": 3600, "refresh_token": "Atzr|stub"})
+        else:
+            self._send(404, {"error": f"unknown stub path {url.path}"})
+
+
+def start_stub_server(config: StubConfig, host="127.0.0.1", port=0):
+    """Starts the stubs on a daemon thread; returns the server (server.server_port has the port)."""
+    handler = type("BoundStubHandler", (StubHandler,), {"config": config})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="stub-upstreams", daemon=True).start()
+    return server
+
+
+def stub_env(port, host="127.0.0.1"):
+    """Environment that points every mcp-servers/ script at the stubs."""
+    base = f"http://{host}:{port}"
+    return {
+        "UPC_ITEMDB_LOOKUP_URL": f"{base}/prod/trial/lookup",
+        "UPC_DATABASE_PRODUCT_URL": f"{base}/product/",
+        "UPC_DATABASE_API_KEY": "stub",
+        "EBAY_APP_ID": "stub",
+        "EBAY_FINDING_DOMAIN": f"{host}:{port}",
+        "EBAY_FINDING_HTTPS": "0",
+        "AMAZON_CLIENT_ID": "stub",
+        "AMAZON_CLIENT_SECRET": "stub",
+        "AMAZON_REFRESH_TOKEN": "stub",
+        "AMAZON_SP_API_ENDPOINT": base,
+        "AMAZON_LWA_ENDPOINT": f"{base}/auth/o2/token",
+    }
+
+
+def build_config(args) -> StubConfig:
+    profiles = {}
+    if args.config:
+        with open(args.config) as f:
+            profiles = json.load(f)
+    base = {"latency_ms": args.latency_ms, "latency_sigma": args.latency_sigma,
+            "error_rate": args.error_rate, "hit_ratio": args.hit_ratio}
+    return StubConfig({name: dict(base, **profiles.get(name, {})) for name in UPSTREAMS})
+
+
+def add_stub_arguments(parser):
+    parser.add_argument("--latency-ms", type=float, default=DEFAULT_PROFILE["latency_ms"])
+    parser.add_argument("--latency-sigma", type=float, default=DEFAULT_PROFILE["latency_sigma"])
+    parser.add_argument("--error-rate", type=float, default=DEFAULT_PROFILE["error_rate"])
+    parser.add_argument("--hit-ratio", type=float, default=DEFAULT_PROFILE["hit_ratio"])
+    parser.add_argument("--config", help="JSON file with per-upstream overrides, e.g. "
+                                         "{\"upcdatabase\": {\"latency_ms\": 400, \"error_rate\": 0.1}}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8089)
+    add_stub_arguments(parser)
+    args = parser.parse_args()
+
+    server = start_stub_server(build_config(args), args.host, args.port)
+    print(json.dumps(stub_env(server.server_port, args.host), indent=2))
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
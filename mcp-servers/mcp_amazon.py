@@ -1,92 +1,284 @@
 #!/usr/bin/env python3
 import json, sys
 import os
-from sp_api.api import Catalog
-from sp_api.base import Marketplaces
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, List, Optional
 
-payload = json.loads(sys.stdin.read())
-upc = payload.get("upc", "")
+from mcp_projection import parse_output_options, shape_output, wants_raw
+from mcp_record import ProductRecord
+from mcp_transport import TokenBucket, get_transport
 
-AMAZON_CLIENT_ID = os.environ.get("AMAZON_CLIENT_ID")
-AMAZON_CLIENT_SECRET = os.environ.get("AMAZON_CLIENT_SECRET")
-AMAZON_REFRESH_TOKEN = os.environ.get("AMAZON_REFRESH_TOKEN")
-AMAZON_REGION = os.environ.get("AMAZON_REGION", "us-east-1") 
+# Catalog Items API 2022-04-01. searchCatalogItems accepts up to 20
+# identifiers per call and is rate limited to 2 requests/s, burst 2.
+CATALOG_ITEMS_PATH = "/catalog/2022-04-01/items"
+MAX_IDENTIFIERS_PER_CALL = 20
 
-MARKETPLACE_MAP = {
-    "us-east-1": Marketplaces.US,
-    "eu-west-1": Marketplaces.DE, 
-}
-marketplace = MARKETPLACE_MAP.get(AMAZON_REGION, Marketplaces.US)
-
-result = {
-    "title": f"Amazon listing {upc} (Not Found)",
-    "description": "Amazon data not found.",
-    "price": 0.00,
-    "images": [],
-    "raw_data": {}
+LWA_TOKEN_URL = "https://api.amazon.com/auth/o2/token"
+
+# AMAZON_REGION -> (SP-API endpoint, marketplace id)
+REGIONS = {
+    "us-east-1": ("https://sellingpartnerapi-na.amazon.com", "ATVPDKIKX0DER"),  # US
+    "eu-west-1": ("https://sellingpartnerapi-eu.amazon.com", "A1PA6795UKMFR9"),  # DE
+    "us-west-2": ("https://sellingpartnerapi-fe.amazon.com", "A1VC38T7YXB528"),  # JP
 }
 
-if not all([AMAZON_CLIENT_ID, AMAZON_CLIENT_SECRET, AMAZON_REFRESH_TOKEN]):
-    sys.stderr.write("Amazon SP-API credentials missing. Skipping Amazon lookup.\n")
-elif not Catalog:
-    sys.stderr.write("python-amazon-sp-api Catalog client not available. Skipping Amazon lookup.\n")
-else:
-    try:
-        credentials = {
-            'lwa_app_id': AMAZON_CLIENT_ID,
-            'lwa_client_secret': AMAZON_CLIENT_SECRET,
-            'refresh_token': AMAZON_REFRESH_TOKEN
+# Catalog clients are cached per credential set so a long-running server keeps
+# its access token and batcher between lookups.
+_client_cache = {}
+_client_lock = threading.Lock()
+
+def _not_found(upc):
+    return {
+        "title": f"Amazon listing {upc} (Not Found)",
+        "description": "Amazon data not found.",
+        "price": 0.00,
+        "images": [],
+        "raw_data": {}
+    }
+
+def _error(upc, e):
+    return {
+        "title": f"Amazon listing {upc} (Error)",
+        "description": f"Amazon API call failed: {e}",
+        "price": 0.00,
+        "images": [],
+        "raw_data": {}
+    }
+
+
+class LWAToken:
+    """Login with Amazon access token, exchanged once and reused until shortly before it expires."""
+
+    def __init__(self, client_id, client_secret, refresh_token, token_url=LWA_TOKEN_URL, margin_s=60.0):
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self.refresh_token = refresh_token
+        self.token_url = token_url
+        self.margin_s = margin_s
+        self.exchanges = 0
+        self._token = None
+        self._expires_at = 0.0
+        self._lock = threading.Lock()
+
+    def get(self) -> str:
+        with self._lock:
+            if self._token is None or time.monotonic() >= self._expires_at:
+                response = get_transport().request("POST", self.token_url, data={
+                    "grant_type": "refresh_token",
+                    "refresh_token": self.refresh_token,
+                    "client_id": self.client_id,
+                    "client_secret": self.client_secret,
+                })
+                response.raise_for_status()
+                payload = response.json()
+                self._token = payload["access_token"]
+                self._expires_at = time.monotonic() + float(payload.get("expires_in", 3600)) - self.margin_s
+                self.exchanges += 1
+            return self._token
+
+    def invalidate(self) -> None:
+        with self._lock:
+            self._token = None
+
+
+class AmazonCatalogClient:
+    """
+    Long-lived Catalog Items client. Lookups queued within batch_window_ms of
+    each other go out as one searchCatalogItems call with up to 20 UPCs,
+    paced by a token bucket at the SP-API rate limit; every caller gets back
+    only the item for its own UPC.
+    """
+
+    def __init__(self, client_id, client_secret, refresh_token, region="us-east-1",
+                 endpoint=None, token_url=None, batch_window_ms=25.0, max_batch=MAX_IDENTIFIERS_PER_CALL,
+                 rate_per_s=2.0, burst=2.0, max_in_flight=2):
+        if rate_per_s <= 0:
+            # The dispatcher waits for each call's token without a timeout.
+            raise ValueError(f"Amazon catalog rate must be positive, got {rate_per_s}")
+        default_endpoint, self.marketplace_id = REGIONS.get(region, REGIONS["us-east-1"])
+        self.endpoint = (endpoint or default_endpoint).rstrip("/")
+        self.token = LWAToken(client_id, client_secret, refresh_token, token_url or LWA_TOKEN_URL)
+        self.batch_window_s = batch_window_ms / 1000.0
+        self.max_batch = max(1, min(max_batch, MAX_IDENTIFIERS_PER_CALL))
+        self.rate_limit = TokenBucket(rate_per_s, burst)
+        self.lookups = 0
+        self.calls = 0
+
+        # upc -> futures of every caller waiting on it, in arrival order
+        self._queue: Dict[str, List[Future]] = {}
+        self._queued = threading.Condition()
+        self._executor = ThreadPoolExecutor(max_workers=max_in_flight, thread_name_prefix="amazon-catalog")
+        self._dispatcher = threading.Thread(target=self._dispatch_loop, name="amazon-batcher", daemon=True)
+        self._dispatcher.start()
+
+    def lookup(self, upc: str, timeout_s: float = 30.0) -> Optional[dict]:
+        """The catalog item for one UPC, or None when Amazon has none."""
+        future = Future()
+        with self._queued:
+            self._queue.setdefault(upc, []).append(future)
+            self.lookups += 1
+            self._queued.notify()
+        return future.result(timeout=timeout_s)
+
+    def _dispatch_loop(self) -> None:
+        while True:
+            with self._queued:
+                while not self._queue:
+                    self._queued.wait()
+                # Hold the first lookup for the window so others can join it.
+                window_ends = time.monotonic() + self.batch_window_s
+                while len(self._queue) < self.max_batch:
+                    remaining = window_ends - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._queued.wait(remaining)
+                batch = {upc: self._queue.pop(upc) for upc in list(self._queue)[:self.max_batch]}
+            try:
+                # Lookups keep queueing while this waits, so batches grow under load.
+                self.rate_limit.acquire(float("inf"))
+                self._executor.submit(self._run_batch, batch)
+            except Exception as e:
+                # Fail this batch's callers; the dispatcher must keep running for the rest.
+                self._fail(batch, e)
+
+    @staticmethod
+    def _fail(batch: Dict[str, List[Future]], error: BaseException) -> None:
+        for futures in batch.values():
+            for future in futures:
+                future.set_exception(error)
+
+    def _run_batch(self, batch: Dict[str, List[Future]]) -> None:
+        try:
+            items = self.search(list(batch))
+        except Exception as e:
+            self._fail(batch, e)
+            return
+        for upc, futures in batch.items():
+            for future in futures:
+                future.set_result(items.get(upc))
+
+    def search(self, upcs: List[str]) -> Dict[str, dict]:
+        """One searchCatalogItems call; returns the first matching item per requested UPC."""
+        params = {
+            "identifiers": ",".join(upcs),
+            "identifiersType": "UPC",
+            "marketplaceIds": self.marketplace_id,
+            "includedData": "summaries,images,identifiers",
+            "pageSize": MAX_IDENTIFIERS_PER_CALL,
         }
-        catalog_client = Catalog(credentials=credentials, marketplace=marketplace)
-
-        response = catalog_client.search_catalog_items(
-            item_locale='en_US', 
-            identifiers=[upc],
-            identifiers_type='UPC', 
-            marketplace_ids=[marketplace.marketplace_id]
-        )
-
-        result["raw_data"] = response.payload
-
-        if response.payload and response.payload.get('items'):
-            item = response.payload['items'][0]
-            summaries = item.get('summaries', [])
-            images = item.get('images', [])
-            offers = item.get('offers', [])
-
-            if summaries:
-                summary = summaries[0]
-                result['title'] = summary.get('item_name')
-                result['description'] = summary.get('brand') 
-
-            if images:
-                result['images'] = [img.get('link') for img in images if img.get('link')]
-
-            if offers:
-                min_price = float('inf')
-                for offer in offers:
-                    if offer.get('offers'):
-                        for offer_detail in offer['offers']:
-                            price_details = offer_detail.get('price')
-                            if price_details and price_details.get('amount') is not None:
-                                current_price = price_details['amount']
-                                if current_price < min_price:
-                                    min_price = current_price
-                if min_price != float('inf'):
-                    result['price'] = min_price
-                else:
-                    result['price'] = 0.00 
-            else:
-                result['price'] = 0.00 
+        for attempt in range(2):
+            response = get_transport().get(f"{self.endpoint}{CATALOG_ITEMS_PATH}", params=params,
+                                           headers={"x-amz-access-token": self.token.get()})
+            self.calls += 1
+            if response.status_code in (401, 403) and attempt == 0:
+                # Token revoked or expired early: exchange again, once.
+                self.token.invalidate()
+                continue
+            response.raise_for_status()
+            break
+
+        # Amazon may return identifiers zero-padded (GTIN-14), so match without leading zeros.
+        wanted = {upc.lstrip("0"): upc for upc in upcs}
+        items = {}
+        for item in response.json().get("items", []):
+            for group in item.get("identifiers", []):
+                for identifier in group.get("identifiers", []):
+                    upc = wanted.get(str(identifier.get("identifier", "")).lstrip("0"))
+                    if upc is not None and upc not in items:
+                        items[upc] = item
+        return items
+
+    def stats(self) -> Dict[str, int]:
+        return {"lookups": self.lookups, "calls": self.calls, "token_exchanges": self.token.exchanges}
+
+
+def _get_catalog_client(client_id, client_secret, refresh_token, region):
+    key = (client_id, refresh_token, region)
+    with _client_lock:
+        client = _client_cache.get(key)
+        if client is None:
+            client = AmazonCatalogClient(
+                client_id, client_secret, refresh_token, region,
+                # Endpoint overrides, e.g. for the local stubs in benchmarks/
+                endpoint=os.environ.get("AMAZON_SP_API_ENDPOINT"),
+                token_url=os.environ.get("AMAZON_LWA_ENDPOINT"),
+                batch_window_ms=float(os.environ.get("AMAZON_BATCH_WINDOW_MS", 25)),
+                rate_per_s=float(os.environ.get("AMAZON_CATALOG_RATE_PER_S", 2)),
+                burst=float(os.environ.get("AMAZON_CATALOG_BURST", 2)),
+            )
+            _client_cache[key] = client
+        return client
+
+def _image_links(item):
+    """Image links from the 2022-04-01 shape (grouped per marketplace) or a flat list of images."""
+    links = []
+    for group in item.get('images', []):
+        for image in group.get('images') or [group]:
+            link = image.get('link')
+            if link and link not in links:
+                links.append(link)
+    return links
+
+def fetch_amazon(upc):
+    """
+    (ProductRecord or None, catalog item or None) for a UPC. Raises on API
+    errors; (None, None) when the SP-API credentials are missing.
+    """
+    AMAZON_CLIENT_ID = os.environ.get("AMAZON_CLIENT_ID")
+    AMAZON_CLIENT_SECRET = os.environ.get("AMAZON_CLIENT_SECRET")
+    AMAZON_REFRESH_TOKEN = os.environ.get("AMAZON_REFRESH_TOKEN")
+    AMAZON_REGION = os.environ.get("AMAZON_REGION", "us-east-1")
 
+    if not all([AMAZON_CLIENT_ID, AMAZON_CLIENT_SECRET, AMAZON_REFRESH_TOKEN]):
+        sys.stderr.write("Amazon SP-API credentials missing. Skipping Amazon lookup.\n")
+        return None, None
+
+    catalog_client = _get_catalog_client(
+        AMAZON_CLIENT_ID, AMAZON_CLIENT_SECRET, AMAZON_REFRESH_TOKEN, AMAZON_REGION
+    )
+    item = catalog_client.lookup(upc)
+    summaries = item.get('summaries', []) if item else []
+    title = summaries and (summaries[0].get('itemName') or summaries[0].get('item_name'))
+    if not title:
+        return None, item
+
+    brand = summaries[0].get('brand')
+    # The catalog carries no offers; price stays empty for the merge to fill in.
+    record = ProductRecord(
+        upc=upc,
+        source_used="amazon.com",
+        product_name=title,
+        description=brand,
+        brand=brand,
+        images_urls=_image_links(item),
+    )
+    return record, item
+
+def lookup_amazon(upc, include_raw=True):
+    try:
+        record, item = fetch_amazon(upc)
     except Exception as e:
         sys.stderr.write(f"Amazon SP-API Error for UPC {upc}: {e}\n")
-        result = {
-            "title": f"Amazon listing {upc} (Error)",
-            "description": f"Amazon API call failed: {e}",
-            "price": 0.00,
-            "images": [],
-            "raw_data": {}
-        }
+        return _error(upc, e)
+
+    raw_data = item if include_raw and item else {}
+    if record is None:
+        result = _not_found(upc)
+        result["raw_data"] = raw_data
+        return result
+    result = record.listing(raw_data)
+    result['asin'] = item.get('asin')
+    return result
+
+def main():
+    payload = json.loads(sys.stdin.read())
+    try:
+        options = parse_output_options(payload)
+    except ValueError as e:
+        sys.exit(f"Invalid output options: {e}")
+    print(json.dumps(shape_output(lookup_amazon(payload.get("upc", ""), include_raw=wants_raw(options)), options)))
 
-print(json.dumps(result))
\ No newline at end of file
+if __name__ == "__main__":
+    main()
@@ -2,34 +2,106 @@
 """
 Normalize barcode and infer type.
 stdin:  {"barcode": "...", "qty": 1}
-stdout: {"barcode": "012345678905", "type": "UPC", "qty": 1}
+stdout: {"barcode": "012345678905", "type": "UPC", "qty": 1, "symbology": "UPC-A",
+         "valid": true, "gtin14": "00012345678905", "forms": {...},
+         "lookup_form": "012345678905"}
+
+lookup_form is the code products.barcode is stored under by the inventory
+incrementer and the bulk importer (UPC-A, else EAN-13, else GTIN-14), so
+every form of one product finds the same row.
+
+Batch:  {"barcodes": ["...", ...]}  ->  {"results": [...]}
+Stream: --stream reads NDJSON (or one raw barcode per line) and writes one
+        NDJSON result per line, in input order; bad lines produce
+        {"input": ..., "error": ...}. --workers N spreads the work over N
+        processes for bulk imports.
 """
-import json, sys, re
+import json, sys
+
+from mcp_gtin import canonicalize, lookup_form
+
+def normalize_barcode(barcode, qty=1):
+    qty = int(qty)
+    info = canonicalize(barcode)
+    clean = info["barcode"]
+
+    barcode_type = (
+        "UPC"   if len(clean) == 12 else
+        "EAN"   if len(clean) == 13 else
+        "ASIN"  if clean.startswith("B0") and len(clean) == 10 else
+        "ISBN"  if (len(clean) == 10 and clean[:9].isdigit()) or (len(clean) == 13 and clean.isdigit()) else
+        "GTIN"  if len(clean) in [14] else
+        "UNKNOWN"
+    )
+
+    result = {"barcode": clean, "type": barcode_type, "qty": qty}
+    result.update(info)
+    result["lookup_form"] = lookup_form(info)
+    return result
+
+def _normalize_line(line):
+    if line.startswith("{"):
+        data = json.loads(line)
+        return normalize_barcode(data.get("barcode", ""), data.get("qty", 1))
+    return normalize_barcode(line)
+
+def _normalize_chunk(lines):
+    dumps = json.dumps
+    out = []
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            out.append(dumps(_normalize_line(line)))
+        except Exception as e:
+            out.append(dumps({"input": line, "error": str(e)}))
+    return "\n".join(out) + "\n" if out else ""
+
+def _chunks(infile, size):
+    chunk = []
+    for line in infile:
+        chunk.append(line)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def stream(infile, outfile, workers=1, chunk_size=2000):
+    """NDJSON in, NDJSON out; lines are handled and written in chunks to keep per-line overhead low."""
+    if workers > 1:
+        import multiprocessing
+        with multiprocessing.Pool(workers) as pool:
+            for block in pool.imap(_normalize_chunk, _chunks(infile, chunk_size), chunksize=4):
+                outfile.write(block)
+    else:
+        for chunk in _chunks(infile, chunk_size):
+            outfile.write(_normalize_chunk(chunk))
+    outfile.flush()
 
 def main():
+    args = sys.argv[1:]
+    if "--stream" in args:
+        workers = int(args[args.index("--workers") + 1]) if "--workers" in args else 1
+        stream(sys.stdin, sys.stdout, workers=workers)
+        return
     try:
         data = json.load(sys.stdin)
-        raw = str(data.get("barcode", "")).strip()
-        qty = int(data.get("qty", 1))
-        clean = re.sub(r"[^0-9A-Za-z]", "", raw).upper()
-
-        if not clean:
-            raise ValueError("Empty barcode")
-
-        barcode_type = (
-            "UPC"   if len(clean) == 12 else
-            "EAN"   if len(clean) == 13 else
-            "ASIN"  if clean.startswith("B0") and len(clean) == 10 else
-            "ISBN"  if (len(clean) == 10 and clean[:9].isdigit()) or (len(clean) == 13 and clean.isdigit()) else
-            "GTIN"  if len(clean) in [14] else
-            "UNKNOWN"
-        )
-
-        result = {"barcode": clean, "type": barcode_type, "qty": qty}
+        if isinstance(data.get("barcodes"), list):
+            results = []
+            for barcode in data["barcodes"]:
+                try:
+                    results.append(normalize_barcode(barcode))
+                except ValueError as e:
+                    results.append({"input": barcode, "error": str(e)})
+            print(json.dumps({"results": results}))
+            return
+        result = normalize_barcode(data.get("barcode", ""), data.get("qty", 1))
         print(json.dumps(result))
     except Exception as e:
         print(str(e), file=sys.stderr)
         sys.exit(1)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,407 @@
+#!/usr/bin/env python3
+"""
+Bulk import of supplier manifests into the products table.
+
+  python3 mcp_bulk_import.py manifest.csv
+  python3 mcp_bulk_import.py manifest.ndjson --concurrency 16 --writers 2
+  cat manifest.ndjson | python3 mcp_bulk_import.py - --import-id po-1234
+
+Manifests are CSV (a barcode/upc/ean/gtin column and an optional qty/quantity
+column; without a header the first two columns are used) or NDJSON
+({"barcode": ..., "qty": ...} objects or bare codes, one per line).
+
+The manifest is streamed in batches of --batch-size lines. Each batch is
+canonicalized to GTIN-14 and de-duplicated (quantities summed), looked up
+through ProductDataMCPServer with bounded concurrency, so its cache is reused
+across batches and runs, and upserted by COPY into a staging table: product
+attributes are refreshed and qty is incremented. Memory is bounded by the
+batch size and the writer queue, not by the size of the manifest.
+
+Each committed batch is recorded in product_import_batches in the same
+transaction as its rows, so re-running an interrupted import with the same
+--import-id skips what was already written and never adds a quantity twice.
+For a file the import id defaults to its name plus a hash of its content, so
+a new manifest sent under an old file name is imported rather than skipped.
+Progress goes to stderr; a JSON summary is printed on stdout.
+"""
+import argparse
+import csv
+import io
+import itertools
+import json
+import logging
+import os
+import queue
+import sys
+import threading
+import time
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+import mcp_db
+from mcp_gtin import canonicalize, lookup_form
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+BARCODE_COLUMNS = ("barcode", "upc", "ean", "gtin", "code")
+QTY_COLUMNS = ("qty", "quantity", "count", "units")
+
+IMPORT_SCHEMA = (
+    """CREATE TABLE IF NOT EXISTS product_import_batches (
+        import_id TEXT NOT NULL,
+        batch_no INTEGER NOT NULL,
+        batch_size INTEGER NOT NULL,
+        lines INTEGER NOT NULL,
+        products INTEGER NOT NULL,
+        imported_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+        PRIMARY KEY (import_id, batch_no)
+    )""",
+)
+
+STAGING_COLUMNS = ("barcode", "gtin14", "title", "brand", "description", "price", "images", "product_data", "qty")
+
+_PRODUCT_DATA = STAGING_COLUMNS.index("product_data")
+
+STAGING_DDL = """CREATE TEMP TABLE IF NOT EXISTS products_staging (
+    barcode TEXT, gtin14 TEXT, title TEXT, brand TEXT, description TEXT,
+    price NUMERIC(12, 2), images JSONB, product_data JSONB, qty INTEGER
+) ON COMMIT DELETE ROWS"""
+
+# Looked-up attributes replace the stored ones only when the lookup found
+# them; quantities always add up. Rows go in barcode order, so parallel
+# writers (and the inventory incrementer) lock shared rows in the same order.
+UPSERT_SQL = f"""INSERT INTO products ({", ".join(STAGING_COLUMNS)}, updated_at)
+SELECT {", ".join(STAGING_COLUMNS)}, now() FROM products_staging ORDER BY barcode
+ON CONFLICT (barcode) DO UPDATE SET
+    gtin14 = COALESCE(EXCLUDED.gtin14, products.gtin14),
+    title = COALESCE(EXCLUDED.title, products.title),
+    brand = COALESCE(EXCLUDED.brand, products.brand),
+    description = COALESCE(EXCLUDED.description, products.description),
+    price = COALESCE(EXCLUDED.price, products.price),
+    images = COALESCE(EXCLUDED.images, products.images),
+    product_data = COALESCE(EXCLUDED.product_data, products.product_data),
+    qty = products.qty + EXCLUDED.qty,
+    updated_at = now()"""
+
+
+def _column(names: List[str], wanted: Optional[str], candidates: Tuple[str, ...]) -> Optional[int]:
+    for name in ([wanted.lower()] if wanted else candidates):
+        if name in names:
+            return names.index(name)
+    return None
+
+
+def _csv_rows(infile, barcode_column: Optional[str] = None, qty_column: Optional[str] = None) -> Iterator[Dict[str, Any]]:
+    reader = csv.reader(infile)
+    header = next(reader, None)
+    if header is None:
+        return
+    names = [name.strip().lower() for name in header]
+    barcode_index = _column(names, barcode_column, BARCODE_COLUMNS)
+    if barcode_index is None:
+        if barcode_column:
+            raise ValueError(f"Column {barcode_column!r} not found in the manifest header")
+        # No header: codes in the first column, quantities in the second.
+        barcode_index, qty_index = 0, 1
+        reader = itertools.chain([header], reader)
+    else:
+        qty_index = _column(names, qty_column, QTY_COLUMNS)
+    for row in reader:
+        if not any(cell.strip() for cell in row):
+            continue
+        qty = row[qty_index].strip() if qty_index is not None and qty_index < len(row) else ""
+        yield {"barcode": row[barcode_index] if barcode_index < len(row) else "", "qty": qty or 1}
+
+
+def _ndjson_rows(infile) -> Iterator[Dict[str, Any]]:
+    for line in infile:
+        line = line.strip()
+        if not line:
+            continue
+        if not line.startswith("{"):
+            yield {"barcode": line, "qty": 1}
+            continue
+        try:
+            data = json.loads(line)
+        except ValueError as e:
+            yield {"input": line, "error": f"Invalid JSON: {e}"}
+            continue
+        yield {"barcode": data.get("barcode") or data.get("upc") or "",
+               "qty": data.get("qty", data.get("quantity", 1))}
+
+
+def read_manifest(infile, manifest_format: str, barcode_column: Optional[str] = None,
+                  qty_column: Optional[str] = None) -> Iterator[Dict[str, Any]]:
+    """Yields one {"barcode", "qty"} (or {"input", "error"}) row per manifest entry, lazily."""
+    if manifest_format == "csv":
+        return _csv_rows(infile, barcode_column, qty_column)
+    return _ndjson_rows(infile)
+
+
+def _chunks(rows: Iterable[Dict[str, Any]], size: int) -> Iterator[List[Dict[str, Any]]]:
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def prepare_batch(rows: List[Dict[str, Any]]) -> Tuple[Dict[str, Dict[str, Any]], List[Dict[str, Any]]]:
+    """Canonicalizes and de-duplicates one batch: ({canonical key: item}, rejected rows)."""
+    items: Dict[str, Dict[str, Any]] = {}
+    rejects = []
+    for row in rows:
+        if "error" in row:
+            rejects.append(row)
+            continue
+        try:
+            qty = int(row["qty"])
+            info = canonicalize(row["barcode"])
+        except (TypeError, ValueError) as e:
+            rejects.append({"input": row["barcode"], "error": str(e)})
+            continue
+        if not info["valid"]:
+            rejects.append({"input": row["barcode"], "error": info.get("validation_error") or f"Unrecognized barcode ({info['symbology']})"})
+            continue
+        key = info["gtin14"] or info["barcode"]
+        item = items.get(key)
+        if item is None:
+            items[key] = {"barcode": lookup_form(info), "gtin14": info["gtin14"], "qty": qty}
+        else:
+            item["qty"] += qty
+    return items, rejects
+
+
+def _staging_row(item: Dict[str, Any], product: Optional[Dict[str, Any]]) -> List[Any]:
+    found = bool(product) and product.get("success") is not False
+    product = product if found else {}
+    price = product.get("price")
+    images = product.get("images_urls") or None
+    return [
+        item["barcode"],
+        item["gtin14"],
+        product.get("product_name") or None,
+        product.get("brand") or None,
+        product.get("description") or None,
+        price if isinstance(price, (int, float)) and price > 0 else None,
+        json.dumps(images) if images else None,
+        json.dumps({key: value for key, value in product.items() if key != "meta"}) if found else None,
+        item["qty"],
+    ]
+
+
+class BulkImporter:
+    """Streams manifest rows through lookup and batched upserts; see the module docstring."""
+
+    def __init__(self, server, import_id: str, batch_size: int = 500, concurrency: int = 8, writers: int = 2,
+                 lookup_options: Optional[Dict[str, Any]] = None, dry_run: bool = False,
+                 rejects_file=None, progress_interval_s: float = 10.0):
+        self.server = server
+        self.import_id = import_id
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        self.writers = writers
+        self.lookup_options = lookup_options or {}
+        self.dry_run = dry_run
+        self.rejects_file = rejects_file
+        self.progress_interval_s = progress_interval_s
+
+        self.stats = {"lines": 0, "skipped_lines": 0, "rejected": 0, "looked_up": 0, "found": 0,
+                      "upserted": 0, "batches": 0, "skipped_batches": 0}
+        self._lock = threading.Lock()
+        self._queue: "queue.Queue[Optional[Tuple[int, int, List[List[Any]]]]]" = queue.Queue(maxsize=max(1, writers) * 2)
+        self._error: Optional[BaseException] = None
+        self._done = threading.Event()
+        self._started = time.monotonic()
+
+    def _count(self, **increments: int) -> None:
+        with self._lock:
+            for name, value in increments.items():
+                self.stats[name] += value
+
+    def imported_batches(self) -> Set[int]:
+        """Batches already committed by an earlier run of this import."""
+        mcp_db.ensure_schema(IMPORT_SCHEMA, tables=("product_import_batches",))
+        with mcp_db.connection() as conn, conn.cursor() as cur:
+            cur.execute("SELECT batch_no, batch_size FROM product_import_batches WHERE import_id = %s",
+                        (self.import_id,))
+            rows = cur.fetchall()
+        sizes = {size for _, size in rows}
+        if sizes and sizes != {self.batch_size}:
+            raise ValueError(f"Import {self.import_id!r} was started with --batch-size {sizes.pop()}; "
+                             f"resume it with the same batch size")
+        return {batch_no for batch_no, _ in rows}
+
+    def run(self, rows: Iterable[Dict[str, Any]]) -> Dict[str, Any]:
+        done = set() if self.dry_run else self.imported_batches()
+        if done:
+            logger.info(f"Resuming import {self.import_id!r}: {len(done)} batches already imported")
+        threads = [threading.Thread(target=self._write_loop, name=f"import-writer-{i}", daemon=True)
+                   for i in range(max(1, self.writers))]
+        threads.append(threading.Thread(target=self._progress_loop, name="import-progress", daemon=True))
+        for thread in threads:
+            thread.start()
+
+        interrupted = False
+        try:
+            for batch_no, chunk in enumerate(_chunks(rows, self.batch_size)):
+                if self._error is not None:
+                    break
+                if batch_no in done:
+                    self._count(lines=len(chunk), skipped_lines=len(chunk), skipped_batches=1)
+                    continue
+                staged = self._lookup_batch(chunk)
+                # Blocks while the writers are behind, which keeps memory flat.
+                self._queue.put((batch_no, len(chunk), staged))
+        except KeyboardInterrupt:
+            interrupted = True
+            logger.warning("Interrupted; finishing batches already looked up")
+        finally:
+            for _ in range(max(1, self.writers)):
+                self._queue.put(None)
+            for thread in threads[:-1]:
+                thread.join()
+            self._done.set()
+
+        summary = self.summary()
+        summary["interrupted"] = interrupted
+        if self._error is not None:
+            summary["error"] = str(self._error)
+        return summary
+
+    def _lookup_batch(self, chunk: List[Dict[str, Any]]) -> List[List[Any]]:
+        items, rejects = prepare_batch(chunk)
+        if rejects and self.rejects_file is not None:
+            self.rejects_file.write("".join(json.dumps(reject) + "\n" for reject in rejects))
+        codes = [item["barcode"] for item in items.values()]
+        results = self.server.getProductDataByUPCs(codes, concurrency=self.concurrency,
+                                                   **self.lookup_options)["results"] if codes else {}
+        staged = [_staging_row(item, results.get(item["barcode"])) for item in items.values()]
+        self._count(lines=len(chunk), rejected=len(rejects), looked_up=len(codes),
+                    found=sum(1 for row in staged if row[_PRODUCT_DATA] is not None))
+        return staged
+
+    def _write_loop(self) -> None:
+        while True:
+            work = self._queue.get()
+            if work is None:
+                return
+            if self._error is not None:
+                continue  # drain without writing after a failure
+            batch_no, lines, staged = work
+            try:
+                if not self.dry_run:
+                    self.write_batch(batch_no, lines, staged)
+                self._count(upserted=len(staged), batches=1)
+            except Exception as e:
+                logger.exception(f"Writing batch {batch_no} failed; stopping (re-run to resume)")
+                self._error = e
+
+    def write_batch(self, batch_no: int, lines: int, staged: List[List[Any]]) -> None:
+        """Upserts one batch and records it as imported, in one transaction."""
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows(staged)  # None is written as an empty field, which COPY reads as NULL
+        buffer.seek(0)
+        try:
+            with mcp_db.connection() as conn, conn.cursor() as cur:
+                cur.execute(STAGING_DDL)
+                cur.copy_expert(f"COPY products_staging ({', '.join(STAGING_COLUMNS)}) FROM STDIN WITH (FORMAT csv)",
+                                buffer)
+                cur.execute(UPSERT_SQL)
+                cur.execute("INSERT INTO product_import_batches (import_id, batch_no, batch_size, lines, products) "
+                            "VALUES (%s, %s, %s, %s, %s)",
+                            (self.import_id, batch_no, self.batch_size, lines, len(staged)))
+        except mcp_db.psycopg2.errors.UniqueViolation:
+            # Another run committed this batch first; its rows are already in.
+            logger.warning(f"Batch {batch_no} of {self.import_id!r} was already imported; skipped")
+
+    def summary(self) -> Dict[str, Any]:
+        elapsed = time.monotonic() - self._started
+        with self._lock:
+            summary = dict(self.stats)
+        processed = summary["lines"] - summary["skipped_lines"]
+        summary.update(import_id=self.import_id, dry_run=self.dry_run, elapsed_s=round(elapsed, 1),
+                       lines_per_s=round(processed / elapsed, 1) if elapsed > 0 else None)
+        return summary
+
+    def _progress_loop(self) -> None:
+        while not self._done.wait(self.progress_interval_s):
+            s = self.summary()
+            logger.info(f"{self.import_id}: {s['lines']} lines, {s['looked_up']} looked up ({s['found']} found), "
+                        f"{s['upserted']} upserted, {s['rejected']} rejected; {s['lines_per_s']} lines/s")
+
+
+def default_import_id(path: str) -> str:
+    """<file name>-<first 16 hex digits of its SHA-256>: stable across re-runs, new for new content."""
+    import hashlib
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return f"{os.path.basename(path)}-{digest.hexdigest()[:16]}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("manifest", help="CSV or NDJSON manifest, or - for stdin")
+    parser.add_argument("--format", choices=("csv", "ndjson"), help="Default: from the file extension (stdin: ndjson)")
+    parser.add_argument("--import-id", help="Resume key; defaults to the manifest file name and content hash")
+    parser.add_argument("--barcode-column", help="CSV column holding the barcodes")
+    parser.add_argument("--qty-column", help="CSV column holding the quantities")
+    parser.add_argument("--batch-size", type=int, default=int(os.getenv("MCP_IMPORT_BATCH_SIZE", 500)))
+    parser.add_argument("--concurrency", type=int, default=int(os.getenv("MCP_IMPORT_CONCURRENCY", 8)),
+                        help="Lookups in flight per batch")
+    parser.add_argument("--writers", type=int, default=int(os.getenv("MCP_IMPORT_WRITERS", 2)),
+                        help="Batches written to Postgres in parallel (pooled connections)")
+    parser.add_argument("--strategy", help="Lookup strategy (see getProductDataByUPC)")
+    parser.add_argument("--cache", help="Cache mode (see getProductDataByUPC)")
+    parser.add_argument("--deadline-ms", type=int)
+    parser.add_argument("--rejects", help="Write rejected lines as NDJSON to this file")
+    parser.add_argument("--progress-interval-s", type=float, default=10.0)
+    parser.add_argument("--dry-run", action="store_true", help="Look everything up but write nothing")
+    args = parser.parse_args()
+
+    from_stdin = args.manifest == "-"
+    if from_stdin and not (args.import_id or args.dry_run):
+        parser.error("--import-id is required when reading the manifest from stdin")
+    import_id = args.import_id or ("stdin" if from_stdin else default_import_id(args.manifest))
+    manifest_format = args.format or ("csv" if args.manifest.lower().endswith(".csv") else "ndjson")
+
+    # Imported here so --help does not start the server's cache and threads.
+    from mcp_product_data import ProductDataMCPServer
+
+    server = ProductDataMCPServer()
+    lookup_options = server._lookup_options({key: value for key, value in (
+        ("strategy", args.strategy), ("cache", args.cache), ("deadline_ms", args.deadline_ms)) if value is not None})
+    if "error" in lookup_options:
+        parser.error(lookup_options["error"])
+    rejects_file = open(args.rejects, "a") if args.rejects else None
+    infile = sys.stdin if from_stdin else open(args.manifest, newline="" if manifest_format == "csv" else None)
+    try:
+        if not args.dry_run:
+            mcp_db.get_pool(max(1, args.writers))
+        importer = BulkImporter(server, import_id, batch_size=args.batch_size, concurrency=args.concurrency,
+                                writers=args.writers, lookup_options=lookup_options, dry_run=args.dry_run,
+                                rejects_file=rejects_file, progress_interval_s=args.progress_interval_s)
+        summary = importer.run(read_manifest(infile, manifest_format, args.barcode_column, args.qty_column))
+    finally:
+        if infile is not sys.stdin:
+            infile.close()
+        if rejects_file is not None:
+            rejects_file.close()
+        server.lookup_executor.shutdown(wait=False)
+        if server.refresher:
+            server.refresher.close()
+        if server.cache:
+            server.cache.close()
+        mcp_db.close_pool()
+
+    print(json.dumps(summary))
+    return 1 if "error" in summary or summary["interrupted"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,283 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import logging
+from dataclasses import dataclass
+from typing import Dict, Any, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CACHE_PATH = os.path.join(os.path.expanduser("~"), ".cache", "mcp-product-data", "products.sqlite3")
+
+# Cache modes accepted by getProductDataByUPC
+CACHE_MODE_DEFAULT = "default"  # read and write the cache
+CACHE_MODE_REFRESH = "refresh"  # skip the read, store the fresh upstream answer
+CACHE_MODE_REFRESH_PRICING = "refresh_pricing"  # reuse cached attributes, re-fetch only price-bearing sources
+CACHE_MODE_BYPASS = "bypass"    # neither read nor write
+CACHE_MODES = (CACHE_MODE_DEFAULT, CACHE_MODE_REFRESH, CACHE_MODE_REFRESH_PRICING, CACHE_MODE_BYPASS)
+
+# Volatile fields stored apart from the product attributes, with their own TTL.
+PRICING_FIELDS = ("price", "currency", "offers")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS product_cache (
+    source      TEXT NOT NULL,
+    barcode     TEXT NOT NULL,
+    payload     TEXT,              -- product attributes; NULL marks a negative ("not found") entry
+    expires_at  REAL NOT NULL,
+    last_access REAL NOT NULL,
+    pricing     TEXT,              -- PRICING_FIELDS, when stored apart from the attributes
+    pricing_expires_at REAL,
+    PRIMARY KEY (source, barcode)
+);
+CREATE INDEX IF NOT EXISTS product_cache_last_access ON product_cache (last_access);
+"""
+
+# Columns added after the first release, for caches created before them.
+_MIGRATIONS = (
+    ("pricing", "ALTER TABLE product_cache ADD COLUMN pricing TEXT"),
+    ("pricing_expires_at", "ALTER TABLE product_cache ADD COLUMN pricing_expires_at REAL"),
+)
+
+
+@dataclass
+class CacheEntry:
+    # Attributes plus pricing; the pricing fields are left out when they expired.
+    payload: Optional[Dict[str, Any]]
+    pricing_fresh: bool = True
+    # Only with allow_stale: the attributes are past their TTL but inside the
+    # stale window, and expired pricing still inside it.
+    stale: bool = False
+    stale_pricing: Optional[Dict[str, Any]] = None
+
+
+class ProductCache:
+    """
+    On-disk SQLite cache of per-source lookup results, keyed on the normalized
+    barcode. Product attributes live for ttl_s; prices, when stored split,
+    only for pricing_ttl_s. "Not found" answers live for negative_ttl_s, and
+    the least recently used entries are evicted beyond max_entries. For
+    stale_ttl_s past the attribute and pricing TTLs a product entry can still
+    be served stale while it is refreshed; "not found" entries cannot.
+
+    Several processes may share one cache file (the pre-forked HTTP
+    workers), so the size is recounted from the table, inside the write
+    transaction, every recount_every new entries; and a locked database
+    is treated as a miss or a skipped write rather than a failed lookup.
+    """
+
+    def __init__(self, path: str = DEFAULT_CACHE_PATH, ttl_s: float = 30 * 24 * 3600,
+                 negative_ttl_s: float = 15 * 60, max_entries: int = 100000,
+                 pricing_ttl_s: float = 6 * 3600, stale_ttl_s: float = 24 * 3600):
+        self.path = path
+        self.ttl_s = ttl_s
+        self.pricing_ttl_s = pricing_ttl_s
+        self.stale_ttl_s = stale_ttl_s
+        self.negative_ttl_s = negative_ttl_s
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.stale_pricing = 0
+        self.stale_hits = 0
+        self.evictions = 0
+        self.errors = 0
+        # Bounds the overshoot past max_entries to about recount_every new rows per process.
+        self.recount_every = max(1, max_entries // 1000)
+        self._new_since_recount = 0
+
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(product_cache)")}
+        for column, statement in _MIGRATIONS:
+            if column not in columns:
+                self._conn.execute(statement)
+        self._size = self._conn.execute("SELECT COUNT(*) FROM product_cache").fetchone()[0]
+
+    @classmethod
+    def from_env(cls) -> Optional["ProductCache"]:
+        """Builds the cache from MCP_CACHE_* variables; returns None when MCP_CACHE_DISABLED is set."""
+        if os.getenv("MCP_CACHE_DISABLED", "").lower() in ("1", "true", "yes"):
+            return None
+        return cls(
+            path=os.getenv("MCP_CACHE_PATH", DEFAULT_CACHE_PATH),
+            ttl_s=float(os.getenv("MCP_CACHE_TTL_S", 30 * 24 * 3600)),
+            pricing_ttl_s=float(os.getenv("MCP_CACHE_PRICING_TTL_S", 6 * 3600)),
+            stale_ttl_s=float(os.getenv("MCP_CACHE_STALE_TTL_S", 24 * 3600)),
+            negative_ttl_s=float(os.getenv("MCP_CACHE_NEGATIVE_TTL_S", 15 * 60)),
+            max_entries=int(os.getenv("MCP_CACHE_MAX_ENTRIES", 100000)),
+        )
+
+    def get(self, source: str, barcode: str) -> Tuple[bool, Optional[Dict[str, Any]]]:
+        """
+        Returns (found, payload). A found entry with a None payload is a cached
+        "not found" answer. Entries whose pricing has expired are not found.
+        """
+        entry = self.get_entry(source, barcode)
+        if entry is None or not entry.pricing_fresh:
+            return False, None
+        return True, entry.payload
+
+    def get_entry(self, source: str, barcode: str, allow_stale: bool = False) -> Optional[CacheEntry]:
+        """
+        The entry while its attributes are fresh, None otherwise. Expired
+        pricing leaves the attributes usable: the entry comes back with
+        pricing_fresh False and without the pricing fields. With allow_stale,
+        entries inside the stale window are returned too, flagged stale, and
+        expired pricing inside it comes back in stale_pricing. Negative entries
+        are only returned while fresh.
+        """
+        now = time.time()
+        stale_until = now - self.stale_ttl_s if allow_stale else now
+        with self._lock:
+            try:
+                row = self._conn.execute(
+                    "SELECT payload, expires_at, pricing, pricing_expires_at FROM product_cache "
+                    "WHERE source = ? AND barcode = ?",
+                    (source, barcode)
+                ).fetchone()
+                if row is not None and row[0] is None:
+                    # Not-found answers are never served stale: a newly listed
+                    # product must show up once negative_ttl_s has passed.
+                    stale_until = now
+                if row is not None and row[1] > stale_until:
+                    self._conn.execute(
+                        "UPDATE product_cache SET last_access = ? WHERE source = ? AND barcode = ?",
+                        (now, source, barcode)
+                    )
+            except sqlite3.OperationalError as e:
+                self.errors += 1
+                logger.warning(f"Cache read for {source}/{barcode} failed, treated as a miss: {e}")
+                row = None
+            if row is None or row[1] <= stale_until:
+                self.misses += 1
+                return None
+            stale = row[1] <= now
+            pricing_fresh = row[3] is None or row[3] > now
+            if stale:
+                self.stale_hits += 1
+            elif pricing_fresh:
+                self.hits += 1
+            else:
+                self.stale_pricing += 1
+        if row[0] is None:
+            return CacheEntry(None, stale=stale)
+        payload = json.loads(row[0])
+        entry = CacheEntry(payload, pricing_fresh, stale)
+        if row[2] is not None:
+            if pricing_fresh:
+                payload.update(json.loads(row[2]))
+            elif row[3] > stale_until:
+                entry.stale_pricing = json.loads(row[2])
+        return entry
+
+    def expires_in(self, source: str, barcode: str) -> Optional[float]:
+        """
+        Seconds until a cached product answer (attributes or pricing,
+        whichever is first) expires; negative once expired, None when there
+        is no positive entry. Does not count as an access.
+        """
+        with self._lock:
+            try:
+                row = self._conn.execute(
+                    "SELECT expires_at, pricing_expires_at FROM product_cache "
+                    "WHERE source = ? AND barcode = ? AND payload IS NOT NULL",
+                    (source, barcode)
+                ).fetchone()
+            except sqlite3.OperationalError as e:
+                self.errors += 1
+                logger.warning(f"Cache read for {source}/{barcode} failed: {e}")
+                row = None
+        if row is None:
+            return None
+        return min(value for value in row if value is not None) - time.time()
+
+    def put(self, source: str, barcode: str, payload: Optional[Dict[str, Any]],
+            split_pricing: bool = False) -> None:
+        """
+        Stores one source answer. With split_pricing the PRICING_FIELDS are
+        kept apart and expire after pricing_ttl_s, the rest after ttl_s.
+        """
+        now = time.time()
+        pricing = pricing_expires_at = None
+        if payload is None:
+            encoded, expires_at = None, now + self.negative_ttl_s
+        else:
+            if split_pricing:
+                pricing = json.dumps({field: payload[field] for field in PRICING_FIELDS if field in payload})
+                pricing_expires_at = now + self.pricing_ttl_s
+                payload = {key: value for key, value in payload.items() if key not in PRICING_FIELDS}
+            encoded, expires_at = json.dumps(payload), now + self.ttl_s
+        with self._lock:
+            try:
+                # IMMEDIATE takes the file's write lock up front, so the recount
+                # and eviction see every process's rows and none evicts twice.
+                self._conn.execute("BEGIN IMMEDIATE")
+                try:
+                    exists = self._conn.execute(
+                        "SELECT 1 FROM product_cache WHERE source = ? AND barcode = ?", (source, barcode)
+                    ).fetchone()
+                    self._conn.execute(
+                        "INSERT OR REPLACE INTO product_cache "
+                        "(source, barcode, payload, expires_at, last_access, pricing, pricing_expires_at) "
+                        "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                        (source, barcode, encoded, expires_at, now, pricing, pricing_expires_at)
+                    )
+                    if not exists:
+                        self._size += 1
+                        self._new_since_recount += 1
+                        if self._new_since_recount >= self.recount_every:
+                            self._recount()
+                    if self._size > self.max_entries:
+                        self._evict()
+                    self._conn.execute("COMMIT")
+                except BaseException:
+                    self._conn.execute("ROLLBACK")
+                    raise
+            except sqlite3.OperationalError as e:
+                self.errors += 1
+                logger.warning(f"Cache write for {source}/{barcode} skipped: {e}")
+
+    def _recount(self) -> None:
+        self._size = self._conn.execute("SELECT COUNT(*) FROM product_cache").fetchone()[0]
+        self._new_since_recount = 0
+
+    def _evict(self) -> None:
+        # Evict a little past the limit so we don't run a DELETE on every insert.
+        self._recount()
+        if self._size <= self.max_entries:
+            return  # another process already made room
+        excess = self._size - self.max_entries + max(1, self.max_entries // 100)
+        self._conn.execute(
+            "DELETE FROM product_cache WHERE rowid IN "
+            "(SELECT rowid FROM product_cache ORDER BY last_access LIMIT ?)",
+            (excess,)
+        )
+        removed = self._conn.execute("SELECT changes()").fetchone()[0]
+        self._size -= removed
+        self.evictions += removed
+        logger.info(f"Evicted {removed} least recently used cache entries")
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "path": self.path,
+                "entries": self._size,
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "stale_pricing": self.stale_pricing,
+                "stale_hits": self.stale_hits,
+                "evictions": self.evictions,
+                "errors": self.errors,
+            }
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
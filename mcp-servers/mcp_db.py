@@ -0,0 +1,135 @@
+"""
+Postgres access for the scripts that write to the products table: one
+process-wide psycopg2 connection pool and the products schema.
+
+The connection comes from DATABASE_URL, or from DB_HOST, DB_PORT, DB_NAME,
+DB_USER, DB_PASSWORD and DB_SSLMODE as in .devcontainer/docker-compose.yml.
+"""
+import logging
+import os
+import threading
+from contextlib import contextmanager
+from typing import Iterator, Optional
+
+try:
+    import psycopg2
+    from psycopg2.pool import ThreadedConnectionPool
+except ImportError:
+    psycopg2 = None
+    ThreadedConnectionPool = None
+
+logger = logging.getLogger(__name__)
+
+# The n8n scan workflow reads id, qty and title by barcode; the rest is filled
+# in by imports. Columns are added in place so existing tables keep working.
+PRODUCTS_SCHEMA = (
+    """CREATE TABLE IF NOT EXISTS products (
+        id BIGSERIAL PRIMARY KEY,
+        barcode TEXT NOT NULL,
+        title TEXT,
+        qty INTEGER NOT NULL DEFAULT 0
+    )""",
+    """ALTER TABLE products
+        ADD COLUMN IF NOT EXISTS gtin14 TEXT,
+        ADD COLUMN IF NOT EXISTS brand TEXT,
+        ADD COLUMN IF NOT EXISTS description TEXT,
+        ADD COLUMN IF NOT EXISTS price NUMERIC(12, 2),
+        ADD COLUMN IF NOT EXISTS images JSONB,
+        ADD COLUMN IF NOT EXISTS product_data JSONB,
+        ADD COLUMN IF NOT EXISTS updated_at TIMESTAMPTZ NOT NULL DEFAULT now()""",
+    # Upserts need a unique barcode.
+    "CREATE UNIQUE INDEX IF NOT EXISTS products_barcode_key ON products (barcode)",
+)
+
+PRODUCTS_COLUMNS = ("id", "barcode", "title", "qty", "gtin14", "brand", "description", "price",
+                    "images", "product_data", "updated_at")
+
+# Catalog reads only: no locks on products, one round trip.
+_SCHEMA_CHECK = """SELECT
+    (SELECT count(*) FROM information_schema.columns
+      WHERE table_schema = current_schema() AND table_name = 'products' AND column_name::text = ANY(%s::text[])),
+    EXISTS (SELECT 1 FROM pg_indexes
+             WHERE schemaname = current_schema() AND tablename = 'products' AND indexname = 'products_barcode_key'),
+    (SELECT count(*) FROM unnest(%s::text[]) AS t(name) WHERE to_regclass(t.name) IS NOT NULL)"""
+
+
+def database_url() -> str:
+    url = os.getenv("DATABASE_URL")
+    if url:
+        return url
+    return (f"postgresql://{os.getenv('DB_USER', '')}:{os.getenv('DB_PASSWORD', '')}"
+            f"@{os.getenv('DB_HOST', 'localhost')}:{os.getenv('DB_PORT', '5432')}/{os.getenv('DB_NAME', '')}"
+            f"?sslmode={os.getenv('DB_SSLMODE', 'prefer')}")
+
+
+_pool: Optional["ThreadedConnectionPool"] = None
+_pool_lock = threading.Lock()
+
+
+def get_pool(maxconn: Optional[int] = None) -> "ThreadedConnectionPool":
+    """Process-wide pool, created on first use with up to maxconn (MCP_DB_POOL_MAX, default 4) connections."""
+    global _pool
+    if psycopg2 is None:
+        raise RuntimeError("psycopg2 is not installed (pip install psycopg2-binary)")
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                maxconn = maxconn or int(os.getenv("MCP_DB_POOL_MAX", 4))
+                _pool = ThreadedConnectionPool(1, maxconn, database_url())
+    return _pool
+
+
+@contextmanager
+def connection() -> Iterator["psycopg2.extensions.connection"]:
+    """A pooled connection whose transaction commits on success and rolls back on error."""
+    pool = get_pool()
+    conn = pool.getconn()
+    try:
+        yield conn
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        pool.putconn(conn)
+
+
+def schema_ready(tables=()) -> bool:
+    """Whether the products columns, its barcode index and the given tables all exist."""
+    with connection() as conn, conn.cursor() as cur:
+        cur.execute(_SCHEMA_CHECK, (list(PRODUCTS_COLUMNS), list(tables)))
+        columns, index, found_tables = cur.fetchone()
+    return columns == len(PRODUCTS_COLUMNS) and index and found_tables == len(tables)
+
+
+def migrate(extra_statements=()) -> None:
+    """
+    Creates or extends the schema. ALTER TABLE locks products exclusively,
+    so this belongs in a deploy step (--migrate), not on every start.
+    """
+    try:
+        with connection() as conn, conn.cursor() as cur:
+            for statement in PRODUCTS_SCHEMA + tuple(extra_statements):
+                cur.execute(statement)
+    except psycopg2.errors.UniqueViolation as e:
+        raise RuntimeError("products holds duplicate barcodes; merge them before "
+                           f"products_barcode_key can be created: {e}") from e
+
+
+def ensure_schema(extra_statements=(), tables=()) -> None:
+    """
+    Migrates only when something is missing, so an up-to-date database costs
+    one catalog query and takes no DDL locks. tables names what
+    extra_statements create.
+    """
+    if not schema_ready(tables):
+        logger.info("Database schema is missing or outdated; migrating")
+        migrate(extra_statements)
+
+
+def close_pool() -> None:
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.closeall()
+            _pool = None
@@ -1,85 +1,162 @@
 #!/usr/bin/env python3
 import json, sys
 import os
-from ebaysdk.finding import Connection as FindingAPI
-from ebaysdk.exception import ConnectionError as EbayConnectionError
-
-payload = json.loads(sys.stdin.read())
-upc = payload.get("upc", "")
-
-EBAY_APP_ID = os.environ.get("EBAY_APP_ID")
-EBAY_ENVIRONMENT = os.environ.get("EBAY_ENVIRONMENT", "production") 
-
-result = {
-    "title": f"eBay listing {upc} (Not Found)",
-    "description": "eBay data not found.",
-    "price": 0.00,
-    "images": [],
-    "raw_data": {}
-}
-
-if not EBAY_APP_ID:
-    sys.stderr.write("eBay APP_ID missing. Skipping eBay lookup.\n")
-elif not FindingAPI:
-    sys.stderr.write("ebaysdk Finding API client not available. Skipping eBay lookup.\n")
-else:
+import threading
+
+from mcp_projection import parse_output_options, shape_output, wants_raw
+from mcp_record import ProductRecord
+from mcp_transport import get_transport
+
+# ebaysdk (and the requests stack under it) is imported on the first lookup
+# that has credentials, not when this module loads.
+FindingAPI = None
+EbayConnectionError = None
+_sdk_checked = False
+
+def _load_sdk():
+    """Imports ebaysdk once; False when it is not installed."""
+    global FindingAPI, EbayConnectionError, _sdk_checked
+    if not _sdk_checked:
+        try:
+            from ebaysdk.finding import Connection as FindingAPI
+            from ebaysdk.exception import ConnectionError as EbayConnectionError
+        except ImportError:
+            pass
+        _sdk_checked = True
+    return FindingAPI is not None
+
+# ebaysdk connections keep per-call request/response state, so each thread
+# gets its own; they all share the pooled transport session underneath.
+_local = threading.local()
+
+def _not_found(upc):
+    return {
+        "title": f"eBay listing {upc} (Not Found)",
+        "description": "eBay data not found.",
+        "price": 0.00,
+        "images": [],
+        "raw_data": {}
+    }
+
+def _error(upc, e):
+    return {
+        "title": f"eBay listing {upc} (Error)",
+        "description": f"eBay API call failed: {e}",
+        "price": 0.00,
+        "images": [],
+        "raw_data": {}
+    }
+
+def _get_finding_api(app_id, environment):
+    domain = 'svcs.ebay.com' if environment == 'production' else 'svcs.sandbox.ebay.com'
+    # Endpoint overrides, e.g. for the local stubs in benchmarks/
+    domain = os.environ.get("EBAY_FINDING_DOMAIN", domain)
+    use_https = os.environ.get("EBAY_FINDING_HTTPS", "1") != "0"
+    key = (app_id, domain)
+    cache = getattr(_local, "apis", None)
+    if cache is None:
+        cache = _local.apis = {}
+    api = cache.get(key)
+    if api is None:
+        transport = get_transport()
+        api = FindingAPI(appid=app_id, config_file=None, domain=domain)
+        if not use_https:
+            api.config.set('https', False, force=True)
+        api.session = transport.sdk_session()
+        api.timeout = transport.timeout
+        cache[key] = api
+    return api
+
+def fetch_ebay(upc):
+    """
+    (ProductRecord of the first listing or None, parsed response) for a UPC.
+    Raises on API errors; (None, {}) when eBay is not configured.
+    """
+    EBAY_APP_ID = os.environ.get("EBAY_APP_ID")
+    EBAY_ENVIRONMENT = os.environ.get("EBAY_ENVIRONMENT", "production")
+
+    if not EBAY_APP_ID:
+        sys.stderr.write("eBay APP_ID missing. Skipping eBay lookup.\n")
+        return None, {}
+    if not _load_sdk():
+        sys.stderr.write("ebaysdk Finding API client not available. Skipping eBay lookup.\n")
+        return None, {}
+
+    api = _get_finding_api(EBAY_APP_ID, EBAY_ENVIRONMENT)
+
+    response = api.execute('findItemsByProduct', {
+        'productId': {
+            '#text': upc,
+            '@attrs': {'type': 'UPC'}
+        },
+        'outputSelector': ['PictureURLSuperSize', 'GalleryInfo', 'PictureURL']
+    })
+
+    # response.dict() re-parses the XML body on every call, so parse it once.
+    data = response.dict() or {}
+    listings = (data.get('searchResult') or {}).get('item') or []
+    if not listings or not listings[0].get('title'):
+        return None, data
+    item = listings[0]
+
+    current_price = item.get('sellingStatus', {}).get('currentPrice', {}).get('value')
+
+    image_urls = []
+    if item.get('galleryURL'):
+        image_urls.append(item['galleryURL'])
+    if item.get('pictureURLSuperSize'):
+        image_urls.append(item['pictureURLSuperSize'])
+    elif item.get('pictureURLLarge'):
+        image_urls.append(item['pictureURLLarge'])
+
+    # Every listing's price, for price statistics across offers.
+    offers = []
+    for listing in listings:
+        listing_price = listing.get('sellingStatus', {}).get('currentPrice', {})
+        if listing_price.get('value') is not None:
+            offers.append({
+                'price': float(listing_price['value']),
+                'currency': listing_price.get('_currencyId'),
+                'merchant': f"eBay item {listing.get('itemId')}"
+            })
+
+    record = ProductRecord(
+        upc=upc,
+        source_used="ebay.com",
+        product_name=item['title'],
+        description=item.get('subtitle'),
+        price=float(current_price) if current_price is not None else None,
+        images_urls=image_urls,
+        offers=offers,
+    )
+    return record, data
+
+def lookup_ebay(upc, include_raw=True):
     try:
-        api = FindingAPI(
-            appid=EBAY_APP_ID,
-            config_file=None, 
-            domain='svcs.ebay.com' if EBAY_ENVIRONMENT == 'production' else 'svcs.sandbox.ebay.com'
-        )
-
-        response = api.execute('findItemsByProduct', {
-            'productId': {
-                '_value': upc,
-                'type': 'UPC' 
-            },
-            'outputSelector': ['PictureURLSuperSize', 'GalleryInfo', 'PictureURL']
-        })
-
-        result["raw_data"] = response.dict()
-
-        if response.dict() and response.dict().get('searchResult') and response.dict()['searchResult'].get('item'):
-            item = response.dict()['searchResult']['item'][0]
-
-            result['title'] = item.get('title')
-            result['description'] = item.get('subtitle') 
-
-            selling_status = item.get('sellingStatus', {})
-            current_price = selling_status.get('currentPrice', {}).get('value')
-            if current_price is not None:
-                result['price'] = float(current_price)
-            else:
-                result['price'] = 0.00 
-
-            image_urls = []
-            if item.get('galleryURL'):
-                image_urls.append(item['galleryURL'])
-            if item.get('pictureURLSuperSize'):
-                image_urls.append(item['pictureURLSuperSize'])
-            elif item.get('pictureURLLarge'):
-                image_urls.append(item['pictureURLLarge'])
-
-            result['images'] = image_urls
-
-    except EbayConnectionError as e:
-        sys.stderr.write(f"eBay API Connection Error for UPC {upc}: {e.response.dict() if e.response else e}\n")
-        result = {
-            "title": f"eBay listing {upc} (Error)",
-            "description": f"eBay API call failed: {e}",
-            "price": 0.00,
-            "images": [],
-            "raw_data": {}
-        }
+        record, data = fetch_ebay(upc)
     except Exception as e:
-        sys.stderr.write(f"eBay API Error for UPC {upc}: {e}\n")
-        result = {
-            "title": f"eBay listing {upc} (Error)",
-            "description": f"eBay API call failed: {e}",
-            "price": 0.00,
-            "images": [],
-            "raw_data": {}
-        }
-
-print(json.dumps(result))
\ No newline at end of file
+        if EbayConnectionError is not None and isinstance(e, EbayConnectionError):
+            sys.stderr.write(f"eBay API Connection Error for UPC {upc}: {e.response.dict() if e.response else e}\n")
+        else:
+            sys.stderr.write(f"eBay API Error for UPC {upc}: {e}\n")
+        return _error(upc, e)
+
+    raw_data = data if include_raw else {}
+    if record is None:
+        result = _not_found(upc)
+        result["raw_data"] = raw_data
+        return result
+    result = record.listing(raw_data)
+    result['offers'] = record.offers
+    return result
+
+def main():
+    payload = json.loads(sys.stdin.read())
+    try:
+        options = parse_output_options(payload)
+    except ValueError as e:
+        sys.exit(f"Invalid output options: {e}")
+    print(json.dumps(shape_output(lookup_ebay(payload.get("upc", ""), include_raw=wants_raw(options)), options)))
+
+if __name__ == "__main__":
+    main()
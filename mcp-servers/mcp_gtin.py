@@ -0,0 +1,202 @@
+"""
+GTIN canonicalization: check-digit validation (GS1 mod-10, ISBN-10 mod-11),
+UPC-E expansion and mapping of every GTIN form (UPC-E, UPC-A, EAN-8, EAN-13,
+ISBN-10/13, GTIN-14) of one product onto a single GTIN-14 key.
+
+Stdlib only and import-light: the normalizer's stream mode loads this for
+bulk imports of millions of codes.
+"""
+import re
+
+_NON_ALNUM = re.compile(r"[^0-9A-Za-z]")
+
+# Symbologies reported in "symbology"
+UPC_A = "UPC-A"
+UPC_E = "UPC-E"
+EAN_8 = "EAN-8"
+EAN_13 = "EAN-13"
+GTIN_14 = "GTIN-14"
+ISBN_10 = "ISBN-10"
+ISBN_13 = "ISBN-13"
+ASIN = "ASIN"
+UNKNOWN = "UNKNOWN"
+
+
+def clean_code(raw):
+    if isinstance(raw, str) and raw.isdigit() and raw.isascii():
+        return raw  # fast path: the common scanner output needs no cleaning
+    return _NON_ALNUM.sub("", str(raw if raw is not None else "").strip()).upper()
+
+
+def gtin_check_digit(body):
+    """GS1 mod-10 check digit for the digits preceding it (any GTIN length)."""
+    # Weights alternate 3, 1, 3, ... starting from the rightmost digit.
+    total = 3 * sum(map(int, body[::-2])) + sum(map(int, body[-2::-2]))
+    return str((10 - total % 10) % 10)
+
+
+def is_valid_gtin(code):
+    return len(code) in (8, 12, 13, 14) and code.isdigit() and gtin_check_digit(code[:-1]) == code[-1]
+
+
+def isbn10_check_digit(body):
+    total = sum((10 - i) * (ord(ch) - 48) for i, ch in enumerate(body))
+    check = (11 - total % 11) % 11
+    return "X" if check == 10 else str(check)
+
+
+def is_valid_isbn10(code):
+    return len(code) == 10 and code[:9].isdigit() and isbn10_check_digit(code[:9]) == code[9]
+
+
+def expand_upc_e(code):
+    """
+    Expands a UPC-E code to its 12-digit UPC-A. Accepts 6 digits (number
+    system 0 assumed, check computed), 7 digits (number system + 6, check
+    computed) or 8 digits (number system + 6 + check, check verified).
+    Returns None when the code cannot be a UPC-E.
+    """
+    if not code.isdigit():
+        return None
+    if len(code) == 6:
+        number_system, core, check = "0", code, None
+    elif len(code) == 7:
+        number_system, core, check = code[0], code[1:], None
+    elif len(code) == 8:
+        number_system, core, check = code[0], code[1:7], code[7]
+    else:
+        return None
+    if number_system not in "01":
+        return None
+
+    last = core[5]
+    if last in "012":
+        body = number_system + core[0:2] + last + "0000" + core[2:5]
+    elif last == "3":
+        body = number_system + core[0:3] + "00000" + core[3:5]
+    elif last == "4":
+        body = number_system + core[0:4] + "00000" + core[4]
+    else:
+        body = number_system + core[0:5] + "0000" + last
+
+    expected = gtin_check_digit(body)
+    if check is not None and check != expected:
+        return None
+    return body + expected
+
+
+def compress_upc_a(upca):
+    """Inverse of expand_upc_e: the 8-digit UPC-E for a UPC-A, or None if it has no UPC-E form."""
+    if len(upca) != 12 or upca[0] not in "01":
+        return None
+    ns, mfr, product, check = upca[0], upca[1:6], upca[6:11], upca[11]
+    if mfr[3:] == "00" and mfr[2] in "012" and product[:2] == "00":
+        core = mfr[0:2] + product[2:5] + mfr[2]
+    elif mfr[3:] == "00" and product[:3] == "000":
+        core = mfr[0:3] + product[3:5] + "3"
+    elif mfr[4] == "0" and product[:4] == "0000":
+        core = mfr[0:4] + product[4] + "4"
+    elif mfr[4] != "0" and product[:4] == "0000" and product[4] in "56789":
+        core = mfr + product[4]
+    else:
+        return None
+    upce = ns + core + check
+    return upce if expand_upc_e(upce) == upca else None
+
+
+def equivalent_forms(gtin14):
+    """Every representation of a valid GTIN-14, keyed by form name."""
+    forms = {"gtin14": gtin14}
+    if gtin14[0] != "0":
+        return forms
+    ean13 = gtin14[1:]
+    forms["ean13"] = ean13
+    if ean13[0] == "0":
+        upca = ean13[1:]
+        forms["upca"] = upca
+        upce = compress_upc_a(upca)
+        if upce:
+            forms["upce"] = upce
+        if gtin14[:6] == "000000":
+            forms["ean8"] = gtin14[6:]
+    if ean13[:3] in ("978", "979"):
+        forms["isbn13"] = ean13
+        if ean13[:3] == "978":
+            forms["isbn10"] = ean13[3:12] + isbn10_check_digit(ean13[3:12])
+    return forms
+
+
+def canonicalize(raw):
+    """
+    Classifies and validates one barcode. Returns a dict with the cleaned
+    code, its symbology, whether its check digit is valid, the canonical
+    GTIN-14 (None when not a valid GTIN) and all equivalent forms. Invalid
+    codes also carry the reason in "validation_error".
+    """
+    clean = clean_code(raw)
+    if not clean:
+        raise ValueError("Empty barcode")
+
+    symbology = UNKNOWN
+    gtin14 = None
+    error = None
+    n = len(clean)
+
+    if clean.isdigit():
+        # Only 12-14 digit codes clearly claim to be GTINs, so only they are
+        # rejected for a bad check digit. Other lengths are read as a GTIN
+        # form when their check digit works out and otherwise passed through
+        # as UNKNOWN: short internal SKUs must not turn into some product's UPC.
+        if n == 8:
+            # A code that checks out as UPC-E (number system 0/1) is read as
+            # UPC-E; US scanners emit those far more often than EAN-8.
+            upca = expand_upc_e(clean) if clean[0] in "01" else None
+            if upca:
+                symbology, gtin14 = UPC_E, "00" + upca
+            elif gtin_check_digit(clean[:-1]) == clean[-1]:
+                symbology, gtin14 = EAN_8, clean.zfill(14)
+        elif n in (12, 13, 14):
+            symbology = {12: UPC_A, 13: EAN_13, 14: GTIN_14}[n]
+            if n == 13 and clean[:3] in ("978", "979"):
+                symbology = ISBN_13
+            expected = gtin_check_digit(clean[:-1])
+            if expected == clean[-1]:
+                gtin14 = clean.zfill(14)
+            else:
+                error = f"Invalid check digit (expected {expected})"
+        elif n == 10 and is_valid_isbn10(clean):
+            symbology = ISBN_10
+    elif n == 10 and clean.startswith("B0"):
+        symbology = ASIN
+    elif n == 10 and clean[:9].isdigit() and clean[9] == "X":
+        symbology = ISBN_10
+
+    if symbology == ISBN_10:
+        if is_valid_isbn10(clean):
+            body = "978" + clean[:9]
+            gtin14 = "0" + body + gtin_check_digit(body)
+        else:
+            error = f"Invalid ISBN-10 check digit (expected {isbn10_check_digit(clean[:9])})"
+
+    result = {
+        "barcode": clean,
+        "symbology": symbology,
+        "valid": gtin14 is not None or symbology == ASIN,
+        "gtin14": gtin14,
+        "forms": equivalent_forms(gtin14) if gtin14 else {},
+    }
+    if error:
+        result["validation_error"] = error
+    return result
+
+
+def canonical_key(raw):
+    """The GTIN-14 for valid GTIN forms, otherwise the cleaned code."""
+    info = canonicalize(raw)
+    return info["gtin14"] or info["barcode"]
+
+
+def lookup_form(info):
+    """The representation upstream UPC APIs accept best: UPC-A, then EAN-13, then GTIN-14."""
+    forms = info["forms"]
+    return forms.get("upca") or forms.get("ean13") or forms.get("gtin14") or info["barcode"]
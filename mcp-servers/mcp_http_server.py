@@ -0,0 +1,300 @@
+"""
+HTTP transport for ProductDataMCPServer, so n8n can call one warm pool of
+servers with HTTP Request nodes instead of piping JSON through executeCommand.
+
+  POST /mcp      JSON-RPC request or batch. Answered as application/json, or
+                 as a server-sent event stream when the client sends
+                 "Accept: text/event-stream"; the stream carries progress
+                 notifications (getProductDataByUPC with "stream": true)
+                 followed by the response.
+  GET  /healthz  200 while serving, 503 once shutdown has begun.
+  GET  /metrics  Prometheus text format (of the worker that answers).
+
+The parent process binds the listening socket and forks MCP_HTTP_WORKERS
+workers (default: one per CPU) that all accept on it; each worker has its own
+ProductDataMCPServer and they share the on-disk SQLite cache. SIGTERM or
+SIGINT stops accepting, lets in-flight requests finish and then exits.
+
+  python3 mcp_http_server.py --port 8765 --workers 4
+"""
+import argparse
+import json
+import logging
+import os
+import signal
+import socket
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+JSON_CONTENT_TYPE = "application/json"
+SSE_CONTENT_TYPE = "text/event-stream"
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4"
+RPC_PATHS = ("/", "/mcp", "/rpc")
+STOP_SIGNALS = {signal.SIGTERM, signal.SIGINT}
+
+
+class MCPRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Headers and body are separate writes; without TCP_NODELAY Nagle plus
+    # delayed ACKs add ~40 ms to every keep-alive response.
+    disable_nagle_algorithm = True
+    server_version = "mcp-product-data"
+
+    def log_message(self, format, *args):
+        logger.debug(f"{self.address_string()} {format % args}")
+
+    def _send(self, status: int, body: str, content_type: str = JSON_CONTENT_TYPE,
+              headers: Optional[Dict[str, str]] = None) -> None:
+        data = body.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        if self.server.draining:
+            self.send_header("Connection", "close")
+            self.close_connection = True
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _send_json(self, status: int, payload) -> None:
+        self._send(status, json.dumps(payload))
+
+    def do_GET(self):
+        path = self.path.split("?", 1)[0]
+        if path == "/healthz":
+            status = 503 if self.server.draining else 200
+            self._send_json(status, {"status": "draining" if self.server.draining else "ok",
+                                     "pid": os.getpid(),
+                                     "in_flight": self.server.in_flight,
+                                     "uptime_s": round(time.monotonic() - self.server.started, 1)})
+        elif path == "/metrics":
+            self._send(200, self.server.mcp.metrics.render_prometheus(), PROMETHEUS_CONTENT_TYPE)
+        else:
+            self._send_json(404, {"error": f"Unknown path: {path}"})
+
+    def do_POST(self):
+        path = self.path.split("?", 1)[0]
+        if path not in RPC_PATHS:
+            self._send_json(404, {"error": f"Unknown path: {path}"})
+            return
+        try:
+            length = int(self.headers.get("Content-Length") or 0)
+        except ValueError:
+            length = -1
+        if length <= 0:
+            self._send_json(411, {"error": "A JSON-RPC body with Content-Length is required"})
+            return
+        if length > self.server.max_body_bytes:
+            self._send_json(413, {"error": f"Request body too large ({length} > {self.server.max_body_bytes} bytes)"})
+            self.close_connection = True
+            return
+        body = self.rfile.read(length).decode("utf-8", "replace")
+
+        if SSE_CONTENT_TYPE in (self.headers.get("Accept") or ""):
+            self._stream_response(body)
+            return
+        self.server.request_started()
+        try:
+            response = self.server.mcp.handle_request(body)
+        finally:
+            self.server.request_finished()
+        self._send(200, response)
+
+    def _stream_response(self, body: str) -> None:
+        """
+        Answers as an event stream: notifications are written as they happen,
+        then the response. The stream has no length, so it ends by closing.
+        """
+        self.send_response(200)
+        self.send_header("Content-Type", SSE_CONTENT_TYPE)
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+        lock = threading.Lock()
+
+        def emit(data: str) -> None:
+            with lock:
+                self.wfile.write(_sse_event(data).encode("utf-8"))
+                self.wfile.flush()
+
+        self.server.request_started()
+        try:
+            response = self.server.mcp.handle_request(body, lambda notification: emit(json.dumps(notification)))
+        finally:
+            self.server.request_finished()
+        emit(response)
+
+
+def _sse_event(data: str, event: str = "message") -> str:
+    return f"event: {event}\ndata: {data}\n\n"
+
+
+class MCPHTTPServer(ThreadingHTTPServer):
+    """One worker's HTTP server; tracks in-flight requests so shutdown can drain them."""
+
+    daemon_threads = True
+
+    def __init__(self, sock: socket.socket, mcp, max_body_bytes: int):
+        super().__init__(sock.getsockname()[:2], MCPRequestHandler, bind_and_activate=False)
+        self.socket.close()
+        self.socket = sock
+        self.mcp = mcp
+        self.max_body_bytes = max_body_bytes
+        self.draining = False
+        self.in_flight = 0
+        self.started = time.monotonic()
+        self._idle = threading.Condition()
+
+    def request_started(self) -> None:
+        with self._idle:
+            self.in_flight += 1
+
+    def request_finished(self) -> None:
+        with self._idle:
+            self.in_flight -= 1
+            self._idle.notify_all()
+
+    def drain(self, timeout_s: float) -> bool:
+        """Stops accepting and waits for in-flight requests; False if some were still running at the timeout."""
+        self.draining = True
+        self.shutdown()
+        deadline = time.monotonic() + timeout_s
+        with self._idle:
+            while self.in_flight:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._idle.wait(remaining)
+        return True
+
+
+def bind_socket(host: str, port: int, backlog: int = 128) -> socket.socket:
+    family = socket.AF_INET6 if ":" in host else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    return sock
+
+
+def run_worker(sock: socket.socket, max_body_bytes: int, shutdown_timeout_s: float) -> None:
+    """Serves on an already-listening socket until SIGTERM/SIGINT, then drains."""
+    stop = threading.Event()
+    for signum in STOP_SIGNALS:
+        signal.signal(signum, lambda signum, frame: stop.set())
+    if hasattr(signal, "pthread_sigmask"):
+        # Blocked by serve() across the fork; safe to deliver now that the
+        # parent's handler is replaced.
+        signal.pthread_sigmask(signal.SIG_UNBLOCK, STOP_SIGNALS)
+
+    # Imported here so the server, its HTTP sessions and SQLite connection are
+    # created after the fork, never shared between processes.
+    from mcp_product_data import ProductDataMCPServer
+
+    server = MCPHTTPServer(sock, ProductDataMCPServer(), max_body_bytes)
+
+    thread = threading.Thread(target=server.serve_forever, name="http-accept", daemon=True)
+    thread.start()
+    logger.info(f"Worker serving on {sock.getsockname()[:2]}")
+    while not stop.wait(1.0):
+        if not thread.is_alive():
+            break
+    logger.info("Worker draining")
+    if not server.drain(shutdown_timeout_s):
+        logger.warning(f"Worker exiting with {server.in_flight} requests still in flight")
+    server.server_close()
+    server.mcp.lookup_executor.shutdown(wait=False)
+    if server.mcp.refresher:
+        server.mcp.refresher.close()
+    if server.mcp.inventory:
+        server.mcp.inventory.close()
+    if server.mcp.cache:
+        server.mcp.cache.close()
+
+
+def serve(host: str, port: int, workers: int, max_body_bytes: int = 10 * 1024 * 1024,
+          shutdown_timeout_s: float = 30.0) -> None:
+    """Binds once and runs `workers` forked worker processes, restarting any that die."""
+    sock = bind_socket(host, port)
+    logger.info(f"mcp-product-data HTTP listening on http://{host}:{sock.getsockname()[1]} with {workers} workers")
+
+    if workers <= 1 or not hasattr(os, "fork"):
+        run_worker(sock, max_body_bytes, shutdown_timeout_s)
+        return
+
+    children: List[int] = []
+    stopping = threading.Event()
+
+    def spawn() -> int:
+        # A child inherits the parent's stop handler, which would SIGTERM its
+        # siblings; the stop signals stay blocked until run_worker replaces it.
+        signal.pthread_sigmask(signal.SIG_BLOCK, STOP_SIGNALS)
+        try:
+            pid = os.fork()
+        except OSError:
+            signal.pthread_sigmask(signal.SIG_UNBLOCK, STOP_SIGNALS)
+            raise
+        if pid == 0:
+            code = 0
+            try:
+                run_worker(sock, max_body_bytes, shutdown_timeout_s)
+            except Exception:
+                logger.exception("Worker crashed")
+                code = 1
+            finally:
+                os._exit(code)
+        signal.pthread_sigmask(signal.SIG_UNBLOCK, STOP_SIGNALS)
+        return pid
+
+    def stop(signum, frame):
+        stopping.set()
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    children.extend(spawn() for _ in range(workers))
+
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        except InterruptedError:
+            continue
+        if pid in children:
+            children.remove(pid)
+        if not stopping.is_set():
+            logger.warning(f"Worker {pid} exited with status {status}; restarting")
+            time.sleep(0.5)  # keep a crash-looping worker from spinning
+            children.append(spawn())
+    sock.close()
+    logger.info("mcp-product-data HTTP stopped")
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - [%(process)d] %(message)s')
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default=os.getenv("MCP_HTTP_HOST", "127.0.0.1"))
+    parser.add_argument("--port", type=int, default=int(os.getenv("MCP_HTTP_PORT", "8765")))
+    parser.add_argument("--workers", type=int, default=int(os.getenv("MCP_HTTP_WORKERS", os.cpu_count() or 1)))
+    parser.add_argument("--max-body-bytes", type=int,
+                        default=int(os.getenv("MCP_HTTP_MAX_BODY_BYTES", 10 * 1024 * 1024)))
+    parser.add_argument("--shutdown-timeout-s", type=float,
+                        default=float(os.getenv("MCP_HTTP_SHUTDOWN_TIMEOUT_S", "30")))
+    args = parser.parse_args()
+    serve(args.host, args.port, args.workers, args.max_body_bytes, args.shutdown_timeout_s)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
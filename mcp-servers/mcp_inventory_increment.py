@@ -0,0 +1,353 @@
+#!/usr/bin/env python3
+"""
+Inventory increments for scanned barcodes.
+
+stdin:  {"barcode": "012345678905", "qty": 1}   (the normalizer's output works as-is)
+stdout: {"id": 17, "barcode": "012345678905", "qty": 42, "title": "...", "created": false,
+         "delta": 1, "coalesced": 1}
+
+Stream: --stream reads NDJSON (or one raw barcode per line) and writes one
+        NDJSON result per line, in input order.
+Replay: --replay applies increments left in the journal and exits.
+Migrate: --migrate creates or extends the tables and exits; run it on deploy.
+        Otherwise a start only checks the catalog and migrates when something
+        is missing.
+
+One upsert (INSERT ... ON CONFLICT (barcode) DO UPDATE SET qty = qty +
+EXCLUDED.qty) both creates unknown products and increments known ones, and
+tells the caller which happened, so no SELECT is needed first. In a
+long-running process (the incrementInventory method of ProductDataMCPServer,
+or --stream) scans arriving within MCP_INVENTORY_FLUSH_MS of each other are
+coalesced per barcode into one delta and written as a single batch.
+
+Durability: a caller is answered only after its batch has committed. If the
+write fails and MCP_INVENTORY_JOURNAL is set, the batch is appended (and
+fsynced) to that journal instead and the caller gets "journaled": true; the
+journal is replayed before the next batch and on start, exactly once, since
+every journaled batch id is recorded in the same transaction as its rows.
+close() flushes whatever is still buffered.
+"""
+import fcntl
+import json, sys
+import logging
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import Future
+from typing import Any, Dict, List, Optional, Tuple
+
+import mcp_db
+from mcp_gtin import canonicalize, lookup_form
+
+logger = logging.getLogger(__name__)
+
+INVENTORY_SCHEMA = (
+    """CREATE TABLE IF NOT EXISTS inventory_journal_applied (
+        batch_id TEXT PRIMARY KEY,
+        applied_at TIMESTAMPTZ NOT NULL DEFAULT now()
+    )""",
+)
+INVENTORY_TABLES = ("inventory_journal_applied",)
+
+# xmax is 0 only for rows this statement inserted.
+UPSERT_SQL = """INSERT INTO products (barcode, gtin14, qty) VALUES %s
+ON CONFLICT (barcode) DO UPDATE SET qty = products.qty + EXCLUDED.qty, updated_at = now()
+RETURNING id, barcode, qty, title, (xmax = 0) AS created"""
+
+
+def inventory_key(barcode: Any) -> Tuple[str, Optional[str]]:
+    """
+    (products.barcode, gtin14) for a scanned code: the same lookup form the
+    bulk importer stores, so every GTIN form of a product hits one row.
+    """
+    info = canonicalize(barcode)
+    if info.get("validation_error"):
+        raise ValueError(f"Invalid barcode {info['barcode']}: {info['validation_error']}")
+    return lookup_form(info), info["gtin14"]
+
+
+class InventoryIncrementer:
+    """Buffers increments for flush_ms, coalesces them per barcode and upserts each buffer as one batch."""
+
+    def __init__(self, flush_ms: float = 5.0, max_batch: int = 500, journal_path: Optional[str] = None):
+        self.flush_s = flush_ms / 1000.0
+        self.max_batch = max_batch
+        self.journal_path = journal_path
+        self.stats = {"scans": 0, "batches": 0, "rows": 0, "journaled": 0, "replayed": 0}
+
+        # barcode -> [gtin14, [(qty, future), ...]]
+        self._pending: Dict[str, List[Any]] = {}
+        self._changed = threading.Condition()
+        self._journal_lock = threading.Lock()
+        self._closed = False
+        self._schema_ready = False
+
+        try:
+            self.replay_journal()
+        except Exception as e:
+            # Scans are still accepted (and journaled); replay is retried before every batch.
+            logger.warning(f"Could not replay the inventory journal yet: {e}")
+        self._writer = threading.Thread(target=self._write_loop, name="inventory-writer", daemon=True)
+        self._writer.start()
+
+    @classmethod
+    def from_env(cls) -> "InventoryIncrementer":
+        return cls(
+            flush_ms=float(os.getenv("MCP_INVENTORY_FLUSH_MS", 5)),
+            max_batch=int(os.getenv("MCP_INVENTORY_MAX_BATCH", 500)),
+            journal_path=os.getenv("MCP_INVENTORY_JOURNAL") or None,
+        )
+
+    def submit(self, barcode: Any, qty: int = 1) -> Future:
+        """Queues one increment; the future resolves once it has been written."""
+        key, gtin14 = inventory_key(barcode)
+        future = Future()
+        with self._changed:
+            if self._closed:
+                raise RuntimeError("Inventory incrementer is closed")
+            entry = self._pending.setdefault(key, [gtin14, []])
+            entry[1].append((int(qty), future))
+            self.stats["scans"] += 1
+            self._changed.notify_all()
+        return future
+
+    def increment(self, barcode: Any, qty: int = 1, timeout_s: float = 30.0) -> Dict[str, Any]:
+        return self.submit(barcode, qty).result(timeout=timeout_s)
+
+    def _write_loop(self) -> None:
+        while True:
+            with self._changed:
+                while not self._pending and not self._closed:
+                    self._changed.wait()
+                if not self._pending:
+                    return
+                # Let a burst of scans land in the same batch.
+                flush_at = time.monotonic() + self.flush_s
+                while not self._closed and len(self._pending) < self.max_batch:
+                    remaining = flush_at - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._changed.wait(remaining)
+                barcodes = list(self._pending)[:self.max_batch]
+                batch = {barcode: self._pending.pop(barcode) for barcode in barcodes}
+                self._changed.notify_all()
+            self._write_batch(batch)
+
+    def _write_batch(self, batch: Dict[str, List[Any]]) -> None:
+        # Sorted, so concurrent batches from other processes lock rows in the same order.
+        deltas = {barcode: (gtin14, sum(qty for qty, _ in scans)) for barcode, (gtin14, scans) in sorted(batch.items())}
+        try:
+            if self.journal_path:
+                self.replay_journal()
+            rows = self._upsert(deltas)
+        except Exception as e:
+            if not self.journal_path:
+                logger.error(f"Inventory batch of {len(deltas)} barcodes failed: {e}")
+                self._resolve(batch, error=e)
+                return
+            try:
+                self._journal(deltas)
+            except Exception as journal_error:
+                logger.exception("Could not journal a failed inventory batch")
+                self._resolve(batch, error=journal_error)
+                return
+            logger.warning(f"Inventory batch of {len(deltas)} barcodes journaled after write failure: {e}")
+            self._resolve(batch, journaled=True)
+            return
+        self.stats["batches"] += 1
+        self.stats["rows"] += len(rows)
+        self._resolve(batch, rows=rows)
+
+    def _ensure_schema(self) -> None:
+        if not self._schema_ready:
+            mcp_db.ensure_schema(INVENTORY_SCHEMA, tables=INVENTORY_TABLES)
+            self._schema_ready = True
+
+    def _upsert(self, deltas: Dict[str, Tuple[Optional[str], int]], batch_id: Optional[str] = None) -> Dict[str, Dict[str, Any]]:
+        """Applies deltas in one transaction; with batch_id, only if that journaled batch was not applied yet."""
+        from psycopg2.extras import execute_values
+
+        self._ensure_schema()
+        with mcp_db.connection() as conn, conn.cursor() as cur:
+            if batch_id is not None:
+                cur.execute("INSERT INTO inventory_journal_applied (batch_id) VALUES (%s) "
+                            "ON CONFLICT DO NOTHING RETURNING batch_id", (batch_id,))
+                if cur.fetchone() is None:
+                    return {}
+            returned = execute_values(cur, UPSERT_SQL,
+                                      [(barcode, gtin14, qty) for barcode, (gtin14, qty) in deltas.items()],
+                                      page_size=max(len(deltas), 1), fetch=True)
+        return {row[1]: {"id": row[0], "barcode": row[1], "qty": row[2], "title": row[3], "created": row[4]}
+                for row in returned}
+
+    @staticmethod
+    def _resolve(batch: Dict[str, List[Any]], rows: Optional[Dict[str, Dict[str, Any]]] = None,
+                 journaled: bool = False, error: Optional[BaseException] = None) -> None:
+        for barcode, (_, scans) in batch.items():
+            for qty, future in scans:
+                if error is not None:
+                    future.set_exception(error)
+                elif journaled:
+                    future.set_result({"barcode": barcode, "delta": qty, "journaled": True})
+                else:
+                    future.set_result(dict(rows.get(barcode, {"barcode": barcode}), delta=qty, coalesced=len(scans)))
+
+    def _journal(self, deltas: Dict[str, Tuple[Optional[str], int]]) -> None:
+        line = json.dumps({"batch_id": uuid.uuid4().hex, "deltas": deltas}) + "\n"
+        with self._journal_lock:
+            with open(self.journal_path, "a") as journal:
+                # Every incrementer process sharing the journal appends and replays under this lock.
+                fcntl.flock(journal, fcntl.LOCK_EX)
+                journal.write(line)
+                journal.flush()
+                os.fsync(journal.fileno())
+        self.stats["journaled"] += 1
+
+    def replay_journal(self) -> int:
+        """
+        Applies every journaled batch not applied yet, then empties the
+        journal; returns how many were applied. The file stays locked from
+        read to truncation, so no other process's append is lost in between.
+        Lines that do not parse are moved to <journal>.bad instead of
+        blocking every later replay.
+        """
+        if not self.journal_path:
+            return 0
+        with self._journal_lock:
+            if not os.path.exists(self.journal_path) or os.path.getsize(self.journal_path) == 0:
+                return 0
+            with open(self.journal_path, "r+") as journal:
+                fcntl.flock(journal, fcntl.LOCK_EX)
+                entries, bad = [], []
+                for line in journal:
+                    if not line.strip():
+                        continue
+                    try:
+                        entry = json.loads(line)
+                        entries.append((entry["batch_id"],
+                                        {barcode: tuple(value) for barcode, value in entry["deltas"].items()}))
+                    except (ValueError, KeyError, TypeError, AttributeError):
+                        bad.append(line if line.endswith("\n") else line + "\n")
+                applied = 0
+                for batch_id, deltas in entries:
+                    if self._upsert(deltas, batch_id=batch_id):
+                        applied += 1
+                if bad:
+                    with open(self.journal_path + ".bad", "a") as quarantine:
+                        quarantine.writelines(bad)
+                        quarantine.flush()
+                        os.fsync(quarantine.fileno())
+                    logger.error(f"Moved {len(bad)} unreadable inventory journal lines to {self.journal_path}.bad")
+                # Every entry is now recorded as applied, so a crash before this
+                # truncation only causes a harmless second replay.
+                journal.seek(0)
+                journal.truncate()
+                journal.flush()
+                os.fsync(journal.fileno())
+            self.stats["replayed"] += applied
+        if applied:
+            logger.info(f"Replayed {applied} journaled inventory batches")
+        return applied
+
+    def flush(self, timeout_s: float = 30.0) -> bool:
+        """Waits until every queued increment has been handed to the writer; False on timeout."""
+        deadline = time.monotonic() + timeout_s
+        with self._changed:
+            self._changed.notify_all()
+            while self._pending:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._changed.wait(remaining)
+        return True
+
+    def close(self, timeout_s: float = 30.0) -> None:
+        """
+        Stops accepting increments, writes what is buffered and waits for the
+        writer. Increments still queued after timeout_s were never written;
+        their callers get an error.
+        """
+        with self._changed:
+            self._closed = True
+            self._changed.notify_all()
+        self._writer.join(timeout_s)
+        with self._changed:
+            abandoned, self._pending = self._pending, {}
+            self._changed.notify_all()
+        if abandoned:
+            logger.error(f"Inventory incrementer closed with {len(abandoned)} barcodes not written")
+            self._resolve(abandoned, error=RuntimeError("Inventory incrementer closed before the increment was written"))
+
+
+def _parse_line(line: str) -> Tuple[Any, Any]:
+    if line.startswith("{"):
+        data = json.loads(line)
+        return data.get("barcode", ""), data.get("qty", 1)
+    return line, 1
+
+
+def stream(incrementer: InventoryIncrementer, infile, outfile) -> None:
+    """NDJSON in, NDJSON out, in input order; a burst of lines is coalesced into few batches."""
+    pending: List[Tuple[str, Optional[Future], Optional[str]]] = []
+
+    def write_done(wait: bool) -> None:
+        while pending and (wait or pending[0][1] is None or pending[0][1].done()):
+            line, future, error = pending.pop(0)
+            if future is not None:
+                try:
+                    outfile.write(json.dumps(future.result()) + "\n")
+                    continue
+                except Exception as e:
+                    error = str(e)
+            outfile.write(json.dumps({"input": line, "error": error}) + "\n")
+        outfile.flush()
+
+    for line in infile:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            barcode, qty = _parse_line(line)
+            pending.append((line, incrementer.submit(barcode, qty), None))
+        except Exception as e:
+            pending.append((line, None, str(e)))
+        write_done(wait=False)
+    write_done(wait=True)
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    args = sys.argv[1:]
+    if "--migrate" in args:
+        try:
+            mcp_db.migrate(INVENTORY_SCHEMA)
+        except Exception as e:
+            print(f"Migration failed: {e}", file=sys.stderr)
+            sys.exit(1)
+        finally:
+            mcp_db.close_pool()
+        print(json.dumps({"migrated": True}))
+        return
+    try:
+        incrementer = InventoryIncrementer.from_env()
+    except Exception as e:
+        print(f"Inventory database unavailable: {e}", file=sys.stderr)
+        sys.exit(1)
+    try:
+        if "--replay" in args:
+            print(json.dumps({"replayed": incrementer.stats["replayed"]}))
+        elif "--stream" in args:
+            stream(incrementer, sys.stdin, sys.stdout)
+        else:
+            data = json.load(sys.stdin)
+            print(json.dumps(incrementer.increment(data.get("barcode", ""), data.get("qty", 1))))
+    except Exception as e:
+        print(str(e), file=sys.stderr)
+        sys.exit(1)
+    finally:
+        incrementer.close()
+        mcp_db.close_pool()
+
+if __name__ == "__main__":
+    main()
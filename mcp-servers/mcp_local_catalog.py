@@ -0,0 +1,462 @@
+#!/usr/bin/env python3
+"""
+Local product catalog built from supplier feed files, looked up before any
+network source.
+
+  python3 mcp_local_catalog.py import feed.csv --supplier acme
+  python3 mcp_local_catalog.py get 012345678905
+  python3 mcp_local_catalog.py search "acme widg"
+  python3 mcp_local_catalog.py compact
+  python3 mcp_local_catalog.py stats
+
+The catalog is a directory (MCP_LOCAL_CATALOG_DIR or --dir) of immutable
+segments listed in catalog.json. Each import writes one new segment, so
+feed updates never rebuild what is already there; newer segments win and a
+row with a true "deleted" column hides the product. Every segment has:
+
+  .dat  the records, compact JSON back to back
+  .idx  fixed-width (GTIN-14, offset, length) entries sorted by GTIN-14
+  .tix  "normalized title<TAB>GTIN-14" lines sorted by title
+  .tof  the offset of every .tix line
+
+All of them are memory-mapped and binary searched, so a lookup costs a few
+page reads and microseconds, and the catalog lives in the page cache rather
+than in the process. Once there are more than MCP_LOCAL_CATALOG_MAX_SEGMENTS
+segments an import compacts them into one.
+
+Feeds are CSV, NDJSON or a JSON array. Columns: barcode/upc/ean/gtin, and
+any of title/name, brand, description, price, currency, images (a list, or
+"|"-separated), category, mpn, model, manufacturer, deleted.
+"""
+import csv
+import fcntl
+import json
+import logging
+import mmap
+import os
+import re
+import struct
+import sys
+import threading
+import time
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from mcp_gtin import canonical_key
+
+logger = logging.getLogger(__name__)
+
+MANIFEST = "catalog.json"
+KEY_WIDTH = 14
+INDEX_ENTRY = struct.Struct(f"<{KEY_WIDTH}sQI")  # key, offset in .dat, length (0 = deleted)
+TITLE_OFFSET = struct.Struct("<Q")
+
+BARCODE_COLUMNS = ("barcode", "upc", "ean", "gtin", "code")
+FIELD_COLUMNS = {
+    "title": ("title", "name", "product_name", "item_name"),
+    "brand": ("brand",),
+    "description": ("description",),
+    "price": ("price",),
+    "currency": ("currency",),
+    "images": ("images", "image", "image_url", "images_urls"),
+    "category": ("category",),
+    "mpn": ("mpn",),
+    "model": ("model",),
+    "manufacturer": ("manufacturer",),
+}
+_WHITESPACE = re.compile(r"\s+")
+
+
+def catalog_key(barcode: Any) -> Optional[bytes]:
+    """The index key for a barcode: its GTIN-14 (or cleaned code), or None if it cannot be indexed."""
+    try:
+        key = canonical_key(barcode)
+    except ValueError:
+        return None
+    return key.encode("ascii").ljust(KEY_WIDTH) if len(key) <= KEY_WIDTH else None
+
+
+def normalize_title(title: str) -> str:
+    return _WHITESPACE.sub(" ", title).strip().lower()
+
+
+def _truthy(value: Any) -> bool:
+    return str(value).strip().lower() in ("1", "true", "yes", "y", "deleted")
+
+
+def _record(row: Dict[str, Any], supplier: Optional[str]) -> Dict[str, Any]:
+    """Maps one feed row onto the fields ProductRecord.from_mapping reads."""
+    lowered = {str(name).strip().lower(): value for name, value in row.items()}
+    record: Dict[str, Any] = {}
+    for field, names in FIELD_COLUMNS.items():
+        for name in names:
+            value = lowered.get(name)
+            if value not in (None, ""):
+                record[field] = value
+                break
+    images = record.get("images")
+    if isinstance(images, str):
+        record["images"] = [url.strip() for url in images.split("|") if url.strip()]
+    if "price" in record:
+        try:
+            record["price"] = float(record["price"])
+        except (TypeError, ValueError):
+            del record["price"]
+    if supplier:
+        record["supplier"] = supplier
+    return record
+
+
+def read_feed(path: str) -> Iterator[Dict[str, Any]]:
+    """Rows of a CSV, NDJSON or JSON array feed, as dicts."""
+    if path.lower().endswith(".csv"):
+        with open(path, newline="") as f:
+            yield from csv.DictReader(f)
+        return
+    with open(path) as f:
+        first = f.read(1)
+        while first and first.isspace():
+            first = f.read(1)
+        f.seek(0)
+        if first == "[":
+            yield from json.load(f)
+            return
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+class Segment:
+    """One immutable, memory-mapped segment."""
+
+    def __init__(self, directory: str, name: str):
+        self.name = name
+        base = os.path.join(directory, name)
+        self._maps = []
+        self.data = self._map(base + ".dat")
+        self.index = self._map(base + ".idx")
+        self.titles = self._map(base + ".tix")
+        self.title_offsets = self._map(base + ".tof")
+        self.count = len(self.index) // INDEX_ENTRY.size if self.index else 0
+        self.title_count = len(self.title_offsets) // TITLE_OFFSET.size if self.title_offsets else 0
+
+    def _map(self, path: str):
+        with open(path, "rb") as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return None  # empty files cannot be mapped
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._maps.append(mapped)
+        return mapped
+
+    def _key_at(self, i: int) -> bytes:
+        start = i * INDEX_ENTRY.size
+        return self.index[start:start + KEY_WIDTH]
+
+    def find(self, key: bytes) -> Optional[Tuple[int, int]]:
+        """(offset, length) of the key's record, length 0 for a deletion; None when absent."""
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._key_at(mid) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < self.count and self._key_at(lo) == key:
+            _, offset, length = INDEX_ENTRY.unpack_from(self.index, lo * INDEX_ENTRY.size)
+            return offset, length
+        return None
+
+    def read(self, offset: int, length: int) -> Dict[str, Any]:
+        return json.loads(self.data[offset:offset + length])
+
+    def _title_line(self, i: int) -> bytes:
+        start = TITLE_OFFSET.unpack_from(self.title_offsets, i * TITLE_OFFSET.size)[0]
+        return self.titles[start:self.titles.find(b"\n", start)]
+
+    def title_prefix(self, prefix: bytes, limit: int) -> Iterator[bytes]:
+        """GTIN keys of titles starting with prefix, in title order."""
+        lo, hi = 0, self.title_count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._title_line(mid) < prefix:
+                lo = mid + 1
+            else:
+                hi = mid
+        found = 0
+        while lo < self.title_count and found < limit:
+            title, _, key = self._title_line(lo).rpartition(b"\t")
+            if not title.startswith(prefix):
+                break
+            yield key.ljust(KEY_WIDTH)
+            lo += 1
+            found += 1
+
+    def close(self) -> None:
+        for mapped in self._maps:
+            mapped.close()
+
+
+def write_segment(directory: str, name: str, records: Iterator[Tuple[bytes, Optional[Dict[str, Any]]]]) -> int:
+    """
+    Writes one segment from (key, record or None for a deletion) pairs;
+    later pairs for the same key win. Returns the number of keys written.
+    """
+    base = os.path.join(directory, name)
+    entries: Dict[bytes, Tuple[int, int]] = {}
+    titles: List[bytes] = []
+    with open(base + ".dat", "wb") as data:
+        offset = 0
+        for key, record in records:
+            if record is None:
+                entries[key] = (offset, 0)
+                continue
+            encoded = json.dumps(record, separators=(",", ":")).encode("utf-8")
+            data.write(encoded)
+            entries[key] = (offset, len(encoded))
+            offset += len(encoded)
+            title = record.get("title")
+            if title:
+                titles.append(normalize_title(str(title)).encode("utf-8") + b"\t" + key.rstrip())
+        data.flush()
+        os.fsync(data.fileno())
+
+    with open(base + ".idx", "wb") as index:
+        for key in sorted(entries):
+            index.write(INDEX_ENTRY.pack(key, *entries[key]))
+        os.fsync(index.fileno())
+    # Titles whose record was replaced later in the same feed are filtered out
+    # at search time, when the key's current record is read.
+    titles.sort()
+    with open(base + ".tix", "wb") as tix, open(base + ".tof", "wb") as tof:
+        position = 0
+        for line in titles:
+            tof.write(TITLE_OFFSET.pack(position))
+            tix.write(line + b"\n")
+            position += len(line) + 1
+        os.fsync(tix.fileno())
+        os.fsync(tof.fileno())
+    return len(entries)
+
+
+class LocalCatalog:
+    """Reads (and, through import_feed/compact, writes) one catalog directory."""
+
+    def __init__(self, directory: str, max_segments: int = 8, reload_interval_s: float = 1.0):
+        self.directory = directory
+        self.max_segments = max_segments
+        self.reload_interval_s = reload_interval_s
+        self._segments: List[Segment] = []  # newest first
+        self._manifest_mtime = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self._reload()
+
+    @classmethod
+    def from_env(cls) -> Optional["LocalCatalog"]:
+        directory = os.getenv("MCP_LOCAL_CATALOG_DIR")
+        if not directory:
+            return None
+        return cls(directory, max_segments=int(os.getenv("MCP_LOCAL_CATALOG_MAX_SEGMENTS", 8)))
+
+    # -- reading ---------------------------------------------------------
+
+    def _manifest_path(self) -> str:
+        return os.path.join(self.directory, MANIFEST)
+
+    def _read_manifest(self) -> Dict[str, Any]:
+        try:
+            with open(self._manifest_path()) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {"version": 1, "next_segment": 1, "segments": []}
+
+    def _reload(self) -> None:
+        """Picks up segments added or removed by another process since the last look."""
+        try:
+            mtime = os.stat(self._manifest_path()).st_mtime_ns
+        except FileNotFoundError:
+            mtime = None
+        with self._lock:
+            self._checked_at = time.monotonic()
+            if mtime == self._manifest_mtime:
+                return
+            names = [segment["name"] for segment in self._read_manifest()["segments"]]
+            current = {segment.name: segment for segment in self._segments}
+            # Segments dropped by a compaction stay readable while mapped.
+            self._segments = [current.pop(name, None) or Segment(self.directory, name) for name in reversed(names)]
+            for segment in current.values():
+                segment.close()
+            self._manifest_mtime = mtime
+
+    def _maybe_reload(self) -> List[Segment]:
+        if time.monotonic() - self._checked_at >= self.reload_interval_s:
+            self._reload()
+        return self._segments
+
+    def _get_key(self, key: bytes, segments: List[Segment]) -> Optional[Dict[str, Any]]:
+        for segment in segments:
+            found = segment.find(key)
+            if found is not None:
+                offset, length = found
+                return segment.read(offset, length) if length else None
+        return None
+
+    def get(self, barcode: Any) -> Optional[Dict[str, Any]]:
+        """The newest record for a barcode, or None if unknown or deleted."""
+        key = catalog_key(barcode)
+        if key is None:
+            return None
+        return self._get_key(key, self._maybe_reload())
+
+    def search_title(self, prefix: str, limit: int = 20) -> List[Dict[str, Any]]:
+        """Products whose current title starts with prefix (case and spacing insensitive)."""
+        wanted = normalize_title(prefix).encode("utf-8")
+        if not wanted:
+            return []
+        segments = self._maybe_reload()
+        results, seen = [], set()
+        for segment in segments:
+            for key in segment.title_prefix(wanted, limit * 4):
+                if key in seen:
+                    continue
+                seen.add(key)
+                record = self._get_key(key, segments)
+                # A newer segment may have renamed or deleted the product.
+                if record and normalize_title(str(record.get("title", ""))).encode("utf-8").startswith(wanted):
+                    results.append(dict(record, gtin=key.decode("ascii").rstrip()))
+        results.sort(key=lambda record: normalize_title(str(record.get("title", ""))))
+        return results[:limit]
+
+    def stats(self) -> Dict[str, Any]:
+        segments = self._maybe_reload()
+        return {"directory": self.directory, "segments": len(segments),
+                "keys": sum(segment.count for segment in segments),
+                "titles": sum(segment.title_count for segment in segments)}
+
+    # -- writing ---------------------------------------------------------
+
+    def _write_manifest(self, manifest: Dict[str, Any]) -> None:
+        tmp = self._manifest_path() + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(manifest, f, indent=1)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self._manifest_path())
+
+    def _locked(self):
+        lock = open(os.path.join(self.directory, "catalog.lock"), "w")
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        return lock
+
+    def import_feed(self, path: str, supplier: Optional[str] = None) -> Dict[str, Any]:
+        """Adds one feed as a new segment; compacts when there are too many segments."""
+        stats = {"rows": 0, "skipped": 0, "deleted": 0}
+
+        def records():
+            for row in read_feed(path):
+                stats["rows"] += 1
+                lowered = {str(name).strip().lower(): value for name, value in row.items()}
+                barcode = next((lowered[name] for name in BARCODE_COLUMNS if lowered.get(name)), None)
+                key = catalog_key(barcode) if barcode else None
+                if key is None:
+                    stats["skipped"] += 1
+                    continue
+                if _truthy(lowered.get("deleted", "")):
+                    stats["deleted"] += 1
+                    yield key, None
+                    continue
+                record = _record(row, supplier)
+                if set(record) <= {"supplier"}:
+                    stats["skipped"] += 1  # nothing but a barcode
+                    continue
+                yield key, record
+
+        with self._locked():
+            manifest = self._read_manifest()
+            name = f"seg-{manifest['next_segment']:06d}"
+            stats["keys"] = write_segment(self.directory, name, records())
+            manifest["next_segment"] += 1
+            manifest["segments"].append({"name": name, "feed": os.path.basename(path), "supplier": supplier,
+                                         "keys": stats["keys"], "created_at": int(time.time())})
+            self._write_manifest(manifest)
+            compact = len(manifest["segments"]) > self.max_segments
+        self._reload()
+        if compact:
+            stats["compacted"] = self.compact()
+        return stats
+
+    def compact(self) -> Dict[str, Any]:
+        """Merges every segment into one, dropping replaced and deleted records."""
+        with self._locked():
+            manifest = self._read_manifest()
+            names = [segment["name"] for segment in manifest["segments"]]
+            if len(names) <= 1:
+                return {"segments": len(names)}
+            segments = [Segment(self.directory, name) for name in reversed(names)]
+
+            def records():
+                keys = sorted({segment._key_at(i) for segment in segments for i in range(segment.count)})
+                for key in keys:
+                    record = self._get_key(key, segments)
+                    if record is not None:
+                        yield key, record
+
+            name = f"seg-{manifest['next_segment']:06d}"
+            keys = write_segment(self.directory, name, records())
+            manifest["next_segment"] += 1
+            manifest["segments"] = [{"name": name, "feed": None, "supplier": None, "keys": keys,
+                                     "created_at": int(time.time()), "compacted_from": names}]
+            self._write_manifest(manifest)
+            for segment in segments:
+                segment.close()
+            for old in names:
+                for ext in (".dat", ".idx", ".tix", ".tof"):
+                    os.remove(os.path.join(self.directory, old + ext))
+        self._reload()
+        return {"segments": len(names), "keys": keys}
+
+    def close(self) -> None:
+        with self._lock:
+            for segment in self._segments:
+                segment.close()
+            self._segments = []
+            self._manifest_mtime = None
+
+
+def main():
+    import argparse
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dir", default=os.getenv("MCP_LOCAL_CATALOG_DIR"), help="Catalog directory")
+    commands = parser.add_subparsers(dest="command", required=True)
+    feed = commands.add_parser("import", help="Add a feed file as a new segment")
+    feed.add_argument("feed")
+    feed.add_argument("--supplier")
+    commands.add_parser("compact", help="Merge all segments into one")
+    get = commands.add_parser("get", help="Look up one barcode")
+    get.add_argument("barcode")
+    search = commands.add_parser("search", help="Prefix search on titles")
+    search.add_argument("prefix")
+    search.add_argument("--limit", type=int, default=20)
+    commands.add_parser("stats")
+    args = parser.parse_args()
+    if not args.dir:
+        parser.error("--dir or MCP_LOCAL_CATALOG_DIR is required")
+
+    catalog = LocalCatalog(args.dir, max_segments=int(os.getenv("MCP_LOCAL_CATALOG_MAX_SEGMENTS", 8)))
+    if args.command == "import":
+        result = catalog.import_feed(args.feed, args.supplier)
+    elif args.command == "compact":
+        result = catalog.compact()
+    elif args.command == "get":
+        result = catalog.get(args.barcode)
+    elif args.command == "search":
+        result = catalog.search_title(args.prefix, args.limit)
+    else:
+        result = catalog.stats()
+    print(json.dumps(result))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,185 @@
+"""
+Field-level merge of per-source product records (the ProductRecord.to_dict()
+dicts of the UPC, eBay and Amazon sources) into one record: each field comes
+from the highest-priority source that has it, images are unioned and
+de-duplicated, prices from every offer are summarised and the source of every
+field is kept in "provenance".
+"""
+import json
+import logging
+import os
+from typing import Dict, Any, List, Optional
+from urllib.parse import urlsplit, urlunsplit
+
+logger = logging.getLogger(__name__)
+
+# Per-field source priority; sources not listed follow in the order the
+# records were given (the configured source order). "*" applies to every
+# field without its own entry.
+DEFAULT_FIELD_PRIORITY: Dict[str, List[str]] = {
+    # The local catalog holds the supplier's own data, so it leads.
+    # Listing titles on marketplaces carry seller noise ("NEW!! Free ship").
+    "product_name": ["local", "upcitemdb.com", "upcdatabase.org", "amazon.com", "ebay.com"],
+    "brand": ["local", "amazon.com", "upcitemdb.com", "upcdatabase.org"],
+    "images_urls": ["local", "amazon.com", "upcitemdb.com", "upcdatabase.org", "ebay.com"],
+}
+
+# Fields that are combined across sources instead of picked from one.
+_COMBINED_FIELDS = ("images_urls", "offers", "sources_used", "source_used", "provenance", "price_stats", "meta")
+
+
+def _is_empty(value: Any) -> bool:
+    return value in (None, "", [], {})
+
+
+def _image_key(url: str) -> str:
+    """Normalizes an image URL for de-duplication: scheme, case of the host and fragments don't matter."""
+    parts = urlsplit(url.strip())
+    return urlunsplit(("", parts.netloc.lower(), parts.path, parts.query, ""))
+
+
+def _to_price(value: Any) -> Optional[float]:
+    try:
+        price = float(value)
+    except (TypeError, ValueError):
+        return None
+    return price if price > 0 else None
+
+
+class MergeEngine:
+    def __init__(self, field_priority: Optional[Dict[str, List[str]]] = None):
+        self.field_priority = dict(DEFAULT_FIELD_PRIORITY if field_priority is None else field_priority)
+
+    @classmethod
+    def from_env(cls) -> "MergeEngine":
+        """
+        MCP_MERGE_PRIORITY overrides the per-field priorities: a JSON object
+        such as {"price": ["amazon.com", "ebay.com"], "*": [...]}, or the path
+        of a file holding one. Entries replace the defaults field by field.
+        """
+        raw = os.getenv("MCP_MERGE_PRIORITY", "").strip()
+        if not raw:
+            return cls()
+        try:
+            if not raw.startswith("{"):
+                with open(raw) as f:
+                    raw = f.read()
+            overrides = json.loads(raw)
+        except (OSError, ValueError) as e:
+            logger.error(f"Ignoring invalid MCP_MERGE_PRIORITY: {e}")
+            return cls()
+        return cls(dict(DEFAULT_FIELD_PRIORITY, **overrides))
+
+    def _ranked(self, field: str, records: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        if len(records) < 2:
+            return records  # the common single-hit lookup: nothing to rank
+        priority = self.field_priority.get(field) or self.field_priority.get("*") or []
+        rank = {source: index for index, source in enumerate(priority)}
+        ordered = sorted(enumerate(records),
+                         key=lambda item: (rank.get(item[1].get("source_used"), len(rank)), item[0]))
+        return [record for _, record in ordered]
+
+    def merge(self, records: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """Merges per-source records, given in configured source order, into one."""
+        records = [record for record in records if record]
+        if not records:
+            return {}
+
+        merged: Dict[str, Any] = {}
+        provenance: Dict[str, str] = {}
+        fields = list(dict.fromkeys(key for record in records for key in record))
+        for field in fields:
+            if field in _COMBINED_FIELDS:
+                continue
+            for record in self._ranked(field, records):
+                value = record.get(field)
+                if not _is_empty(value):
+                    merged[field] = value
+                    if field != "success":
+                        provenance[field] = record.get("source_used")
+                    break
+            else:
+                merged[field] = records[0].get(field)
+
+        images = self.merge_images(self._ranked("images_urls", records))
+        merged["images_urls"] = [image["url"] for image in images]
+        if images:
+            provenance["images_urls"] = [image["source"] for image in images]
+
+        offers = self.collect_offers(records)
+        merged["offers"] = offers
+        merged["price_stats"] = self.price_stats(offers)
+        merged["provenance"] = provenance
+        merged["sources_used"] = [record.get("source_used") for record in records]
+        merged["source_used"] = provenance.get("product_name", records[0].get("source_used"))
+        return merged
+
+    @staticmethod
+    def merge_images(records: List[Dict[str, Any]]) -> List[Dict[str, str]]:
+        """Union of every record's images in priority order, each URL once."""
+        seen = set()
+        images = []
+        for record in records:
+            for url in record.get("images_urls") or []:
+                if not isinstance(url, str) or not url.strip():
+                    continue
+                key = _image_key(url)
+                if key in seen:
+                    continue
+                seen.add(key)
+                images.append({"url": url, "source": record.get("source_used")})
+        return images
+
+    @staticmethod
+    def collect_offers(records: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Every priced offer across sources; a record without offers contributes its own price."""
+        offers = []
+        for record in records:
+            source = record.get("source_used")
+            record_offers = record.get("offers") or []
+            if not record_offers and _to_price(record.get("price")) is not None:
+                record_offers = [{"price": record.get("price"), "currency": record.get("currency")}]
+            for offer in record_offers:
+                price = _to_price(offer.get("price"))
+                if price is None:
+                    continue
+                offers.append({
+                    "source": source,
+                    "price": price,
+                    "currency": offer.get("currency") or record.get("currency") or "USD",
+                    "merchant": offer.get("merchant"),
+                })
+        return offers
+
+    @staticmethod
+    def price_stats(offers: List[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+        """
+        Min, max, median and spread of offer prices. Only offers in the most
+        common currency are compared; the rest are counted as excluded.
+        """
+        if not offers:
+            return None
+        import statistics  # pulls in fractions and decimal; only needed once there are offers
+        currencies = [offer["currency"] for offer in offers]
+        currency = max(dict.fromkeys(currencies), key=currencies.count)
+        prices = sorted(offer["price"] for offer in offers if offer["currency"] == currency)
+        median = statistics.median(prices)
+        by_source: Dict[str, Dict[str, Any]] = {}
+        for offer in offers:
+            if offer["currency"] != currency:
+                continue
+            entry = by_source.setdefault(offer["source"], {"min": offer["price"], "count": 0})
+            entry["min"] = min(entry["min"], offer["price"])
+            entry["count"] += 1
+        return {
+            "currency": currency,
+            "count": len(prices),
+            "min": prices[0],
+            "max": prices[-1],
+            "median": round(median, 2),
+            "mean": round(statistics.fmean(prices), 2),
+            "spread": round(prices[-1] - prices[0], 2),
+            "spread_pct": round((prices[-1] - prices[0]) / median * 100, 1) if median else None,
+            "excluded": len(offers) - len(prices),
+            "by_source": by_source,
+        }
@@ -2,13 +2,33 @@ import json
 import sys
 import os
 import logging
-import requests
 import base64 # Added for base64 decoding input from n8n
-from typing import Dict, List, Any, Optional
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED, TimeoutError as FutureTimeoutError
+from typing import Callable, Dict, List, Any, Optional
 from dataclasses import dataclass
 
-# Configure logging
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+from mcp_barcode_normalizer import normalize_barcode
+from mcp_gtin import canonicalize, canonical_key, lookup_form
+from mcp_upc_lookup import lookup_upc
+from mcp_ebay import fetch_ebay, lookup_ebay
+from mcp_amazon import fetch_amazon, lookup_amazon
+import mcp_transport
+from mcp_transport import get_transport
+from mcp_singleflight import SingleFlight
+import mcp_trace
+from mcp_trace import RequestTracer
+from mcp_metrics import MetricsRegistry
+from mcp_local_catalog import LocalCatalog
+from mcp_merge import MergeEngine
+from mcp_record import ProductRecord
+from mcp_projection import RAW_MODES, parse_output_options, project, shape_output, wants_raw
+from mcp_refresher import BackgroundRefresher
+from mcp_source_health import SourceHealthRegistry
+from mcp_cache import (ProductCache, CACHE_MODES, CACHE_MODE_DEFAULT, CACHE_MODE_REFRESH,
+                       CACHE_MODE_REFRESH_PRICING, CACHE_MODE_BYPASS)
+
 logger = logging.getLogger(__name__)
 
 @dataclass
@@ -25,116 +45,169 @@ class MCPResponse:
     result: Optional[Dict[str, Any]] = None
     error: Optional[Dict[str, Any]] = None
 
+# Lookup strategies for getProductDataByUPC
+STRATEGY_SEQUENTIAL = "sequential"        # one source after the other (original behaviour)
+STRATEGY_FIRST_SUCCESS = "first_success"  # all sources at once, best hit in priority order
+STRATEGY_MERGE_ALL = "merge_all"          # all sources at once, merge every hit by priority
+STRATEGY_HEDGED = "hedged"                # sequential, but the next source starts when one is slower than its p95
+LOOKUP_STRATEGIES = (STRATEGY_SEQUENTIAL, STRATEGY_FIRST_SUCCESS, STRATEGY_MERGE_ALL, STRATEGY_HEDGED)
+
+# Lean output options (see mcp_projection) in tool input schemas
+FIELDS_SCHEMA = {
+    "type": ["array", "string"],
+    "items": {"type": "string"},
+    "description": ("Only return these fields (list or comma-separated); dotted paths such as "
+                    "price_stats.min select nested values.")
+}
+STANDALONE_OUTPUT_SCHEMA = {
+    "fields": FIELDS_SCHEMA,
+    "raw": {
+        "type": "string",
+        "enum": list(RAW_MODES),
+        "description": "Upstream payload in raw_data: full (default), truncate (to raw_max_bytes of JSON) or none."
+    },
+    "raw_max_bytes": {"type": "integer", "description": "Size limit for raw=truncate (default 2048)."}
+}
+
 class UPCDataSource:
+    name = "unknown"
+    # Whether the source's prices go stale quickly; its cached prices then
+    # expire before its product attributes do.
+    price_bearing = True
+    # Whether answers go through the shared lookup cache.
+    cacheable = True
+
     def __init__(self, api_key: str, base_url: str):
         self.api_key = api_key
         self.base_url = base_url
 
-    def get_product_data(self, upc: str) -> Optional[Dict[str, Any]]:
-        raise NotImplementedError
+    @property
+    def transport(self):
+        # Shared pooled transport: keep-alive, split timeouts and retries.
+        # Built on the first upstream call, not when the sources are set up.
+        return get_transport()
 
-    def _standardize_data(self, data: Dict[str, Any], source: str) -> Dict[str, Any]:
-        # Default standardization, override in subclasses if needed
-        standardized_output = {
-            "product_name": data.get("title", data.get("productname", "")),
-            "description": data.get("description", ""),
-            "brand": data.get("brand", ""),
-            "category": data.get("category", ""),
-            "images_urls": data.get("images", data.get("image_urls", [])),
-            "ean": data.get("ean", ""),
-            "mpn": data.get("mpn", ""),
-            "model": data.get("model", ""),
-            "price": data.get("price", None),
-            "currency": data.get("currency", "USD"),
-            "features_list": data.get("features", []),
-            "manufacturer": data.get("manufacturer", ""),
-            "dimensions": data.get("dimensions", ""),
-            "weight": data.get("weight", ""),
-            "upc": data.get("upc", upc), # This `upc` should be the parameter passed from get_product_data
-            "success": True,
-            "source_used": source
-        }
-        logger.info(f"DEBUG: Standardized data from {source}: {standardized_output}")
-        return standardized_output
+    def get_product_data(self, upc: str) -> Optional[ProductRecord]:
+        raise NotImplementedError
 
 class UPCDatabaseOrg(UPCDataSource):
+    name = "upcdatabase.org"
+    price_bearing = False  # a long-run average price, not live offers
+
     def __init__(self, api_key: str):
-        super().__init__(api_key, "https://api.upcdatabase.org/product/")
+        super().__init__(api_key, os.getenv("UPC_DATABASE_PRODUCT_URL", "https://api.upcdatabase.org/product/"))
 
-    def get_product_data(self, upc: str) -> Optional[Dict[str, Any]]:
+    def get_product_data(self, upc: str) -> Optional[ProductRecord]:
         try:
             headers = {"Authorization": f"Bearer {self.api_key}"}
-            response = requests.get(f"{self.base_url}{upc}", headers=headers, timeout=10)
+            response = self.transport.get(f"{self.base_url}{upc}", headers=headers)
+            if response.status_code == 404:
+                logger.warning(f"No data or unsuccessful response from upcdatabase.org for UPC: {upc}")
+                return None
             response.raise_for_status()
             data = response.json()
             if data.get("success") and data.get("item_name"):
-                logger.info(f"Data found on upcdatabase.org for UPC: {upc}")
-                # Map upcdatabase.org specific fields to a common format
-                standardized_data = {
-                    "title": data.get("item_name"),
-                    "description": data.get("description"),
-                    "brand": data.get("brand"),
-                    "category": data.get("category"),
-                    "image_urls": [data.get("image")] if data.get("image") else [],
-                    "ean": data.get("ean"),
-                    "mpn": data.get("mpn"),
-                    "model": data.get("model"),
-                    "price": data.get("price"),
-                    "currency": data.get("currency"),
-                    "features": data.get("features", []),
-                    "manufacturer": data.get("manufacturer"),
-                    "dimensions": data.get("dimensions", ""),
-                    "weight": data.get("weight"),
-                    "upc": data.get("upc")
-                }
-                return self._standardize_data(standardized_data, "upcdatabase.org")
+                # Map upcdatabase.org specific fields to the common record
+                return ProductRecord(
+                    upc=data.get("upc") or upc,
+                    source_used=self.name,
+                    product_name=data.get("item_name"),
+                    description=data.get("description"),
+                    brand=data.get("brand"),
+                    category=data.get("category"),
+                    images_urls=[data.get("image")] if data.get("image") else [],
+                    ean=data.get("ean"),
+                    mpn=data.get("mpn"),
+                    model=data.get("model"),
+                    price=data.get("price"),
+                    currency=data.get("currency"),
+                    features_list=data.get("features", []),
+                    manufacturer=data.get("manufacturer"),
+                    dimensions=data.get("dimensions", ""),
+                    weight=data.get("weight"),
+                )
             else:
                 logger.warning(f"No data or unsuccessful response from upcdatabase.org for UPC: {upc}")
                 return None
-        except requests.exceptions.RequestException as e:
+        except mcp_transport.RequestException as e:
             logger.error(f"Error fetching from upcdatabase.org for UPC {upc}: {e}")
-            return None
+            raise
 
 class UPCItemDB(UPCDataSource):
+    name = "upcitemdb.com"
+
     def __init__(self, api_key: str = None):
-        super().__init__(api_key, "https://api.upcitemdb.com/prod/trial/lookup")
+        super().__init__(api_key, os.getenv("UPC_ITEMDB_LOOKUP_URL", "https://api.upcitemdb.com/prod/trial/lookup"))
 
-    def get_product_data(self, upc: str) -> Optional[Dict[str, Any]]:
+    def get_product_data(self, upc: str) -> Optional[ProductRecord]:
         try:
             params = {"upc": upc}
-            response = requests.get(self.base_url, params=params, timeout=10)
+            response = self.transport.get(self.base_url, params=params)
+            if response.status_code == 404:
+                logger.warning(f"No data found on upcitemdb.com for UPC: {upc}")
+                return None
             response.raise_for_status()
             data = response.json()
             if data.get("items"):
                 item = data["items"][0]
-                logger.info(f"DEBUG: UPCItemDB raw item data: {item}") # DEBUG
-                logger.info(f"Data found on upcitemdb.com for UPC: {upc}")
-                standardized_data = {
-                    "title": item.get("title"),
-                    "description": item.get("description"),
-                    "brand": item.get("brand"),
-                    "category": item.get("category"),
-                    "image_urls": item.get("images", []),
-                    "ean": item.get("ean"),
-                    "mpn": item.get("mpn"),
-                    "model": item.get("model"),
-                    "price": item.get("lowest_recorded_price"),
-                    "currency": item.get("currency"),
-                    "features": item.get("features", []),
-                    "manufacturer": item.get("manufacturer"),
-                    "dimensions": item.get("dimensions"),
-                    "weight": item.get("weight"),
-                    "upc": item.get("upc")
-                }
-                standardized_result = self._standardize_data(standardized_data, "upcitemdb.com") # Capture return
-                logger.info(f"DEBUG: UPCItemDB standardized result: {standardized_result}") # DEBUG
-                return standardized_result
+                return ProductRecord(
+                    upc=item.get("upc") or upc,
+                    source_used=self.name,
+                    product_name=item.get("title"),
+                    description=item.get("description"),
+                    brand=item.get("brand"),
+                    category=item.get("category"),
+                    images_urls=item.get("images", []),
+                    ean=item.get("ean"),
+                    mpn=item.get("mpn"),
+                    model=item.get("model"),
+                    price=item.get("lowest_recorded_price"),
+                    currency=item.get("currency"),
+                    features_list=item.get("features", []),
+                    manufacturer=item.get("manufacturer"),
+                    dimensions=item.get("dimensions"),
+                    weight=item.get("weight"),
+                    offers=[{"price": offer.get("price"), "currency": offer.get("currency"),
+                             "merchant": offer.get("merchant")} for offer in item.get("offers", [])],
+                )
             else:
                 logger.warning(f"No data found on upcitemdb.com for UPC: {upc}")
                 return None
-        except requests.exceptions.RequestException as e:
+        except mcp_transport.RequestException as e:
             logger.error(f"Error fetching from upcitemdb.com for UPC {upc}: {e}")
+            raise
+
+class MarketplaceDataSource(UPCDataSource):
+    """
+    Adapts the marketplace modules (fetch_ebay, fetch_amazon), which return
+    (ProductRecord or None, raw response) and raise on errors, to UPCDataSource.
+    """
+
+    def __init__(self, name: str, fetch):
+        super().__init__(None, None)
+        self.name = name
+        self.fetch = fetch
+
+    def get_product_data(self, upc: str) -> Optional[ProductRecord]:
+        # The raw response never leaves the module's own output, so it is dropped here.
+        record, _ = self.fetch(upc)
+        return record
+
+class LocalCatalogSource(UPCDataSource):
+    """The on-disk supplier catalog (mcp_local_catalog); answers in microseconds, without the network."""
+    name = "local"
+    price_bearing = False
+    cacheable = False  # already a local index; caching it would only add a SQLite round trip
+
+    def __init__(self, catalog: LocalCatalog):
+        super().__init__(None, catalog.directory)
+        self.catalog = catalog
+
+    def get_product_data(self, upc: str) -> Optional[ProductRecord]:
+        record = self.catalog.get(upc)
+        if record is None:
             return None
+        return ProductRecord.from_mapping(record, self.name, upc)
 
 class ProductDataMCPServer:
     # HARDCODED API KEY FOR TESTING: This bypasses environment variable issues for now.
@@ -150,18 +223,173 @@ class ProductDataMCPServer:
 
         self.upc_data_sources.append(UPCItemDB(self.upcitemdb_api_key))
 
+        # The local catalog, when configured, is asked before any network source.
+        self.local_sources = []
+        local_catalog = LocalCatalog.from_env()
+        if local_catalog is not None:
+            self.local_sources.append(LocalCatalogSource(local_catalog))
+
         if not self.upc_data_sources:
             logger.error("No UPC data sources configured. Please set at least one API key.")
 
-    def handle_request(self, request_data: str) -> str:
+        # Marketplaces join streamed lookups only, when their credentials are set.
+        self.marketplace_sources = []
+        if os.getenv("EBAY_APP_ID"):
+            self.marketplace_sources.append(MarketplaceDataSource("ebay.com", fetch_ebay))
+        if all(os.getenv(name) for name in ("AMAZON_CLIENT_ID", "AMAZON_CLIENT_SECRET", "AMAZON_REFRESH_TOKEN")):
+            self.marketplace_sources.append(MarketplaceDataSource("amazon.com", fetch_amazon))
+
+        self.cache = ProductCache.from_env()
+        self.source_health = SourceHealthRegistry.from_env(
+            source.name for source in self.local_sources + self.upc_data_sources + self.marketplace_sources)
+        # Concurrent lookups of the same barcode share one upstream pass.
+        self.inflight = SingleFlight()
+        self.merger = MergeEngine.from_env()
+        # Stale-while-revalidate and hot-SKU refresh, on their own rate budget.
+        self.refresher = None
+        if self.cache is not None and self.cache.stale_ttl_s > 0:
+            self.refresher = BackgroundRefresher.from_env(self._refresh_source, self._refresh_due)
+
+        self.default_strategy = os.getenv("MCP_LOOKUP_STRATEGY", STRATEGY_SEQUENTIAL)
+        self.default_deadline_ms = int(os.getenv("MCP_LOOKUP_DEADLINE_MS", "10000"))
+        # Upper bound for a caller's deadline_ms.
+        self.max_deadline_ms = max(self.default_deadline_ms, int(os.getenv("MCP_LOOKUP_MAX_DEADLINE_MS", "60000")))
+        # Bounds both JSON-RPC batch arrays and getProductDataByUPCs fan-out.
+        self.batch_concurrency = int(os.getenv("MCP_BATCH_CONCURRENCY", "8"))
+        self.batch_max_size = int(os.getenv("MCP_BATCH_MAX_SIZE", "10000"))
+        # Hedged lookups: the latency quantile after which the next source is
+        # fired, and the delay used until a source has enough samples.
+        self.hedge_quantile = float(os.getenv("MCP_HEDGE_QUANTILE", "0.95"))
+        self.hedge_default_delay_ms = float(os.getenv("MCP_HEDGE_DEFAULT_DELAY_MS", "500"))
+        self.hedge_min_delay_ms = float(os.getenv("MCP_HEDGE_MIN_DELAY_MS", "10"))
+        self._hedge_counts = {"lookups": 0, "hedged": 0, "won": 0}
+        self._hedge_lock = threading.Lock()
+        # Shared by every concurrent lookup; a source call that outlives its
+        # deadline keeps its worker until the HTTP timeout fires.
+        self.lookup_executor = ThreadPoolExecutor(
+            max_workers=int(os.getenv("MCP_LOOKUP_WORKERS", "16")),
+            thread_name_prefix="upc-lookup"
+        )
+        # Created on the first incrementInventory call, so lookups never need Postgres.
+        self.inventory = None
+        self._inventory_lock = threading.Lock()
+        # Sampled trace spans and slow-request profiles (MCP_TRACE_*, MCP_PROFILE_*).
+        self.tracer = RequestTracer.from_env()
+        self._init_metrics()
+
+        # JSON-RPC method name -> handler taking the request params.
+        self.methods = {
+            "getProductDataByUPC": self._rpc_get_product_data_by_upc,
+            "getProductDataByUPCs": self._rpc_get_product_data_by_upcs,
+            "getSourceHealth": lambda params: self.getSourceHealth(),
+            "getLookupStats": lambda params: self.getLookupStats(),
+            "metrics": self._rpc_metrics,
+            "normalizeBarcode": self._rpc_normalize_barcode,
+            "incrementInventory": self._rpc_increment_inventory,
+            "lookupUPC": self._rpc_lookup_upc,
+            "lookupEbay": self._rpc_lookup_ebay,
+            "lookupAmazon": self._rpc_lookup_amazon,
+            "initialize": lambda params: self.initialize(),
+            "list_tools": lambda params: self.list_tools(),
+        }
+        # Methods whose handler also takes a `notify` callable for progress notifications.
+        self.streaming_methods = {"getProductDataByUPC"}
+
+    def _init_metrics(self) -> None:
+        """Counters, latency histograms and gauges behind the `metrics` method."""
+        self.metrics = MetricsRegistry()
+        m = self.metrics
+        self.m_rpc_requests = m.counter(
+            "mcp_rpc_requests_total", "JSON-RPC requests by method and outcome (ok, error, exception).",
+            ("method", "outcome"))
+        self.m_rpc_duration = m.histogram(
+            "mcp_rpc_request_duration_seconds", "JSON-RPC request latency by method.", ("method",))
+        self.m_rpc_in_flight = m.gauge(
+            "mcp_rpc_in_flight", "JSON-RPC requests currently being handled.", ("method",))
+        self.m_lookup_duration = m.histogram(
+            "mcp_lookup_duration_seconds", "Product lookup latency by strategy and outcome (found, not_found).",
+            ("strategy", "outcome"))
+        self.m_source_results = m.counter(
+            "mcp_source_results_total",
+            "Per-source lookup outcomes (hit, miss, error, timeout, cancelled, skipped) and how the cache served them.",
+            ("source", "outcome", "cache"))
+        self.m_upstream_duration = m.histogram(
+            "mcp_upstream_request_duration_seconds", "Upstream API call latency by source and outcome.",
+            ("source", "outcome"))
+        self.m_upstream_in_flight = m.gauge(
+            "mcp_upstream_in_flight", "Upstream API calls currently in flight.", ("source",))
+        self.m_hedges = m.counter(
+            "mcp_hedged_requests_total", "Hedged upstream requests by target source and outcome (fired, won, denied).",
+            ("source", "outcome"))
+        m.gauge("mcp_lookup_queue_depth", "Source calls waiting for a lookup worker.",
+                callback=lambda: {(): self.lookup_executor._work_queue.qsize()})
+        m.gauge("mcp_lookups_in_flight", "Distinct lookups currently running (after coalescing).",
+                callback=lambda: {(): self.inflight.stats()["in_flight"]})
+        m.counter("mcp_lookups_coalesced_total", "Lookups answered by joining an identical in-flight lookup.",
+                  callback=lambda: {(): self.inflight.stats()["coalesced"]})
+        m.gauge("mcp_circuit_open", "1 while a source's circuit breaker is not closed.", ("source",),
+                callback=lambda: {(s["source"],): 0 if s["state"] == "closed" else 1
+                                  for s in self.getSourceHealth()["sources"]})
+        if self.refresher is not None:
+            m.counter("mcp_cache_refreshes_total", "Background cache refreshes by outcome.", ("outcome",),
+                      callback=lambda: {(name,): value for name, value in self.refresher.stats().items()
+                                        if name not in ("pending", "tracked_skus")})
+            m.gauge("mcp_cache_refreshes_pending", "Background cache refreshes queued or running.",
+                    callback=lambda: {(): self.refresher.stats()["pending"]})
+        if self.cache is not None:
+            m.gauge("mcp_cache_entries", "Entries in the product cache.",
+                    callback=lambda: {(): self.cache.stats()["entries"]})
+            m.counter("mcp_cache_operations_total", "Product cache reads and evictions.", ("result",),
+                      callback=self._cache_operation_counts)
+
+    def _cache_operation_counts(self) -> Dict[tuple, int]:
+        stats = self.cache.stats()
+        return {("hit",): stats["hits"], ("miss",): stats["misses"], ("stale_pricing",): stats["stale_pricing"],
+                ("stale",): stats["stale_hits"], ("eviction",): stats["evictions"]}
+
+    def handle_request(self, request_data: str, notify: Optional[Callable[[Dict[str, Any]], None]] = None) -> str:
+        # request_data is the JSON-RPC string main() extracted from n8n's event
+        # object: either a single request object or a JSON-RPC batch array.
+        # notify, when the transport can deliver them, receives JSON-RPC
+        # notifications sent before the response (see streamed lookups).
         try:
-            # request_data is now expected to be the actual JSON-RPC string
-            # (since main() already extracted it from n8n's full event object)
             request_json = json.loads(request_data)
-            logger.info(f"DEBUG: handle_request received JSON-RPC: {request_json}") # Debug to confirm it
+        except json.JSONDecodeError as e:
+            return json.dumps(self._error_response(None, -32700, "Parse error", str(e)))
+        return self.handle_message(request_json, notify)
+
+    def handle_message(self, request_json: Any, notify: Optional[Callable[[Dict[str, Any]], None]] = None) -> str:
+        """handle_request for an already parsed request or batch; the response is serialized here, once."""
+        if isinstance(request_json, list):
+            if not request_json:
+                return json.dumps(self._error_response(None, -32600, "Invalid Request", "Empty batch"))
+            responses = self._bounded_map(lambda item: self._handle_single(item, notify),
+                                          request_json, self.batch_concurrency)
+            return json.dumps(responses)
+        return json.dumps(self._handle_single(request_json, notify))
+
+    def _handle_single(self, request_json: Any, notify: Optional[Callable[[Dict[str, Any]], None]] = None) -> Dict[str, Any]:
+        if not isinstance(request_json, dict):
+            return self._error_response(None, -32600, "Invalid Request", "Request must be a JSON object")
+        method = request_json.get("method")
+        method_label = method if method in self.methods else "unknown"
+        started = time.perf_counter()
+        outcome = "exception"
+        self.m_rpc_in_flight.inc(method=method_label)
+        try:
+            with self.tracer.request("rpc", method=method_label) as scope:
+                response = self._dispatch(request_json, notify)
+                outcome = "error" if response.get("error") else "ok"
+                scope.set(outcome=outcome)
+            return response
+        finally:
+            self.m_rpc_in_flight.dec(method=method_label)
+            self.m_rpc_duration.observe(time.perf_counter() - started, method=method_label)
+            self.m_rpc_requests.inc(method=method_label, outcome=outcome)
 
-            # This 'request_json' variable IS already the correct JSON-RPC body.
-            # No further extraction from 'original.body' is needed here.
+    def _dispatch(self, request_json: Dict[str, Any],
+                  notify: Optional[Callable[[Dict[str, Any]], None]] = None) -> Dict[str, Any]:
+        try:
             request = MCPRequest(
                 jsonrpc=request_json.get("jsonrpc", "2.0"),
                 method=request_json.get("method"),
@@ -169,18 +397,11 @@ class ProductDataMCPServer:
                 id=request_json.get("id")
             )
 
-            result = {}
-            if request.method == "getProductDataByUPC":
-                # RENAMED PARAMETER TO AVOID POTENTIAL SCOPE ISSUES
-                upc_from_request = request.params.get("upc")
-                if upc_from_request:
-                    result = self.getProductDataByUPC(upc_from_request) # Pass the renamed parameter
-                else:
-                    result = {"error": "Missing 'upc' parameter", "code": 400}
-            elif request.method == "initialize":
-                result = self.initialize()
-            elif request.method == "list_tools":
-                result = self.list_tools()
+            handler = self.methods.get(request.method)
+            if handler and request.method in self.streaming_methods:
+                result = handler(request.params or {}, notify=self._progress_notifier(request, notify))
+            elif handler:
+                result = handler(request.params or {})
             else:
                 result = {"error": f"Unknown method: {request.method}", "code": 404}
 
@@ -197,36 +418,214 @@ class ProductDataMCPServer:
                     result=result
                 )
 
-            return json.dumps({
+            return {
                 "jsonrpc": response.jsonrpc,
                 "id": response.id,
                 "result": response.result,
                 "error": response.error
-            })
+            }
 
-        except json.JSONDecodeError as e:
-            error_response = MCPResponse(
-                jsonrpc="2.0",
-                id=None,
-                error={"code": -32700, "message": "Parse error", "data": str(e)}
-            )
-            return json.dumps({
-                "jsonrpc": error_response.jsonrpc,
-                "id": error_response.id,
-                "error": error_response.error
-            })
         except Exception as e:
-            request_id = request.id if 'request' in locals() and hasattr(request, 'id') else None
-            error_response = MCPResponse(
-                jsonrpc="2.0",
-                id=request_id,
-                error={"code": -32603, "message": "Internal error", "data": str(e)}
-            )
-            return json.dumps({
-                "jsonrpc": error_response.jsonrpc,
-                "id": error_response.id,
-                "error": error_response.error
+            logger.exception("Unhandled error while processing JSON-RPC request")
+            return self._error_response(request_json.get("id"), -32603, "Internal error", str(e))
+
+    @staticmethod
+    def _progress_notifier(request: MCPRequest, notify: Optional[Callable[[Dict[str, Any]], None]]):
+        """
+        Wraps notify into a callback emitting MCP-style notifications/progress
+        messages. The progress token is params.progressToken when the client
+        sent one, otherwise the request id.
+        """
+        if notify is None:
+            return None
+        params = request.params or {}
+        token = params.get("progressToken", request.id)
+
+        def send(progress: int, total: int, **details) -> None:
+            notify({
+                "jsonrpc": "2.0",
+                "method": "notifications/progress",
+                "params": dict(progressToken=token, progress=progress, total=total, **details)
             })
+        return send
+
+    @staticmethod
+    def _error_response(request_id: Any, code: int, message: str, data: Any = None) -> Dict[str, Any]:
+        error_response = MCPResponse(
+            jsonrpc="2.0",
+            id=request_id,
+            error={"code": code, "message": message, "data": data}
+        )
+        return {
+            "jsonrpc": error_response.jsonrpc,
+            "id": error_response.id,
+            "error": error_response.error
+        }
+
+    @staticmethod
+    def _bounded_map(fn, items: List[Any], concurrency: int) -> List[Any]:
+        """
+        Applies fn to every item with at most `concurrency` calls in flight,
+        preserving order. Uses a pool scoped to this call so nested batches can
+        never deadlock on a shared executor.
+        """
+        if len(items) <= 1 or concurrency <= 1:
+            return [fn(item) for item in items]
+        with ThreadPoolExecutor(max_workers=min(concurrency, len(items)), thread_name_prefix="rpc-batch") as pool:
+            return list(pool.map(fn, items))
+
+    def _lookup_options(self, params: Dict[str, Any]) -> Dict[str, Any]:
+        """Validates the lookup options shared by getProductDataByUPC and getProductDataByUPCs."""
+        strategy = params.get("strategy", self.default_strategy)
+        if strategy not in LOOKUP_STRATEGIES:
+            return {"error": f"Unknown strategy: {strategy}", "code": 400, "details": {"allowed": list(LOOKUP_STRATEGIES)}}
+        cache_mode = params.get("cache", CACHE_MODE_DEFAULT)
+        if cache_mode not in CACHE_MODES:
+            return {"error": f"Unknown cache mode: {cache_mode}", "code": 400, "details": {"allowed": list(CACHE_MODES)}}
+        try:
+            deadline_ms = int(params.get("deadline_ms", self.default_deadline_ms))
+        except (TypeError, ValueError):
+            return {"error": "'deadline_ms' must be an integer", "code": 400}
+        if not 0 < deadline_ms <= self.max_deadline_ms:
+            return {"error": f"'deadline_ms' must be between 1 and {self.max_deadline_ms}", "code": 400}
+        return {
+            "strategy": strategy,
+            "deadline_ms": deadline_ms,
+            "cache_mode": cache_mode
+        }
+
+    def _rpc_get_product_data_by_upc(self, params: Dict[str, Any], notify=None) -> Dict[str, Any]:
+        # RENAMED PARAMETER TO AVOID POTENTIAL SCOPE ISSUES
+        upc_from_request = params.get("upc")
+        if not upc_from_request:
+            return {"error": "Missing 'upc' parameter", "code": 400}
+        options = self._lookup_options(params)
+        if "error" in options:
+            return options
+        try:
+            upc_key = self._lookup_code(upc_from_request)
+            fields = parse_output_options(params)["fields"]
+        except ValueError as e:
+            return {"error": str(e), "code": 400}
+        if params.get("stream"):
+            def project_progress(count: int, total: int, record=None, **details) -> None:
+                notify(count, total, record=project(record, fields) if record else record, **details)
+
+            if notify is None:
+                progress = self._discard_progress
+            else:
+                progress = project_progress if fields else notify
+            result = self.getProductDataByUPC(upc_key, progress=progress,
+                                              deadline_ms=options["deadline_ms"], cache_mode=options["cache_mode"])
+        else:
+            result = self.getProductDataByUPC(upc_key, **options)
+        # Results may be shared with coalesced callers; project() copies.
+        return project(result, fields)
+
+    @staticmethod
+    def _discard_progress(progress: int, total: int, **details) -> None:
+        """Progress sink for streamed lookups over transports that cannot deliver notifications."""
+
+    def _rpc_get_product_data_by_upcs(self, params: Dict[str, Any]) -> Dict[str, Any]:
+        upcs = params.get("upcs")
+        if not isinstance(upcs, list) or not upcs:
+            return {"error": "Missing or empty 'upcs' list parameter", "code": 400}
+        if len(upcs) > self.batch_max_size:
+            return {"error": f"Too many UPCs in one batch ({len(upcs)} > {self.batch_max_size})", "code": 413}
+        options = self._lookup_options(params)
+        if "error" in options:
+            return options
+        try:
+            fields = parse_output_options(params)["fields"]
+        except ValueError as e:
+            return {"error": str(e), "code": 400}
+        try:
+            concurrency = int(params.get("concurrency", self.batch_concurrency))
+        except (TypeError, ValueError):
+            return {"error": "'concurrency' must be an integer", "code": 400}
+        concurrency = max(1, min(concurrency, self.batch_concurrency))
+        batch = self.getProductDataByUPCs(upcs, concurrency=concurrency, **options)
+        if fields:
+            batch["results"] = {upc: project(result, fields) for upc, result in batch["results"].items()}
+        return batch
+
+    @staticmethod
+    def _lookup_code(upc: Any) -> str:
+        """
+        Canonicalizes a scanned code to the form upstream UPC APIs accept best.
+        Every GTIN form of one product maps to the same code; codes with a bad
+        check digit are rejected before any upstream call.
+        """
+        info = canonicalize(upc)
+        if info.get("validation_error"):
+            raise ValueError(f"Invalid barcode {info['barcode']}: {info['validation_error']}")
+        return lookup_form(info)
+
+    def _rpc_metrics(self, params: Dict[str, Any]) -> Dict[str, Any]:
+        output_format = params.get("format", "json")
+        if output_format == "prometheus":
+            return {"content_type": "text/plain; version=0.0.4", "text": self.metrics.render_prometheus()}
+        if output_format != "json":
+            return {"error": f"Unknown metrics format: {output_format}", "code": 400,
+                    "details": {"allowed": ["json", "prometheus"]}}
+        return {"metrics": self.metrics.snapshot()}
+
+    def _rpc_normalize_barcode(self, params: Dict[str, Any]) -> Dict[str, Any]:
+        try:
+            qty = int(params.get("qty", 1))
+        except (TypeError, ValueError):
+            return {"error": "'qty' must be an integer", "code": 400}
+        try:
+            return normalize_barcode(params.get("barcode", ""), qty)
+        except ValueError as e:
+            return {"error": str(e), "code": 400}
+
+    def _rpc_increment_inventory(self, params: Dict[str, Any]) -> Dict[str, Any]:
+        if not params.get("barcode"):
+            return {"error": "Missing 'barcode' parameter", "code": 400}
+        try:
+            qty = int(params.get("qty", 1))
+        except (TypeError, ValueError):
+            return {"error": "'qty' must be an integer", "code": 400}
+        try:
+            with self._inventory_lock:
+                if self.inventory is None:
+                    # Imported here: psycopg2 is only needed once inventory is used.
+                    from mcp_inventory_increment import InventoryIncrementer
+                    self.inventory = InventoryIncrementer.from_env()
+            future = self.inventory.submit(params["barcode"], qty)
+        except ValueError as e:
+            return {"error": str(e), "code": 400}
+        except Exception as e:
+            return {"error": f"Inventory database unavailable: {e}", "code": 503}
+        try:
+            return future.result(timeout=self.default_deadline_ms / 1000.0)
+        except FutureTimeoutError:
+            # Still queued or being written and may yet commit: reporting a
+            # failure would make a retrying client count the scan twice.
+            return {"barcode": params["barcode"], "delta": qty, "pending": True}
+        except Exception as e:
+            return {"error": f"Inventory increment failed: {e}", "code": 503}
+
+    @staticmethod
+    def _standalone_lookup(lookup: Callable[..., Dict[str, Any]], params: Dict[str, Any]) -> Dict[str, Any]:
+        """Runs lookup_upc/lookup_ebay/lookup_amazon with the fields/raw output options applied."""
+        if not params.get("upc"):
+            return {"error": "Missing 'upc' parameter", "code": 400}
+        try:
+            options = parse_output_options(params)
+        except ValueError as e:
+            return {"error": str(e), "code": 400, "details": {"raw_modes": list(RAW_MODES)}}
+        return shape_output(lookup(params["upc"], include_raw=wants_raw(options)), options)
+
+    def _rpc_lookup_upc(self, params: Dict[str, Any]) -> Dict[str, Any]:
+        return self._standalone_lookup(lookup_upc, params)
+
+    def _rpc_lookup_ebay(self, params: Dict[str, Any]) -> Dict[str, Any]:
+        return self._standalone_lookup(lookup_ebay, params)
+
+    def _rpc_lookup_amazon(self, params: Dict[str, Any]) -> Dict[str, Any]:
+        return self._standalone_lookup(lookup_amazon, params)
 
     def initialize(self) -> Dict[str, Any]:
         return {
@@ -249,72 +648,698 @@ class ProductDataMCPServer:
                     "inputSchema": {
                         "type": "object",
                         "properties": {
-                            "upc": {"type": "string", "description": "The UPC string to look up."}
+                            "upc": {"type": "string", "description": "The UPC string to look up."},
+                            "strategy": {
+                                "type": "string",
+                                "enum": list(LOOKUP_STRATEGIES),
+                                "description": ("sequential (default), first_success, merge_all (every source "
+                                                "including eBay/Amazon, merged field by field) or hedged "
+                                                "(sequential, firing the next source when one is slower than its "
+                                                "observed p95).")
+                            },
+                            "deadline_ms": {
+                                "type": "integer",
+                                "description": ("Overall deadline for concurrent strategies "
+                                                "(1 to MCP_LOOKUP_MAX_DEADLINE_MS, default 60000).")
+                            },
+                            "cache": {
+                                "type": "string",
+                                "enum": list(CACHE_MODES),
+                                "description": ("default, refresh (skip cached answers), refresh_pricing (re-fetch "
+                                                "prices from price-bearing sources only, merged with every source's "
+                                                "cached attributes) or bypass (no cache at all).")
+                            },
+                            "stream": {
+                                "type": "boolean",
+                                "description": ("Query every source, including eBay and Amazon when configured, "
+                                                "and send a notifications/progress message with the merged record "
+                                                "so far as each one answers.")
+                            },
+                            "progressToken": {
+                                "type": ["string", "integer"],
+                                "description": "Token echoed in progress notifications (defaults to the request id)."
+                            },
+                            "fields": FIELDS_SCHEMA
+                        },
+                        "required": ["upc"]
+                    }
+                },
+                {
+                    "name": "getProductDataByUPCs",
+                    "description": "Looks up a list of UPCs with bounded concurrency and returns results keyed per UPC.",
+                    "inputSchema": {
+                        "type": "object",
+                        "properties": {
+                            "upcs": {"type": "array", "items": {"type": "string"}, "description": "The UPC strings to look up."},
+                            "concurrency": {
+                                "type": "integer",
+                                "description": "Maximum lookups in flight (capped by MCP_BATCH_CONCURRENCY)."
+                            },
+                            "strategy": {"type": "string", "enum": list(LOOKUP_STRATEGIES)},
+                            "deadline_ms": {
+                                "type": "integer",
+                                "description": ("Per-UPC deadline for concurrent strategies "
+                                                "(1 to MCP_LOOKUP_MAX_DEADLINE_MS, default 60000).")
+                            },
+                            "cache": {"type": "string", "enum": list(CACHE_MODES)},
+                            "fields": FIELDS_SCHEMA
+                        },
+                        "required": ["upcs"]
+                    }
+                },
+                {
+                    "name": "getSourceHealth",
+                    "description": ("Returns per-source latency, error rate, hit rate, circuit breaker state "
+                                    "and the current lookup order."),
+                    "inputSchema": {"type": "object", "properties": {}}
+                },
+                {
+                    "name": "getLookupStats",
+                    "description": "Returns request coalescing counters (executed, coalesced, in flight) and cache statistics.",
+                    "inputSchema": {"type": "object", "properties": {}}
+                },
+                {
+                    "name": "metrics",
+                    "description": ("Returns request, per-source and cache metrics: counters, latency "
+                                    "histograms (p50/p95/p99), in-flight counts and queue depth."),
+                    "inputSchema": {
+                        "type": "object",
+                        "properties": {
+                            "format": {
+                                "type": "string",
+                                "enum": ["json", "prometheus"],
+                                "description": "json (default) or prometheus for the text exposition format."
+                            }
+                        }
+                    }
+                },
+                {
+                    "name": "normalizeBarcode",
+                    "description": ("Cleans a scanned barcode, validates its check digit, expands UPC-E and "
+                                    "returns the canonical GTIN-14 with all equivalent forms."),
+                    "inputSchema": {
+                        "type": "object",
+                        "properties": {
+                            "barcode": {"type": "string", "description": "The raw scanned barcode."},
+                            "qty": {"type": "integer", "description": "Scanned quantity, defaults to 1."}
+                        },
+                        "required": ["barcode"]
+                    }
+                },
+                {
+                    "name": "incrementInventory",
+                    "description": ("Adds a scanned quantity to a product's inventory, creating the product "
+                                    "row when the barcode is new. Concurrent scans are coalesced into one "
+                                    "batched upsert. \"pending\": true means the write is still queued and "
+                                    "must not be retried."),
+                    "inputSchema": {
+                        "type": "object",
+                        "properties": {
+                            "barcode": {"type": "string", "description": "The scanned barcode."},
+                            "qty": {"type": "integer", "description": "Quantity to add (negative to remove), defaults to 1."}
                         },
+                        "required": ["barcode"]
+                    }
+                },
+                {
+                    "name": "lookupUPC",
+                    "description": "Looks up a UPC on upcitemdb.com and upcdatabase.org and merges the results.",
+                    "inputSchema": {
+                        "type": "object",
+                        "properties": dict(
+                            upc={"type": "string", "description": "The UPC string to look up."},
+                            **STANDALONE_OUTPUT_SCHEMA
+                        ),
+                        "required": ["upc"]
+                    }
+                },
+                {
+                    "name": "lookupEbay",
+                    "description": "Looks up a UPC with the eBay Finding API.",
+                    "inputSchema": {
+                        "type": "object",
+                        "properties": dict(
+                            upc={"type": "string", "description": "The UPC string to look up."},
+                            **STANDALONE_OUTPUT_SCHEMA
+                        ),
+                        "required": ["upc"]
+                    }
+                },
+                {
+                    "name": "lookupAmazon",
+                    "description": "Looks up a UPC in the Amazon SP-API catalog.",
+                    "inputSchema": {
+                        "type": "object",
+                        "properties": dict(
+                            upc={"type": "string", "description": "The UPC string to look up."},
+                            **STANDALONE_OUTPUT_SCHEMA
+                        ),
                         "required": ["upc"]
                     }
                 }
             ]
         }
 
-    def getProductDataByUPC(self, input_upc: str) -> Dict[str, Any]: # RENAMED PARAMETER FOR CLARITY
-        logger.info(f"DEBUG: getProductDataByUPC called for UPC: {input_upc}")
-        for source in self.upc_data_sources:
-            logger.info(f"DEBUG: Checking source: {source.__class__.__name__}")
-            product_data = source.get_product_data(input_upc) # Use input_upc here
-            logger.info(f"DEBUG: Result from {source.__class__.__name__}: {product_data} (type: {type(product_data)})")
-            if product_data:
-                logger.info(f"DEBUG: Found valid product_data from {source.__class__.__name__}. Attempting to return.")
-                return product_data
+    def getProductDataByUPC(self, input_upc: str, strategy: str = STRATEGY_SEQUENTIAL,
+                            deadline_ms: Optional[int] = None,
+                            cache_mode: str = CACHE_MODE_DEFAULT,
+                            progress: Optional[Callable[..., None]] = None) -> Dict[str, Any]:
+        """
+        Looks up one barcode. With a progress callback every source (the
+        marketplaces included) is queried at once and progress is called
+        with the merged record so far each time one answers; the return value
+        is the final merge once all have answered or the deadline passed.
+        """
+        started = time.monotonic()
+        # Cache entries and in-flight lookups are keyed on the GTIN-14, so
+        # UPC-A / EAN-13 / UPC-E scans of one product share them.
+        cache_key = canonical_key(input_upc)
+        if self.refresher is not None:
+            self.refresher.record_scan(cache_key, input_upc)
+        if progress is not None:
+            # Streamed lookups report to their own caller, so they are not coalesced.
+            return self._lookup(input_upc, cache_key, STRATEGY_MERGE_ALL, deadline_ms, cache_mode, progress)
+        if deadline_ms is None:
+            deadline_ms = self.default_deadline_ms
+        # The deadline is part of the key: a caller never gets a lookup cut
+        # short by, or kept waiting on, another caller's deadline.
+        result, shared = self.inflight.do(
+            (cache_key, strategy, cache_mode, deadline_ms),
+            lambda: self._lookup(input_upc, cache_key, strategy, deadline_ms, cache_mode)
+        )
+        if not shared:
+            return result
+        # Coalesced callers get their own copy so per-caller meta never leaks
+        # between responses.
+        result = dict(result)
+        result["meta"] = dict(result["meta"], coalesced=True,
+                              elapsed_ms=round((time.monotonic() - started) * 1000, 1))
+        return result
+
+    def _lookup(self, input_upc: str, cache_key: str, strategy: str, deadline_ms: Optional[int],
+                cache_mode: str, progress: Optional[Callable[..., None]] = None) -> Dict[str, Any]:
+        with mcp_trace.span("lookup", upc=input_upc, strategy=strategy, cache_mode=cache_mode) as span:
+            result = self._run_lookup(input_upc, cache_key, strategy, deadline_ms, cache_mode, progress)
+            span.set(found=result.get("success", True))
+            return result
+
+    def _run_lookup(self, input_upc: str, cache_key: str, strategy: str, deadline_ms: Optional[int],
+                    cache_mode: str, progress: Optional[Callable[..., None]] = None) -> Dict[str, Any]:
+        started = time.monotonic()
+        deadline_s = (deadline_ms if deadline_ms is not None else self.default_deadline_ms) / 1000.0
+        if cache_mode == CACHE_MODE_REFRESH_PRICING:
+            # Fresh prices are merged onto every source's cached attributes.
+            strategy = STRATEGY_MERGE_ALL
+        # A local catalog hit answers without the network, except for merges,
+        # which take the local record as their first source instead.
+        local_timings = []
+        product_data = None
+        if progress is None and strategy != STRATEGY_MERGE_ALL:
+            for source in self.local_sources:
+                outcome = self._call_source(source, input_upc, cache_key, cache_mode)
+                local_timings.append(outcome["timing"])
+                if outcome["data"]:
+                    product_data = self.merger.merge([outcome["data"]])
+                    break
+        if product_data is not None:
+            timings = []
+        elif progress is not None:
+            product_data, timings = self._lookup_concurrent(
+                input_upc, cache_key, strategy, cache_mode, started, started + deadline_s, progress=progress)
+        elif strategy == STRATEGY_SEQUENTIAL:
+            product_data, timings = self._lookup_sequential(input_upc, cache_key, cache_mode)
+        elif strategy == STRATEGY_HEDGED:
+            product_data, timings = self._lookup_hedged(input_upc, cache_key, cache_mode, started, started + deadline_s)
+        else:
+            product_data, timings = self._lookup_concurrent(input_upc, cache_key, strategy, cache_mode,
+                                                             started, started + deadline_s)
+        timings = local_timings + timings
+
+        meta = {
+            "strategy": strategy,
+            "elapsed_ms": round((time.monotonic() - started) * 1000, 1),
+            "sources": timings,
+            "coalesced": False,
+            "streamed": progress is not None,
+            "cache": {
+                "mode": cache_mode if self.cache else "disabled",
+                "hits": sum(1 for timing in timings if timing.get("cache") == "hit"),
+                "misses": sum(1 for timing in timings if timing.get("cache") == "miss"),
+                "stale": sum(1 for timing in timings if timing.get("cache") == "stale"),
+            }
+        }
+        for timing in timings:
+            self.m_source_results.inc(source=timing["source"], outcome=timing["status"],
+                                      cache=timing.get("cache", "none"))
+        self.m_lookup_duration.observe(time.monotonic() - started, strategy=strategy,
+                                       outcome="found" if product_data else "not_found")
+        if product_data:
+            product_data["meta"] = meta
+            return product_data
+
+        logger.error(f"No source returned valid data for UPC: {input_upc}")
+        return {"success": False, "message": f"No product data found for UPC: {input_upc} from any configured source.",
+                "code": 404, "meta": meta}
+
+    def getLookupStats(self) -> Dict[str, Any]:
+        """Request coalescing counters, cache statistics, background refresh and hedging counters."""
+        with self._hedge_lock:
+            hedging = dict(self._hedge_counts)
+        hedging["hedge_rate"] = round(hedging["hedged"] / hedging["lookups"], 3) if hedging["lookups"] else None
+        hedging["win_rate"] = round(hedging["won"] / hedging["hedged"], 3) if hedging["hedged"] else None
+        return {
+            "coalescing": self.inflight.stats(),
+            "cache": self.cache.stats() if self.cache else None,
+            "refresh": self.refresher.stats() if self.refresher else None,
+            "hedging": hedging
+        }
+
+    def getSourceHealth(self) -> Dict[str, Any]:
+        """Rolling latency/error/hit rates, circuit state and current lookup order per source."""
+        return self.source_health.snapshot(self.local_sources + self.upc_data_sources + self.marketplace_sources)
+
+    def getProductDataByUPCs(self, upcs: List[Any], concurrency: int = 8, **options) -> Dict[str, Any]:
+        """
+        Looks up many barcodes at once. Inputs are normalized and de-duplicated
+        before any upstream call; results are keyed by the UPC as supplied and
+        failures are reported per item instead of failing the whole batch.
+        """
+        started = time.monotonic()
+        results: Dict[str, Any] = {}
+        keys_by_input: Dict[str, str] = {}
+        for upc in upcs:
+            label = str(upc)
+            if label in results or label in keys_by_input:
+                continue
+            try:
+                keys_by_input[label] = self._lookup_code(upc)
+            except (ValueError, TypeError) as e:
+                results[label] = {"success": False, "message": str(e), "code": 400}
+
+        unique_keys = list(dict.fromkeys(keys_by_input.values()))
+
+        def lookup(upc_key: str) -> Dict[str, Any]:
+            try:
+                return self.getProductDataByUPC(upc_key, **options)
+            except Exception as e:
+                logger.exception(f"Batch lookup failed for UPC {upc_key}")
+                return {"success": False, "message": f"Lookup failed: {e}", "code": 500}
+
+        by_key = dict(zip(unique_keys, self._bounded_map(lookup, unique_keys, concurrency)))
+        for label, upc_key in keys_by_input.items():
+            results[label] = by_key[upc_key]
+
+        return {
+            "results": results,
+            "meta": {
+                "requested": len(upcs),
+                "unique": len(unique_keys),
+                "found": sum(1 for key in unique_keys if by_key[key].get("success") is not False),
+                "errors": sum(1 for result in results.values() if result.get("code") in (400, 500)),
+                "elapsed_ms": round((time.monotonic() - started) * 1000, 1)
+            }
+        }
+
+    def _call_source(self, source: UPCDataSource, upc: str, cache_key: str,
+                     cache_mode: str = CACHE_MODE_DEFAULT) -> Dict[str, Any]:
+        """Runs one source lookup through the cache and records how it went."""
+        with mcp_trace.span("source", source=source.name) as span:
+            outcome = self._source_outcome(source, upc, cache_key, cache_mode)
+            span.set(status=outcome["timing"]["status"], cache=outcome["timing"].get("cache"))
+            return outcome
+
+    def _source_outcome(self, source: UPCDataSource, upc: str, cache_key: str, cache_mode: str) -> Dict[str, Any]:
+        started = time.monotonic()
+        use_cache = self.cache is not None and cache_mode != CACHE_MODE_BYPASS and source.cacheable
+        cache_status = "bypass" if self.cache is not None and source.cacheable else None
+        # Cached attributes whose prices expired: served if the upstream call fails.
+        stale_entry = None
+
+        if use_cache and cache_mode in (CACHE_MODE_DEFAULT, CACHE_MODE_REFRESH_PRICING):
+            entry = self.cache.get_entry(source.name, cache_key, allow_stale=self.refresher is not None)
+            stale = self._serve_stale(source, upc, cache_key, cache_mode, entry)
+            if stale is not None:
+                stale["timing"]["elapsed_ms"] = round((time.monotonic() - started) * 1000, 1)
+                return stale
+            # refresh_pricing re-fetches every price-bearing source that knows the product.
+            reuse = entry is not None and not entry.stale and (
+                entry.payload is None or not source.price_bearing
+                or (cache_mode == CACHE_MODE_DEFAULT and entry.pricing_fresh))
+            if reuse:
+                timing = {"source": source.name, "status": "hit" if entry.payload else "miss", "cache": "hit",
+                          "elapsed_ms": round((time.monotonic() - started) * 1000, 1)}
+                return {"data": entry.payload, "timing": timing}
+            if entry is not None:
+                stale_entry = entry
+                cache_status = "pricing_stale" if entry.stale or not entry.pricing_fresh else "refresh_pricing"
             else:
-                logger.info(f"DEBUG: No valid data received from {source.__class__.__name__}.")
+                cache_status = "miss"
+        elif use_cache:
+            cache_status = "refresh"
+
+        health = self.source_health.get(source.name)
+        if not health.allow_request():
+            timing = {"source": source.name, "status": "skipped", "circuit": health.state,
+                      "elapsed_ms": round((time.monotonic() - started) * 1000, 1)}
+            if stale_entry is not None:
+                timing.update(status="hit", cache="attributes_only")
+            return {"data": stale_entry.payload if stale_entry else None, "timing": timing}
+
+        error = None
+        call_started = time.monotonic()
+        self.m_upstream_in_flight.inc(source=source.name)
+        try:
+            record = source.get_product_data(upc)
+            # The one conversion of a source's record; cache and merge share the dict.
+            product_data = record.to_dict() if record is not None else None
+            status = "hit" if product_data else "miss"
+        except Exception as e:
+            logger.error(f"Unexpected error from {source.name} for UPC {upc}: {e}")
+            product_data, status, error = None, "error", str(e)
+        finally:
+            self.m_upstream_in_flight.dec(source=source.name)
+        call_elapsed = time.monotonic() - call_started
+        health.record(status, call_elapsed * 1000)
+        self.m_upstream_duration.observe(call_elapsed, source=source.name, outcome=status)
+
+        # Errors are never cached; misses are stored as short-lived negative entries.
+        if use_cache and status != "error":
+            self.cache.put(source.name, cache_key, product_data, split_pricing=source.price_bearing)
+
+        timing = {"source": source.name, "status": status,
+                  "elapsed_ms": round((time.monotonic() - started) * 1000, 1)}
+        if cache_status:
+            timing["cache"] = cache_status
+        if error:
+            timing["error"] = error
+            if stale_entry is not None:
+                # The prices could not be refreshed; the attributes are still good.
+                timing.update(status="hit", cache="attributes_only")
+                product_data = stale_entry.payload
+        return {"data": product_data, "timing": timing}
+
+    def _serve_stale(self, source: UPCDataSource, upc: str, cache_key: str, cache_mode: str,
+                     entry) -> Optional[Dict[str, Any]]:
+        """
+        Stale-while-revalidate: an entry past its TTL (but inside the stale
+        window) is answered from cache at once and refreshed in the
+        background. Returns None when the entry has to be fetched live.
+        """
+        if entry is None or self.refresher is None:
+            return None
+        if entry.stale:
+            # refresh_pricing wants live prices from price-bearing sources.
+            if cache_mode == CACHE_MODE_REFRESH_PRICING and source.price_bearing and entry.payload:
+                return None
+            payload = entry.payload
+            if payload and entry.stale_pricing:
+                payload = dict(payload, **entry.stale_pricing)
+        elif (cache_mode == CACHE_MODE_DEFAULT and source.price_bearing and not entry.pricing_fresh
+              and entry.stale_pricing is not None):
+            payload = dict(entry.payload, **entry.stale_pricing)
+        else:
+            return None
+        self.refresher.schedule(source, upc, cache_key)
+        return {"data": payload, "timing": {"source": source.name, "status": "hit" if payload else "miss",
+                                            "cache": "stale"}}
+
+    def _refresh_source(self, source: UPCDataSource, upc: str, cache_key: str) -> None:
+        """Background refresh of one source's cache entry (see BackgroundRefresher)."""
+        self._call_source(source, upc, cache_key, CACHE_MODE_REFRESH)
+
+    def _refresh_due(self, cache_key: str, ahead_s: float) -> List[UPCDataSource]:
+        """Sources whose cached answer for cache_key expires within ahead_s."""
+        due = []
+        for source in self.upc_data_sources + self.marketplace_sources:
+            remaining = self.cache.expires_in(source.name, cache_key)
+            if remaining is not None and remaining <= ahead_s:
+                due.append(source)
+        return due
+
+    def _lookup_sequential(self, upc: str, cache_key: str, cache_mode: str = CACHE_MODE_DEFAULT):
+        timings = []
+        for source in self.source_health.order(self.upc_data_sources):
+            outcome = self._call_source(source, upc, cache_key, cache_mode)
+            timings.append(outcome["timing"])
+            if outcome["data"]:
+                return self.merger.merge([outcome["data"]]), timings
+        return None, timings
+
+    def _hedge_delay_s(self, source: UPCDataSource) -> float:
+        observed = self.source_health.get(source.name).latency_quantile_ms(self.hedge_quantile)
+        delay_ms = observed if observed is not None else self.hedge_default_delay_ms
+        return max(delay_ms, self.hedge_min_delay_ms) / 1000.0
+
+    def _lookup_hedged(self, upc: str, cache_key: str, cache_mode: str, started: float, deadline: float):
+        """
+        Sources in health order, one at a time, except that when the running
+        source has not answered within its observed p95 latency the next one
+        is fired alongside it (a hedge), if that source's hedge budget allows.
+        The first hit wins; requests still running are abandoned.
+        """
+        sources = self.source_health.order(self.upc_data_sources)
+        for source in sources[1:]:
+            self.source_health.get(source.name).earn_hedge_credit()
+        launched = []  # (source, future, is_hedge)
+        next_index = 0
+        hedge_at = None
+        winner = None
+
+        def launch(hedge: bool) -> None:
+            nonlocal next_index, hedge_at
+            source = sources[next_index]
+            next_index += 1
+            future = self.lookup_executor.submit(mcp_trace.bind(self._call_source), source, upc, cache_key, cache_mode)
+            launched.append((source, future, hedge))
+            hedge_at = time.monotonic() + self._hedge_delay_s(source)
+
+        if sources:
+            launch(hedge=False)
+        while winner is None:
+            pending = [future for _, future, _ in launched if not future.done()]
+            if not pending:
+                # Everything running came back empty: plain fallback to the next source.
+                if next_index >= len(sources):
+                    break
+                launch(hedge=False)
+                continue
+            now = time.monotonic()
+            if now >= deadline:
+                break
+            if hedge_at is not None and now >= hedge_at and next_index < len(sources):
+                target = sources[next_index]
+                if self.source_health.get(target.name).try_hedge():
+                    self.m_hedges.inc(source=target.name, outcome="fired")
+                    launch(hedge=True)
+                else:
+                    self.m_hedges.inc(source=target.name, outcome="denied")
+                    hedge_at = None  # over budget: wait for the running sources instead
+                continue
+            if hedge_at is not None and next_index < len(sources):
+                timeout = min(deadline, hedge_at) - now
+            else:
+                timeout = deadline - now
+            done, _ = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+            # Among finished sources, the one earliest in the order wins.
+            for source, future, hedge in launched:
+                if future in done and future.result()["data"]:
+                    winner = (source, future, hedge)
+                    break
+
+        timings = []
+        unfinished_status = "timeout" if winner is None else "cancelled"
+        hedged = False
+        for source, future, hedge in launched:
+            hedged = hedged or hedge
+            if future.done():
+                timing = future.result()["timing"]
+            else:
+                # Cancels it if it has not started; a running upstream call is
+                # left to finish (its answer still reaches the cache).
+                future.cancel()
+                timing = {"source": source.name, "status": unfinished_status,
+                          "elapsed_ms": round((time.monotonic() - started) * 1000, 1)}
+            if hedge:
+                timing = dict(timing, hedge=True)
+            timings.append(timing)
+
+        with self._hedge_lock:
+            self._hedge_counts["lookups"] += 1
+            if hedged:
+                self._hedge_counts["hedged"] += 1
+            if winner is not None and winner[2]:
+                self._hedge_counts["won"] += 1
+        if winner is None:
+            return None, timings
+        if winner[2]:
+            self.source_health.get(winner[0].name).record_hedge_win()
+            self.m_hedges.inc(source=winner[0].name, outcome="won")
+        return self.merger.merge([winner[1].result()["data"]]), timings
+
+    def _lookup_concurrent(self, upc: str, cache_key: str, strategy: str, cache_mode: str,
+                           started: float, deadline: float, sources: Optional[List[UPCDataSource]] = None,
+                           progress: Optional[Callable[..., None]] = None):
+        # merge_all queries the marketplaces too and keeps the configured
+        # order, which breaks ties in field precedence.
+        if strategy == STRATEGY_MERGE_ALL:
+            sources = list(sources if sources is not None
+                           else self.local_sources + self.upc_data_sources + self.marketplace_sources)
+        else:
+            sources = self.source_health.order(sources if sources is not None else self.upc_data_sources)
+        call_source = mcp_trace.bind(self._call_source)
+        futures = [self.lookup_executor.submit(call_source, source, upc, cache_key, cache_mode) for source in sources]
+        pending = set(futures)
+
+        while pending:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            done, pending = wait(pending, timeout=remaining, return_when=FIRST_COMPLETED)
+            if progress is not None:
+                self._report_progress(progress, sources, futures, done)
+            if strategy == STRATEGY_FIRST_SUCCESS and self._first_success(futures) is not None:
+                break
+
+        # Sources still running either missed the deadline or lost to a
+        # higher-priority hit; their results are discarded.
+        unfinished_status = "timeout" if time.monotonic() >= deadline else "cancelled"
+        outcomes = []
+        for source, future in zip(sources, futures):
+            if future.done():
+                outcomes.append(future.result())
+            else:
+                future.cancel()
+                outcomes.append({"data": None, "timing": {
+                    "source": source.name, "status": unfinished_status,
+                    "elapsed_ms": round((time.monotonic() - started) * 1000, 1)
+                }})
+        timings = [outcome["timing"] for outcome in outcomes]
+        hits = [outcome["data"] for outcome in outcomes if outcome["data"]]
+
+        if not hits:
+            return None, timings
+        if strategy == STRATEGY_FIRST_SUCCESS:
+            return self.merger.merge(hits[:1]), timings
+        return self.merger.merge(hits), timings
+
+    def _report_progress(self, progress: Callable[..., None], sources: List[UPCDataSource],
+                         futures: List[Any], done) -> None:
+        """Sends one progress update per newly finished source, carrying the merge of every hit so far."""
+        finished = [future for future in futures if future.done()]
+        hits = [future.result()["data"] for future in finished if future.result()["data"]]
+        record = self.merger.merge(hits) if hits else None
+        newly_done = [future for future in futures if future in done]
+        for count, future in enumerate(newly_done, start=len(finished) - len(newly_done) + 1):
+            timing = future.result()["timing"]
+            try:
+                progress(count, len(sources), source=timing["source"], status=timing["status"],
+                         record=record)
+            except Exception:
+                # A client that went away must not fail the lookup itself.
+                logger.exception("Failed to send lookup progress notification")
+
+    @staticmethod
+    def _first_success(futures) -> Optional[int]:
+        """Index of the highest-priority hit, once every source ahead of it has finished."""
+        for index, future in enumerate(futures):
+            if not future.done():
+                return None
+            if future.result()["data"]:
+                return index
+        return None
+
+
+def _process_line(server: ProductDataMCPServer, line: str,
+                  notify: Optional[Callable[[Dict[str, Any]], None]] = None) -> Optional[str]:
+    """Handles one line of n8n input and returns the response line (None for blank input)."""
+    line = line.strip()
+    # Raw input is only formatted when DEBUG logging is on; MCP_TRACE_SAMPLE_RATE samples requests instead.
+    logger.debug("Raw JSON input from n8n: %s", line)
+    if not line:
+        return None
+
+    try:
+        n8n_item_data = json.loads(line)
+        # A bare JSON-RPC batch array is accepted as-is.
+        if isinstance(n8n_item_data, list):
+            actual_json_rpc_request = n8n_item_data
+        else:
+            actual_json_rpc_request = n8n_item_data.get("body", {})
+
+        if not actual_json_rpc_request:
+            logger.error("Error: Could not find actual JSON-RPC request nested in n8n input.")
+            return json.dumps({"jsonrpc": "2.0", "error": {"code": -32600, "message": "Invalid n8n input structure: Missing 'original.body'"}})
+
+        # Already parsed, so it goes straight to handle_message rather than back through a string.
+        return server.handle_message(actual_json_rpc_request, notify)
+
+    except json.JSONDecodeError as e:
+        logger.error(f"JSON Decode Error parsing n8n item: {e}. Input was: {line[:500]}...")
+        return json.dumps({"jsonrpc": "2.0", "error": {"code": -32700, "message": f"Parse error: {str(e)}"}})
+    except Exception as e:
+        logger.exception("An unexpected error occurred during processing:")
+        return json.dumps({"jsonrpc": "2.0", "error": {"code": -32000, "message": f"Server error: {str(e)}"}})
+
+
+class StdioResponseWriter:
+    """Writes whole response lines to stdout; the lock keeps concurrent responses from interleaving."""
+
+    def __init__(self, stream=None):
+        self.stream = stream or sys.stdout
+        self._lock = threading.Lock()
+
+    def write(self, response: Optional[str]) -> None:
+        if response is None:
+            return
+        with self._lock:
+            self.stream.write(response + "\n")
+            self.stream.flush()
+
+
+def serve_stdio(server: ProductDataMCPServer, infile=None, writer: Optional[StdioResponseWriter] = None,
+                concurrency: int = 1) -> None:
+    """
+    Reads one request per line and writes one response line each. With
+    concurrency > 1 up to that many requests are handled at once and each
+    response is written as soon as it is ready, so responses may come back
+    out of order (clients match them by JSON-RPC id). Once the limit is
+    reached stdin is not read any further until a request finishes.
+    """
+    infile = infile or sys.stdin
+    writer = writer or StdioResponseWriter()
+    # Progress notifications of streamed lookups go out as their own lines.
+    notify = lambda notification: writer.write(json.dumps(notification))
+    if concurrency <= 1:
+        for line in infile:
+            writer.write(_process_line(server, line, notify))
+        return
+
+    slots = threading.BoundedSemaphore(concurrency)
 
-        logger.error(f"DEBUG: getProductDataByUPC loop finished. No source returned valid data.")
+    def run(line: str) -> None:
         try:
-            # Explicitly check if input_upc is defined here before using it in f-string
-            final_message_upc = input_upc # Assign to a new variable just to be absolutely sure of scope
-            logger.error(f"DEBUG: Final return - input_upc is: {final_message_upc}")
-        except NameError:
-            logger.error(f"DEBUG: NameError: input_upc is not defined in final return block!")
-            final_message_upc = "UNKNOWN_UPC_ERROR" # Fallback if NameError occurs here
+            writer.write(_process_line(server, line, notify))
+        finally:
+            slots.release()
 
-        return {"success": False, "message": f"No product data found for UPC: {final_message_upc} from any configured source.", "code": 404}
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="stdio-rpc") as pool:
+        for line in infile:
+            if not line.strip():
+                continue
+            slots.acquire()  # back-pressure: stop reading while every slot is busy
+            pool.submit(run, line)
+        # Leaving the block waits for in-flight requests before exiting on EOF.
 
 
 def main():
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
     # API KEY IS HARDCODED IN ProductDataMCPServer.__init__ for now.
     server = ProductDataMCPServer()
-    logger.info("mcp-product-data started")
+    # 1 keeps the classic one-at-a-time, in-order loop.
+    concurrency = int(os.getenv("MCP_STDIO_CONCURRENCY", "1"))
+    logger.info(f"mcp-product-data started (stdio concurrency: {concurrency})")
     try:
-        # Read JSON input from stdin (this is separate from the API key argument)
-        for line in sys.stdin:
-            line = line.strip()
-            logger.info(f"DEBUG: Raw JSON input from n8n: {line}") # KEEP THIS DEBUG LINE
-
-            if line:
-                try:
-                    n8n_item_data = json.loads(line)
-                    actual_json_rpc_request = n8n_item_data.get("body", {}) 
-
-                    if not actual_json_rpc_request:
-                        logger.error("Error: Could not find actual JSON-RPC request nested in n8n input.")
-                        print(json.dumps({"jsonrpc": "2.0", "error": {"code": -32600, "message": "Invalid n8n input structure: Missing 'original.body'"}}))
-                        sys.stdout.flush()
-                        continue # Skip to next line or exit
-
-                    # Now pass the correctly extracted JSON-RPC request (as a string) to handle_request
-                    response = server.handle_request(json.dumps(actual_json_rpc_request))
-                    print(response)
-                    sys.stdout.flush()
-
-                except json.JSONDecodeError as e:
-                    logger.error(f"JSON Decode Error parsing n8n item: {e}. Input was: {line[:500]}...")
-                    print(json.dumps({"jsonrpc": "2.0", "error": {"code": -32700, "message": f"Parse error: {str(e)}"}}))
-                    sys.stdout.flush()
-                except Exception as e:
-                    logger.exception("An unexpected error occurred during processing:")
-                    print(json.dumps({"jsonrpc": "2.0", "error": {"code": -32000, "message": f"Server error: {str(e)}"}}))
-                    sys.stdout.flush()
+        serve_stdio(server, concurrency=concurrency)
     except KeyboardInterrupt:
         logger.info("Server shutting down...")
     except Exception as e:
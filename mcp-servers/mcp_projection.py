@@ -0,0 +1,90 @@
+"""
+Lean output options for lookup results, so n8n only receives (and stores in
+its execution data) what a workflow actually uses:
+
+  fields         list (or comma-separated string) of fields to return; dotted
+                 paths select nested values, e.g. "price_stats.min"
+  raw            what to do with the upstream payload in "raw_data": full
+                 (default), truncate (cut to raw_max_bytes of JSON) or none
+  raw_max_bytes  size limit for raw=truncate
+
+The default raw mode can be changed with MCP_RAW_MODE.
+"""
+import json
+import os
+from typing import Any, Dict, List, Optional
+
+RAW_FULL = "full"
+RAW_TRUNCATE = "truncate"
+RAW_NONE = "none"
+RAW_MODES = (RAW_FULL, RAW_TRUNCATE, RAW_NONE)
+
+DEFAULT_RAW_MAX_BYTES = 2048
+
+# Kept even when not asked for, so callers can still tell a miss or an error.
+_ALWAYS_KEPT = ("success", "message", "code")
+
+
+def parse_output_options(params: Dict[str, Any]) -> Dict[str, Any]:
+    """Validates fields/raw/raw_max_bytes from request params; raises ValueError."""
+    fields = params.get("fields")
+    if isinstance(fields, str):
+        fields = [field.strip() for field in fields.split(",") if field.strip()]
+    if fields is not None and (not isinstance(fields, list) or not all(isinstance(f, str) and f for f in fields)):
+        raise ValueError("'fields' must be a list of field names or a comma-separated string")
+
+    raw = params.get("raw", os.getenv("MCP_RAW_MODE", RAW_FULL))
+    if raw not in RAW_MODES:
+        raise ValueError(f"Unknown raw mode: {raw} (allowed: {', '.join(RAW_MODES)})")
+    try:
+        raw_max_bytes = int(params.get("raw_max_bytes", DEFAULT_RAW_MAX_BYTES))
+    except (TypeError, ValueError):
+        raise ValueError("'raw_max_bytes' must be an integer")
+    return {"fields": fields or None, "raw": raw, "raw_max_bytes": max(0, raw_max_bytes)}
+
+
+def wants_raw(options: Dict[str, Any]) -> bool:
+    """Whether the upstream payload is needed at all, so lookups can skip keeping it."""
+    if options["raw"] == RAW_NONE:
+        return False
+    fields = options["fields"]
+    return fields is None or any(field.split(".", 1)[0] == "raw_data" for field in fields)
+
+
+def project(record: Dict[str, Any], fields: Optional[List[str]]) -> Dict[str, Any]:
+    """A new dict with only the given (possibly dotted) fields; missing fields are left out."""
+    if not fields or not isinstance(record, dict):
+        return record
+    projected: Dict[str, Any] = {}
+    for path in list(fields) + [key for key in _ALWAYS_KEPT if key in record]:
+        value = record
+        parts = path.split(".")
+        for part in parts:
+            if not isinstance(value, dict) or part not in value:
+                break
+            value = value[part]
+        else:
+            target = projected
+            for part in parts[:-1]:
+                target = target.setdefault(part, {})
+            target[parts[-1]] = value
+    return projected
+
+
+def shape_raw(record: Dict[str, Any], mode: str, max_bytes: int = DEFAULT_RAW_MAX_BYTES) -> Dict[str, Any]:
+    """Applies a raw mode to record["raw_data"]; returns a copy when anything changes."""
+    if mode == RAW_FULL or not isinstance(record, dict) or "raw_data" not in record:
+        return record
+    shaped = dict(record)
+    if mode == RAW_NONE:
+        del shaped["raw_data"]
+        return shaped
+    encoded = json.dumps(record["raw_data"], separators=(",", ":"))
+    if len(encoded) > max_bytes:
+        shaped["raw_data"] = {"truncated": True, "bytes": len(encoded), "preview": encoded[:max_bytes]}
+    return shaped
+
+
+def shape_output(record: Dict[str, Any], options: Dict[str, Any]) -> Dict[str, Any]:
+    """Applies the raw mode, then the field projection."""
+    return project(shape_raw(record, options["raw"], options["raw_max_bytes"]), options["fields"])
@@ -0,0 +1,88 @@
+"""
+ProductRecord: the one shape every data source produces, from the UPC APIs
+in mcp_product_data to the eBay and Amazon scripts.
+
+Sources fill a record straight from the upstream payload and the server
+turns it into a dict once (to_dict), where it enters the cache and the
+merge. Slots keep a record to a fixed, small allocation.
+"""
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Mapping, Optional
+
+
+@dataclass(slots=True)
+class ProductRecord:
+    upc: str
+    source_used: str
+    product_name: Optional[str] = ""
+    description: Optional[str] = ""
+    brand: Optional[str] = ""
+    category: Optional[str] = ""
+    images_urls: List[str] = field(default_factory=list)
+    ean: Optional[str] = ""
+    mpn: Optional[str] = ""
+    model: Optional[str] = ""
+    price: Optional[float] = None
+    currency: Optional[str] = "USD"
+    features_list: List[str] = field(default_factory=list)
+    manufacturer: Optional[str] = ""
+    dimensions: Optional[str] = ""
+    weight: Optional[str] = ""
+    offers: List[Dict[str, Any]] = field(default_factory=list)
+    success: bool = True
+
+    @classmethod
+    def from_mapping(cls, data: Mapping[str, Any], source: str, upc: str) -> "ProductRecord":
+        """A record from a title/images/features style mapping, such as a local catalog row."""
+        return cls(
+            upc=data.get("upc") or upc,
+            source_used=source,
+            product_name=data.get("title", data.get("productname", "")),
+            description=data.get("description", ""),
+            brand=data.get("brand", ""),
+            category=data.get("category", ""),
+            images_urls=data.get("images", data.get("image_urls", [])),
+            ean=data.get("ean", ""),
+            mpn=data.get("mpn", ""),
+            model=data.get("model", ""),
+            price=data.get("price", None),
+            currency=data.get("currency", "USD"),
+            features_list=data.get("features", []),
+            manufacturer=data.get("manufacturer", ""),
+            dimensions=data.get("dimensions", ""),
+            weight=data.get("weight", ""),
+            offers=data.get("offers", []),
+        )
+
+    def to_dict(self) -> Dict[str, Any]:
+        """The standardized product dict the cache, merge and JSON-RPC results use."""
+        return {
+            "product_name": self.product_name,
+            "description": self.description,
+            "brand": self.brand,
+            "category": self.category,
+            "images_urls": self.images_urls,
+            "ean": self.ean,
+            "mpn": self.mpn,
+            "model": self.model,
+            "price": self.price,
+            "currency": self.currency,
+            "features_list": self.features_list,
+            "manufacturer": self.manufacturer,
+            "dimensions": self.dimensions,
+            "weight": self.weight,
+            "offers": self.offers,
+            "upc": self.upc,
+            "success": self.success,
+            "source_used": self.source_used,
+        }
+
+    def listing(self, raw_data: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """The title/description/price/images output of mcp_ebay.py and mcp_amazon.py."""
+        return {
+            "title": self.product_name,
+            "description": self.description,
+            "price": self.price if self.price is not None else 0.00,
+            "images": self.images_urls,
+            "raw_data": raw_data or {},
+        }
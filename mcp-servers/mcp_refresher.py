@@ -0,0 +1,197 @@
+import heapq
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Hashable, List, Optional, Tuple
+
+from mcp_transport import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+# Refresh reasons
+REFRESH_STALE = "stale"  # a stale entry was just served
+REFRESH_HOT = "hot"      # a frequently scanned entry is about to expire
+
+
+class ScanTracker:
+    """
+    Scan frequency per barcode as an exponentially decayed count, so a SKU
+    that was hot yesterday cools down. Keeps at most max_tracked barcodes.
+    """
+
+    def __init__(self, half_life_s: float = 3600.0, max_tracked: int = 10000):
+        self.half_life_s = half_life_s
+        self.max_tracked = max_tracked
+        # key -> [score, updated_at, lookup code]
+        self._scores: Dict[Hashable, List[Any]] = {}
+        self._lock = threading.Lock()
+
+    def _decayed(self, score: float, updated_at: float, now: float) -> float:
+        return score * 0.5 ** ((now - updated_at) / self.half_life_s)
+
+    def record(self, key: Hashable, upc: str) -> None:
+        now = time.monotonic()
+        with self._lock:
+            entry = self._scores.get(key)
+            if entry is None:
+                self._scores[key] = [1.0, now, upc]
+                if len(self._scores) > self.max_tracked * 1.1:
+                    self._prune(now)
+            else:
+                entry[0] = self._decayed(entry[0], entry[1], now) + 1.0
+                entry[1] = now
+
+    def _prune(self, now: float) -> None:
+        keep = heapq.nlargest(self.max_tracked, self._scores.items(),
+                              key=lambda item: self._decayed(item[1][0], item[1][1], now))
+        self._scores = dict(keep)
+
+    def hottest(self, n: int) -> List[Tuple[Hashable, str, float]]:
+        """The n most scanned barcodes as (key, lookup code, decayed score)."""
+        now = time.monotonic()
+        with self._lock:
+            scored = [(key, entry[2], self._decayed(entry[0], entry[1], now)) for key, entry in self._scores.items()]
+        return heapq.nlargest(n, scored, key=lambda item: item[2])
+
+    def __len__(self) -> int:
+        return len(self._scores)
+
+
+class BackgroundRefresher:
+    """
+    Re-fetches cache entries off the request path: stale entries right after
+    they were served (stale-while-revalidate) and, on a timer, the hottest
+    barcodes before they expire. Refreshes run on their own small pool and
+    token bucket, so they never take workers or rate from live lookups;
+    stale refreshes over budget are dropped (the next scan asks again).
+
+    refresh(source, upc, cache_key) performs one upstream call and stores the
+    result; due_sources(cache_key, ahead_s) returns the sources whose cached
+    answer for the barcode expires within ahead_s.
+    """
+
+    def __init__(self, refresh: Callable[[Any, str, str], Any],
+                 due_sources: Callable[[str, float], List[Any]],
+                 rate_per_s: float = 1.0, burst: float = 5.0, workers: int = 2, max_pending: int = 256,
+                 hot_interval_s: float = 60.0, hot_count: int = 100, refresh_ahead_s: float = 600.0,
+                 tracker: Optional[ScanTracker] = None):
+        self.refresh = refresh
+        self.due_sources = due_sources
+        self.budget = TokenBucket(rate_per_s, burst)
+        self.max_pending = max_pending
+        self.hot_interval_s = hot_interval_s
+        self.hot_count = hot_count
+        self.refresh_ahead_s = refresh_ahead_s
+        self.tracker = tracker or ScanTracker()
+
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="cache-refresh")
+        self._pending = set()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._counts: Dict[str, int] = {}
+
+        self._hot_thread = None
+        if hot_interval_s > 0 and hot_count > 0:
+            self._hot_thread = threading.Thread(target=self._hot_loop, name="hot-sku-refresh", daemon=True)
+            self._hot_thread.start()
+
+    @classmethod
+    def from_env(cls, refresh, due_sources) -> "BackgroundRefresher":
+        return cls(
+            refresh, due_sources,
+            rate_per_s=float(os.getenv("MCP_REFRESH_RATE_PER_S", 1.0)),
+            burst=float(os.getenv("MCP_REFRESH_BURST", 5)),
+            workers=int(os.getenv("MCP_REFRESH_WORKERS", 2)),
+            max_pending=int(os.getenv("MCP_REFRESH_MAX_PENDING", 256)),
+            hot_interval_s=float(os.getenv("MCP_HOT_REFRESH_INTERVAL_S", 60)),
+            hot_count=int(os.getenv("MCP_HOT_SKU_COUNT", 100)),
+            refresh_ahead_s=float(os.getenv("MCP_HOT_REFRESH_AHEAD_S", 600)),
+            tracker=ScanTracker(
+                half_life_s=float(os.getenv("MCP_HOT_HALF_LIFE_S", 3600)),
+                max_tracked=int(os.getenv("MCP_HOT_MAX_TRACKED", 10000)),
+            ),
+        )
+
+    def record_scan(self, cache_key: str, upc: str) -> None:
+        self.tracker.record(cache_key, upc)
+
+    def _count(self, name: str) -> None:
+        with self._lock:
+            self._counts[name] = self._counts.get(name, 0) + 1
+
+    def schedule(self, source, upc: str, cache_key: str, reason: str = REFRESH_STALE) -> bool:
+        """Queues one refresh unless it is already pending, the queue is full or the budget is spent."""
+        key = (source.name, cache_key)
+        with self._lock:
+            if key in self._pending:
+                return False
+            if len(self._pending) >= self.max_pending:
+                self._counts["dropped_queue_full"] = self._counts.get("dropped_queue_full", 0) + 1
+                return False
+            self._pending.add(key)
+        if reason == REFRESH_STALE and not self.budget.try_acquire():
+            with self._lock:
+                self._pending.discard(key)
+            self._count("dropped_rate_limited")
+            return False
+        self._count(f"scheduled_{reason}")
+        try:
+            self._executor.submit(self._run, key, source, upc, cache_key)
+        except RuntimeError:
+            # Shut down while scheduling.
+            with self._lock:
+                self._pending.discard(key)
+            return False
+        return True
+
+    def is_pending(self, source, cache_key: str) -> bool:
+        with self._lock:
+            return (source.name, cache_key) in self._pending
+
+    def _run(self, key, source, upc: str, cache_key: str) -> None:
+        try:
+            self.refresh(source, upc, cache_key)
+            self._count("completed")
+        except Exception:
+            logger.exception(f"Background refresh of {cache_key} from {source.name} failed")
+            self._count("failed")
+        finally:
+            with self._lock:
+                self._pending.discard(key)
+
+    def _hot_loop(self) -> None:
+        while not self._stop.wait(self.hot_interval_s):
+            try:
+                self.refresh_hot()
+            except Exception:
+                logger.exception("Hot SKU refresh pass failed")
+
+    def refresh_hot(self) -> int:
+        """Schedules refreshes for the hottest barcodes whose entries expire soon; returns how many."""
+        scheduled = 0
+        for cache_key, upc, _ in self.tracker.hottest(self.hot_count):
+            for source in self.due_sources(cache_key, self.refresh_ahead_s):
+                if self.is_pending(source, cache_key):
+                    continue  # already being refreshed; keep the budget for the rest
+                # Hot refreshes wait for budget instead of being dropped, but
+                # never past the next pass.
+                if not self.budget.acquire(self.hot_interval_s, self._stop):
+                    return scheduled
+                if self.schedule(source, upc, cache_key, REFRESH_HOT):
+                    scheduled += 1
+                else:
+                    self.budget.refund()
+        return scheduled
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._counts)
+            stats["pending"] = len(self._pending)
+        stats["tracked_skus"] = len(self.tracker)
+        return stats
+
+    def close(self) -> None:
+        self._stop.set()
+        self._executor.shutdown(wait=False)
@@ -0,0 +1,219 @@
+import os
+import threading
+import time
+from collections import deque
+from typing import Dict, Any, List, Iterable, Optional
+
+# Circuit breaker states
+CIRCUIT_CLOSED = "closed"        # calls flow normally
+CIRCUIT_OPEN = "open"            # calls are skipped until the cool-down expires
+CIRCUIT_HALF_OPEN = "half_open"  # one probe call decides whether to close again
+
+# Priors used before a source has any samples, so fresh sources keep their
+# configured order (ties are broken by position).
+_PRIOR_LATENCY_MS = 500.0
+_PRIOR_HIT_RATE = 0.5
+_MIN_ANSWER_RATE = 0.05
+# Latency quantiles need a few samples before they mean anything.
+_MIN_QUANTILE_SAMPLES = 10
+
+
+class SourceHealth:
+    """
+    Rolling health of one upstream source: EWMA latency, error rate and hit
+    rate, plus a circuit breaker that opens after repeated failures and lets a
+    single half-open probe through once the cool-down has passed.
+
+    It also keeps the latencies of the last latency_window answered calls
+    for tail quantiles, and the hedge budget: hedge_budget hedged requests
+    per lookup that could have hedged to this source, banked up to
+    hedge_burst.
+    """
+
+    def __init__(self, name: str, alpha: float = 0.2, failure_threshold: int = 5,
+                 error_rate_threshold: float = 0.5, min_samples: int = 20, cooldown_s: float = 30.0,
+                 latency_window: int = 200, hedge_budget: float = 0.1, hedge_burst: float = 5.0):
+        self.name = name
+        self.alpha = alpha
+        self.failure_threshold = failure_threshold
+        self.error_rate_threshold = error_rate_threshold
+        self.min_samples = min_samples
+        self.cooldown_s = cooldown_s
+        self.hedge_budget = hedge_budget
+        self.hedge_burst = hedge_burst
+
+        self.latency_ms = None
+        self.error_rate = 0.0
+        self.hit_rate = None
+        self.calls = 0
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+        self.short_circuited = 0
+        self._recent_latencies = deque(maxlen=latency_window)
+
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.hedges_denied = 0
+        self._hedge_credit = hedge_burst
+
+        self.state = CIRCUIT_CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+
+    def allow_request(self) -> bool:
+        with self._lock:
+            if self.state == CIRCUIT_CLOSED:
+                return True
+            if self.state == CIRCUIT_OPEN and time.monotonic() - self.opened_at >= self.cooldown_s:
+                self.state = CIRCUIT_HALF_OPEN
+                self._probe_in_flight = False
+            if self.state == CIRCUIT_HALF_OPEN and not self._probe_in_flight:
+                self._probe_in_flight = True
+                return True
+            self.short_circuited += 1
+            return False
+
+    def record(self, status: str, elapsed_ms: float) -> None:
+        """Records one upstream call; status is "hit", "miss" or "error"."""
+        failed = status == "error"
+        with self._lock:
+            self.calls += 1
+            if status == "hit":
+                self.hits += 1
+            elif status == "miss":
+                self.misses += 1
+            else:
+                self.errors += 1
+
+            self.latency_ms = elapsed_ms if self.latency_ms is None else self._ewma(self.latency_ms, elapsed_ms)
+            if not failed:
+                self._recent_latencies.append(elapsed_ms)
+            self.error_rate = self._ewma(self.error_rate, 1.0 if failed else 0.0)
+            if not failed:
+                hit = 1.0 if status == "hit" else 0.0
+                self.hit_rate = hit if self.hit_rate is None else self._ewma(self.hit_rate, hit)
+
+            if failed:
+                self.consecutive_failures += 1
+                if self.state == CIRCUIT_HALF_OPEN or self._should_trip():
+                    self.state = CIRCUIT_OPEN
+                    self.opened_at = time.monotonic()
+                    self._probe_in_flight = False
+            else:
+                self.consecutive_failures = 0
+                if self.state != CIRCUIT_CLOSED:
+                    self.state = CIRCUIT_CLOSED
+                    self._probe_in_flight = False
+
+    def latency_quantile_ms(self, q: float) -> Optional[float]:
+        """Latency quantile over the recent answered calls; None until there are enough samples."""
+        with self._lock:
+            return self._quantile_unlocked(q)
+
+    def earn_hedge_credit(self) -> None:
+        with self._lock:
+            self._hedge_credit = min(self.hedge_burst, self._hedge_credit + self.hedge_budget)
+
+    def try_hedge(self) -> bool:
+        """Spends one hedge from the budget; False (and counted as denied) when it is used up."""
+        with self._lock:
+            if self._hedge_credit < 1.0:
+                self.hedges_denied += 1
+                return False
+            self._hedge_credit -= 1.0
+            self.hedges += 1
+            return True
+
+    def record_hedge_win(self) -> None:
+        with self._lock:
+            self.hedge_wins += 1
+
+    def expected_time_to_answer_ms(self) -> float:
+        """Expected latency divided by the chance this source returns a usable answer."""
+        latency = self.latency_ms if self.latency_ms is not None else _PRIOR_LATENCY_MS
+        hit_rate = self.hit_rate if self.hit_rate is not None else _PRIOR_HIT_RATE
+        return latency / max(hit_rate * (1.0 - self.error_rate), _MIN_ANSWER_RATE)
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            p95 = self._quantile_unlocked(0.95)
+            return {
+                "source": self.name,
+                "state": self.state,
+                "latency_ms": round(self.latency_ms, 1) if self.latency_ms is not None else None,
+                "error_rate": round(self.error_rate, 3),
+                "hit_rate": round(self.hit_rate, 3) if self.hit_rate is not None else None,
+                "expected_time_to_answer_ms": round(self.expected_time_to_answer_ms(), 1),
+                "consecutive_failures": self.consecutive_failures,
+                "calls": self.calls,
+                "hits": self.hits,
+                "misses": self.misses,
+                "errors": self.errors,
+                "short_circuited": self.short_circuited,
+                "latency_p95_ms": round(p95, 1) if p95 is not None else None,
+                "hedges": self.hedges,
+                "hedge_wins": self.hedge_wins,
+                "hedges_denied": self.hedges_denied,
+            }
+
+    def _quantile_unlocked(self, q: float) -> Optional[float]:
+        samples = sorted(self._recent_latencies)
+        if len(samples) < _MIN_QUANTILE_SAMPLES:
+            return None
+        return samples[min(len(samples) - 1, int(q * len(samples)))]
+
+    def _should_trip(self) -> bool:
+        if self.consecutive_failures >= self.failure_threshold:
+            return True
+        return self.calls >= self.min_samples and self.error_rate >= self.error_rate_threshold
+
+    def _ewma(self, current: float, sample: float) -> float:
+        return current + self.alpha * (sample - current)
+
+
+class SourceHealthRegistry:
+    """Health for every configured source, and the adaptive ordering built on it."""
+
+    def __init__(self, names: Iterable[str], adaptive: bool = True, **health_options):
+        self.adaptive = adaptive
+        self._health_options = health_options
+        self._health: Dict[str, SourceHealth] = {name: SourceHealth(name, **health_options) for name in names}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls, names: Iterable[str]) -> "SourceHealthRegistry":
+        return cls(
+            names,
+            adaptive=os.getenv("MCP_ADAPTIVE_ORDERING", "1").lower() not in ("0", "false", "no"),
+            alpha=float(os.getenv("MCP_HEALTH_EWMA_ALPHA", 0.2)),
+            failure_threshold=int(os.getenv("MCP_BREAKER_FAILURE_THRESHOLD", 5)),
+            error_rate_threshold=float(os.getenv("MCP_BREAKER_ERROR_RATE", 0.5)),
+            cooldown_s=float(os.getenv("MCP_BREAKER_COOLDOWN_S", 30)),
+            hedge_budget=float(os.getenv("MCP_HEDGE_BUDGET", 0.1)),
+            hedge_burst=float(os.getenv("MCP_HEDGE_BURST", 5)),
+        )
+
+    def get(self, name: str) -> SourceHealth:
+        health = self._health.get(name)
+        if health is None:
+            with self._lock:
+                health = self._health.setdefault(name, SourceHealth(name, **self._health_options))
+        return health
+
+    def order(self, sources: List[Any]) -> List[Any]:
+        """Sorts sources by expected time-to-answer; configured order breaks ties."""
+        if not self.adaptive:
+            return list(sources)
+        ranked = sorted(enumerate(sources),
+                        key=lambda item: (self.get(item[1].name).expected_time_to_answer_ms(), item[0]))
+        return [source for _, source in ranked]
+
+    def snapshot(self, sources: List[Any]) -> Dict[str, Any]:
+        return {
+            "adaptive_ordering": self.adaptive,
+            "order": [source.name for source in self.order(sources)],
+            "sources": [self.get(source.name).snapshot() for source in sources],
+        }
@@ -0,0 +1,205 @@
+"""
+Sampled per-request trace spans and slow-request profiles for the JSON-RPC
+server, in place of logging whole payloads on every lookup.
+
+MCP_TRACE_SAMPLE_RATE (0-1, default 0) of requests are traced: each span
+(the request, the lookup, every source call) records its duration and a few
+attributes, and the finished trace is logged as one JSON line on the
+mcp_trace logger:
+
+  {"trace_id": "...", "name": "rpc", "duration_ms": 12.4, "attrs": {"method": ...},
+   "spans": [{"name": "source", "start_ms": 0.3, "duration_ms": 11.8, "source": "upcitemdb.com", ...}]}
+
+Setting MCP_PROFILE_SLOW_MS runs MCP_PROFILE_SAMPLE_RATE (default 1) of
+requests under cProfile and writes those slower than that many ms to
+MCP_PROFILE_DIR (default ./profiles) as <method>-<time>-<pid>-<n>-<ms>ms.prof, for
+`python -m pstats`. cProfile only sees the thread handling the request; the
+source calls it fans out to the lookup pool show up as the wait for them.
+
+Requests that are neither traced nor profiled pay at most a random() call
+per request and a context variable read per span.
+"""
+import contextvars
+import itertools
+import json
+import logging
+import os
+import random
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+_current: contextvars.ContextVar[Optional["Trace"]] = contextvars.ContextVar("mcp_trace", default=None)
+
+
+class Trace:
+    """The spans of one sampled request."""
+    __slots__ = ("trace_id", "name", "attrs", "started", "spans", "_lock")
+
+    def __init__(self, name: str, attrs: Dict[str, Any]):
+        self.trace_id = os.urandom(8).hex()
+        self.name = name
+        self.attrs = attrs
+        self.started = time.perf_counter()
+        self.spans: List[Dict[str, Any]] = []
+        self._lock = threading.Lock()
+
+    def add(self, name: str, started: float, ended: float, attrs: Dict[str, Any]) -> None:
+        span = {"name": name, "start_ms": round((started - self.started) * 1000, 3),
+                "duration_ms": round((ended - started) * 1000, 3)}
+        span.update(attrs)
+        with self._lock:  # source spans finish on pool threads
+            self.spans.append(span)
+
+    def to_dict(self, ended: float) -> Dict[str, Any]:
+        with self._lock:
+            spans = sorted(self.spans, key=lambda span: span["start_ms"])
+        return {"trace_id": self.trace_id, "name": self.name,
+                "duration_ms": round((ended - self.started) * 1000, 3), "attrs": self.attrs, "spans": spans}
+
+
+class Span:
+    __slots__ = ("trace", "name", "attrs", "started")
+
+    def __init__(self, trace: Trace, name: str, attrs: Dict[str, Any]):
+        self.trace = trace
+        self.name = name
+        self.attrs = attrs
+        self.started = 0.0
+
+    def set(self, **attrs) -> None:
+        self.attrs.update(attrs)
+
+    def __enter__(self) -> "Span":
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> bool:
+        if exc_type is not None:
+            self.attrs["error"] = exc_type.__name__
+        self.trace.add(self.name, self.started, time.perf_counter(), self.attrs)
+        return False
+
+
+class _NoopSpan:
+    """Stands in for Span and request scopes when nothing is recorded."""
+    __slots__ = ()
+
+    def set(self, **attrs) -> None:
+        pass
+
+    def __enter__(self) -> "_NoopSpan":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> bool:
+        return False
+
+
+_NOOP = _NoopSpan()
+
+
+def span(name: str, **attrs):
+    """A span in the current request's trace; a no-op when the request is not traced."""
+    trace = _current.get()
+    if trace is None:
+        return _NOOP
+    return Span(trace, name, attrs)
+
+
+def bind(fn: Callable) -> Callable:
+    """fn, carrying the current trace into the thread that runs it (for executor tasks)."""
+    trace = _current.get()
+    if trace is None:
+        return fn
+
+    def run(*args, **kwargs):
+        token = _current.set(trace)
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            _current.reset(token)
+    return run
+
+
+class _RequestScope:
+    def __init__(self, tracer: "RequestTracer", name: str, attrs: Dict[str, Any], traced: bool, profiled: bool):
+        self.tracer = tracer
+        self.name = name
+        self.attrs = attrs
+        self.trace = Trace(name, attrs) if traced else None
+        self.profiler = None
+        if profiled:
+            import cProfile
+            self.profiler = cProfile.Profile()
+        self._token = None
+        self._started = 0.0
+
+    def set(self, **attrs) -> None:
+        self.attrs.update(attrs)
+
+    def __enter__(self) -> "_RequestScope":
+        if self.trace is not None:
+            self._token = _current.set(self.trace)
+        if self.profiler is not None:
+            try:
+                self.profiler.enable()
+            except ValueError:
+                self.profiler = None  # another profiler already runs on this thread
+        self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> bool:
+        ended = time.perf_counter()
+        if self.profiler is not None:
+            self.profiler.disable()
+            elapsed_ms = (ended - self._started) * 1000
+            if elapsed_ms >= self.tracer.profile_slow_ms:
+                self.tracer.dump_profile(self.profiler, self.attrs.get("method") or self.name, elapsed_ms)
+        if self.trace is not None:
+            _current.reset(self._token)
+            if exc_type is not None:
+                self.attrs["error"] = exc_type.__name__
+            logger.info(json.dumps(self.trace.to_dict(ended), default=str))
+        return False
+
+
+class RequestTracer:
+    def __init__(self, sample_rate: float = 0.0, profile_slow_ms: Optional[float] = None,
+                 profile_dir: str = "profiles", profile_sample_rate: float = 1.0):
+        self.sample_rate = sample_rate
+        self.profile_slow_ms = profile_slow_ms
+        self.profile_dir = profile_dir
+        self.profile_sample_rate = profile_sample_rate
+        self.profiles_written = 0
+        self._sequence = itertools.count(1)
+
+    @classmethod
+    def from_env(cls) -> "RequestTracer":
+        slow_ms = os.getenv("MCP_PROFILE_SLOW_MS")
+        return cls(
+            sample_rate=float(os.getenv("MCP_TRACE_SAMPLE_RATE", 0)),
+            profile_slow_ms=float(slow_ms) if slow_ms else None,
+            profile_dir=os.getenv("MCP_PROFILE_DIR", "profiles"),
+            profile_sample_rate=float(os.getenv("MCP_PROFILE_SAMPLE_RATE", 1)),
+        )
+
+    def request(self, name: str, **attrs):
+        """Scope for one request: traced and/or profiled as sampled, otherwise a no-op."""
+        traced = self.sample_rate > 0 and random.random() < self.sample_rate
+        profiled = self.profile_slow_ms is not None and random.random() < self.profile_sample_rate
+        if not traced and not profiled:
+            return _NOOP
+        return _RequestScope(self, name, attrs, traced, profiled)
+
+    def dump_profile(self, profiler, label: str, elapsed_ms: float) -> None:
+        try:
+            os.makedirs(self.profile_dir, exist_ok=True)
+            path = os.path.join(self.profile_dir, f"{label}-{time.strftime('%Y%m%d-%H%M%S')}-"
+                                                  f"{os.getpid()}-{next(self._sequence)}-{elapsed_ms:.0f}ms.prof")
+            profiler.dump_stats(path)
+            self.profiles_written += 1
+            logger.warning(f"Slow request ({elapsed_ms:.0f} ms), profile written to {path}")
+        except OSError as e:
+            logger.error(f"Could not write request profile: {e}")
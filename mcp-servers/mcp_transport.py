@@ -0,0 +1,221 @@
+import os
+import random
+import threading
+import time
+import logging
+from typing import TYPE_CHECKING, Callable, Optional, Tuple
+
+# requests (~100 ms to import) is loaded when the first transport is built,
+# so scripts that never reach the network do not pay for it.
+if TYPE_CHECKING:
+    import requests
+
+logger = logging.getLogger(__name__)
+
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+
+class TokenBucket:
+    """Allows `rate_per_s` operations per second on average, with bursts of up to `burst`."""
+
+    def __init__(self, rate_per_s: float, burst: float):
+        self.rate_per_s = rate_per_s
+        self.capacity = max(burst, 1.0)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float) -> None:
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate_per_s)
+        self._updated = now
+
+    def try_acquire(self) -> bool:
+        with self._lock:
+            self._refill(time.monotonic())
+            if self._tokens >= 1.0:
+                self._tokens -= 1.0
+                return True
+            return False
+
+    def refund(self) -> None:
+        """Returns a token taken for work that did not happen."""
+        with self._lock:
+            self._tokens = min(self.capacity, self._tokens + 1.0)
+
+    def acquire(self, timeout_s: float, stop: Optional[threading.Event] = None) -> bool:
+        """Waits up to timeout_s for a token; gives up early once `stop` is set."""
+        deadline = time.monotonic() + timeout_s
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                if self._tokens >= 1.0:
+                    self._tokens -= 1.0
+                    return True
+                wait_s = (1.0 - self._tokens) / self.rate_per_s if self.rate_per_s > 0 else timeout_s
+            wait_s = min(wait_s, deadline - now)
+            if wait_s <= 0:
+                return False
+            if stop is not None:
+                if stop.wait(wait_s):
+                    return False
+            else:
+                time.sleep(wait_s)
+
+
+class HTTPTransport:
+    """
+    Shared HTTP layer for every upstream lookup: one pooled keep-alive session
+    (a connection pool per host), split connect/read timeouts, and retries with
+    jittered exponential backoff that honour Retry-After.
+
+    All upstream calls made through it are read-only lookups, so every request
+    is considered safe to retry.
+    """
+
+    def __init__(self, pool_connections: int = 10, pool_maxsize: int = 32,
+                 connect_timeout: float = 3.05, read_timeout: float = 10.0,
+                 max_retries: int = 2, backoff_base: float = 0.2, backoff_max: float = 5.0,
+                 retry_after_max: float = 30.0):
+        import requests
+        from requests.adapters import HTTPAdapter
+
+        self.timeout: Tuple[float, float] = (connect_timeout, read_timeout)
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.retry_after_max = retry_after_max
+        self.transient_errors = (requests.exceptions.ConnectionError, requests.exceptions.Timeout)
+
+        # pool_connections is the number of hosts kept, pool_maxsize the number
+        # of keep-alive connections per host. Retries are ours, not urllib3's.
+        self.adapter = HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize, max_retries=0)
+        self.session = requests.Session()
+        self.session.mount("https://", self.adapter)
+        self.session.mount("http://", self.adapter)
+
+    @classmethod
+    def from_env(cls) -> "HTTPTransport":
+        return cls(
+            pool_connections=int(os.getenv("MCP_HTTP_POOL_CONNECTIONS", 10)),
+            pool_maxsize=int(os.getenv("MCP_HTTP_POOL_MAXSIZE", 32)),
+            connect_timeout=float(os.getenv("MCP_HTTP_CONNECT_TIMEOUT", 3.05)),
+            read_timeout=float(os.getenv("MCP_HTTP_READ_TIMEOUT", 10)),
+            max_retries=int(os.getenv("MCP_HTTP_MAX_RETRIES", 2)),
+            backoff_base=float(os.getenv("MCP_HTTP_BACKOFF_BASE", 0.2)),
+            backoff_max=float(os.getenv("MCP_HTTP_BACKOFF_MAX", 5)),
+            retry_after_max=float(os.getenv("MCP_HTTP_RETRY_AFTER_MAX", 30)),
+        )
+
+    def get(self, url: str, **kwargs) -> "requests.Response":
+        return self.request("GET", url, **kwargs)
+
+    def request(self, method: str, url: str, **kwargs) -> "requests.Response":
+        kwargs.setdefault("timeout", self.timeout)
+        return self.with_retries(lambda: self.session.request(method, url, **kwargs), url)
+
+    def with_retries(self, send: Callable[[], "requests.Response"], url: str) -> "requests.Response":
+        """
+        Calls send() until it returns a non-retryable response or the retry
+        budget is spent. The last response is returned as-is (callers decide
+        whether to raise_for_status); the last transport error is re-raised.
+        """
+        attempt = 0
+        while True:
+            try:
+                response = send()
+            except self.transient_errors as e:
+                if attempt >= self.max_retries:
+                    raise
+                delay = self._backoff(attempt)
+                logger.warning(f"Transport error for {url} ({e}); retry {attempt + 1} in {delay:.2f}s")
+            else:
+                if response.status_code not in RETRY_STATUSES or attempt >= self.max_retries:
+                    return response
+                delay = self._retry_after(response)
+                if delay is None:
+                    delay = self._backoff(attempt)
+                elif delay > self.retry_after_max:
+                    # Upstream asked us to back off longer than we're willing to wait.
+                    return response
+                logger.warning(f"HTTP {response.status_code} from {url}; retry {attempt + 1} in {delay:.2f}s")
+                response.close()
+            time.sleep(delay)
+            attempt += 1
+
+    def _backoff(self, attempt: int) -> float:
+        # "Full jitter": uniform over [0, min(cap, base * 2^attempt)].
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
+    @staticmethod
+    def _retry_after(response: "requests.Response") -> Optional[float]:
+        value = response.headers.get("Retry-After")
+        if not value:
+            return None
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            pass
+        from email.utils import parsedate_to_datetime  # HTTP-date form; rare, and email.utils is slow to import
+        try:
+            return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+        except (TypeError, ValueError):
+            return None
+
+    def sdk_session(self) -> "requests.Session":
+        """
+        A requests.Session for third-party SDKs (e.g. ebaysdk) that shares this
+        transport's connection pools and retry policy.
+        """
+        return _shared_session_class()(self)
+
+
+_shared_session = None
+
+
+def _shared_session_class():
+    """The requests.Session subclass behind sdk_session, defined once requests is loaded."""
+    global _shared_session
+    if _shared_session is None:
+        import requests
+
+        class _SharedSession(requests.Session):
+            def __init__(self, transport: HTTPTransport):
+                super().__init__()
+                self._transport = transport
+                self.mount("https://", transport.adapter)
+                self.mount("http://", transport.adapter)
+
+            def send(self, request, **kwargs):
+                return self._transport.with_retries(lambda: requests.Session.send(self, request, **kwargs), request.url)
+
+            def close(self):
+                # The pools belong to the transport; SDKs that close their session after
+                # every call (ebaysdk does) must not tear down keep-alive connections.
+                pass
+
+        _shared_session = _SharedSession
+    return _shared_session
+
+
+_transport: Optional[HTTPTransport] = None
+_transport_lock = threading.Lock()
+
+
+def get_transport() -> HTTPTransport:
+    """Process-wide transport, built from MCP_HTTP_* variables on first use."""
+    global _transport
+    if _transport is None:
+        with _transport_lock:
+            if _transport is None:
+                _transport = HTTPTransport.from_env()
+    return _transport
+
+
+def __getattr__(name):
+    # mcp_transport.RequestException, for except clauses; only resolved when
+    # an exception is actually being matched, by which time requests is loaded.
+    if name == "RequestException":
+        from requests.exceptions import RequestException
+        return RequestException
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
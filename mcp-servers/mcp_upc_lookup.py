@@ -1,84 +1,111 @@
 #!/usr/bin/env python3
 import json, sys
-import requests
 import os
+from concurrent.futures import ThreadPoolExecutor
 
-payload = json.loads(sys.stdin.read())
-upc = payload.get("upc", "")
+import mcp_transport
+from mcp_merge import MergeEngine
+from mcp_projection import parse_output_options, shape_output, wants_raw
+from mcp_transport import get_transport
 
-result = {}
-raw_upc_data = {}
+_merger = MergeEngine.from_env()
 
-# --- UPCitemdb.com (Trial API) ---
-try:
-    upcitemdb_url = f"https://api.upcitemdb.com/prod/trial/lookup?upc={upc}" # CORRECTED URL
-    upcitemdb_response = requests.get(upcitemdb_url, timeout=10)
-    upcitemdb_response.raise_for_status()
-    upcitemdb_data = upcitemdb_response.json()
-    raw_upc_data['upcitemdb'] = upcitemdb_data
-
-    if upcitemdb_data and upcitemdb_data.get('items'):
-        item = upcitemdb_data['items'][0]
-        result['title'] = item.get('title')
-        result['description'] = item.get('description')
-        if item.get('offers'):
-            prices = [offer.get('price') for offer in item['offers'] if offer.get('price') is not None]
-            if prices:
-                result['lowest_price_upc'] = min(prices)
-                result['highest_price_upc'] = max(prices)
-        if item.get('images'):
-            result['images'] = item['images']
+def _fetch_upcitemdb(upc):
+    """Returns (standardized record or None, raw response) from UPCitemdb.com (Trial API)."""
+    try:
+        upcitemdb_url = os.environ.get("UPC_ITEMDB_LOOKUP_URL", "https://api.upcitemdb.com/prod/trial/lookup")
+        upcitemdb_response = get_transport().get(upcitemdb_url, params={"upc": upc})
+        upcitemdb_response.raise_for_status()
+        upcitemdb_data = upcitemdb_response.json()
 
-except requests.exceptions.RequestException as e:
-    sys.stderr.write(f"Error querying UPCitemdb.com: {e}\n")
-except Exception as e:
-    sys.stderr.write(f"Error processing UPCitemdb.com data: {e}\n")
+        if upcitemdb_data and upcitemdb_data.get('items'):
+            item = upcitemdb_data['items'][0]
+            return {
+                "product_name": item.get('title'),
+                "description": item.get('description'),
+                "images_urls": item.get('images') or [],
+                "offers": item.get('offers') or [],
+                "source_used": "upcitemdb.com"
+            }, upcitemdb_data
+        return None, upcitemdb_data
 
-# --- upcdatabase.org ---
-UPC_DATABASE_API_KEY = os.environ.get("UPC_DATABASE_API_KEY")
+    except mcp_transport.RequestException as e:
+        sys.stderr.write(f"Error querying UPCitemdb.com: {e}\n")
+    except Exception as e:
+        sys.stderr.write(f"Error processing UPCitemdb.com data: {e}\n")
+    return None, None
 
-if UPC_DATABASE_API_KEY:
+def _fetch_upcdatabase(upc, api_key):
+    """Returns (standardized record or None, raw response) from upcdatabase.org."""
     try:
-        upcdatabase_url = f"https://api.upcdatabase.org/v1/product/{upc}"
-        headers = {"Authorization": f"Bearer {UPC_DATABASE_API_KEY}"}
-        upcdatabase_response = requests.get(upcdatabase_url, headers=headers, timeout=10)
+        upcdatabase_url = os.environ.get("UPC_DATABASE_PRODUCT_URL", "https://api.upcdatabase.org/v1/product/") + upc
+        headers = {"Authorization": f"Bearer {api_key}"}
+        upcdatabase_response = get_transport().get(upcdatabase_url, headers=headers)
         upcdatabase_response.raise_for_status()
         upcdatabase_data = upcdatabase_response.json()
-        raw_upc_data['upcdatabase_org'] = upcdatabase_data
 
         if upcdatabase_data and upcdatabase_data.get('success'):
             product = upcdatabase_data.get('item')
             if product:
-                result['title'] = result.get('title') or product.get('title')
-                result['description'] = result.get('description') or product.get('description')
-                result['price'] = result.get('price') or product.get('avg_price')
-                if product.get('images'):
-                    result['images'] = result.get('images') or product['images']
+                return {
+                    "product_name": product.get('title'),
+                    "description": product.get('description'),
+                    "price": product.get('avg_price'),
+                    "images_urls": product.get('images') or [],
+                    "source_used": "upcdatabase.org"
+                }, upcdatabase_data
+        return None, upcdatabase_data
 
-    except requests.exceptions.RequestException as e:
+    except mcp_transport.RequestException as e:
         sys.stderr.write(f"Error querying upcdatabase.org: {e}\n")
     except Exception as e:
         sys.stderr.write(f"Error processing upcdatabase.org data: {e}\n")
-else:
-    sys.stderr.write("UPC_DATABASE_API_KEY not found in environment variables. Skipping upcdatabase.org lookup.\n")
+    return None, None
+
+def lookup_upc(upc, include_raw=True):
+    # Both sources are queried in parallel and merged field by field
+    # (UPCitemdb.com first for title and description, images unioned).
+    fetchers = {'upcitemdb': lambda: _fetch_upcitemdb(upc)}
+    UPC_DATABASE_API_KEY = os.environ.get("UPC_DATABASE_API_KEY")
+    if UPC_DATABASE_API_KEY:
+        fetchers['upcdatabase_org'] = lambda: _fetch_upcdatabase(upc, UPC_DATABASE_API_KEY)
+    else:
+        sys.stderr.write("UPC_DATABASE_API_KEY not found in environment variables. Skipping upcdatabase.org lookup.\n")
 
-if not result.get('title'):
-    result['title'] = f"Product Title for UPC {upc} (No external data)"
-if not result.get('description'):
-    result['description'] = "No description available from external UPC sources."
-if not result.get('price'):
-    result['price'] = 0.00
+    with ThreadPoolExecutor(max_workers=len(fetchers)) as pool:
+        futures = {name: pool.submit(fetch) for name, fetch in fetchers.items()}
+        outcomes = {name: future.result() for name, future in futures.items()}
 
-if not result.get('images'):
-    result['images'] = []
+    raw_upc_data = {name: raw for name, (_, raw) in outcomes.items() if raw is not None} if include_raw else {}
+    result = _merger.merge([record for record, _ in outcomes.values() if record])
+    price_stats = result.get('price_stats') or {}
+
+    if not result.get('product_name'):
+        result['product_name'] = f"Product Title for UPC {upc} (No external data)"
+    if not result.get('description'):
+        result['description'] = "No description available from external UPC sources."
+    if not result.get('price'):
+        result['price'] = 0.00
+
+    return {
+        "title": result.get('product_name'),
+        "description": result.get('description'),
+        "price": result.get('price'),
+        "lowest_price": price_stats.get('min', result.get('price')),
+        "highest_price": price_stats.get('max', result.get('price')),
+        "images": result.get('images_urls') or [],
+        "price_stats": price_stats or None,
+        "provenance": result.get('provenance', {}),
+        "raw_data": raw_upc_data
+    }
+
+def main():
+    payload = json.loads(sys.stdin.read())
+    try:
+        options = parse_output_options(payload)
+    except ValueError as e:
+        sys.exit(f"Invalid output options: {e}")
+    print(json.dumps(shape_output(lookup_upc(payload.get("upc", ""), include_raw=wants_raw(options)), options)))
 
-final_output = {
-    "title": result.get('title'),
-    "description": result.get('description'),
-    "price": result.get('price'),
-    "lowest_price": result.get('lowest_price_upc', result.get('price')),
-    "highest_price": result.get('highest_price_upc', result.get('price')),
-    "images": result.get('images'),
-    "raw_data": raw_upc_data
-}
-print(json.dumps(final_output))
\ No newline at end of file
+if __name__ == "__main__":
+    main()